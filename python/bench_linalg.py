@@ -0,0 +1,517 @@
+"""
+Benchmarks for linalg.
+
+Times construction, arithmetic, reductions and coordinate helpers of the
+Vector family and reports the best time per call. Results can be written
+as JSON and compared against a saved baseline to catch regressions:
+
+    python bench_linalg.py                      # run and print timings
+    python bench_linalg.py --output run.json    # also write them as JSON
+    python bench_linalg.py --save-baseline      # replace the baseline file
+    python bench_linalg.py --compare            # flag regressions, exit 1
+    python bench_linalg.py --filter add --sizes 2 1000
+    python bench_linalg.py --fast-vectors       # FastVector vs Vector report
+    python bench_linalg.py --startup            # import time per backend
+"""
+import argparse
+import json
+import math
+import os
+import pickle
+import platform
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+
+import numpy as np
+
+from linalg import Vector, CVector, Vector2D, Vector3D
+from linalg import Vector2DArray, Vector3DArray, FastVector2D, FastVector3D
+from linalg import Matrix3D
+import linalg
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, 'bench_linalg_baseline.json')
+SIZES = (2, 100, 10**4, 10**6, 10**7)
+# building from a list is a Python-level loop, keep it to smaller sizes
+MAX_LIST_SIZE = 10**6
+# batch operations on Vector2DArray/Vector3DArray
+BATCH_SIZES = (10**3, 10**6)
+# what a short-lived script does, timed in a fresh interpreter by --startup
+STARTUP_SCRIPT = ('import linalg\n'
+                  'u = linalg.Vector3D(1.0, 2.0, 3.0)\n'
+                  'v = linalg.Vector3D(4.0, 5.0, 6.0)\n'
+                  'abs(u.cross(v) + 2.0 * u)\n')
+
+_groups = []
+
+
+def group(fn):
+    """
+    Registers a generator of (name, callable) benchmark cases
+    """
+    _groups.append(fn)
+    return fn
+
+
+@group
+def construction(sizes):
+    for n in sizes:
+        arr = np.arange(n, dtype=float)
+        yield f'Vector(ndarray)[n={n}]', lambda: Vector(arr)
+        yield f'CVector(ndarray)[n={n}]', lambda: CVector(arr)
+        if n <= MAX_LIST_SIZE:
+            lst = arr.tolist()
+            yield f'Vector(list)[n={n}]', lambda: Vector(lst)
+            yield f'CVector(list)[n={n}]', lambda: CVector(lst)
+    yield 'Vector2D(x, y)', lambda: Vector2D(3.0, 4.0)
+    yield 'Vector2D(ndarray)', lambda: Vector2D(np.array([3.0, 4.0]))
+    yield 'Vector3D(x, y, z)', lambda: Vector3D(2.0, 3.0, 4.0)
+    yield 'Vector3D(ndarray)', lambda: Vector3D(np.array([2.0, 3.0, 4.0]))
+
+
+def _operators(name, u, v):
+    yield f'{name}.__add__', lambda: u + v
+    yield f'{name}.__sub__', lambda: u - v
+    yield f'{name}.__mul__', lambda: u * v
+    yield f'{name}.__truediv__', lambda: u / v
+    yield f'{name}.__neg__', lambda: -u
+    yield f'{name}.__rmul__', lambda: 2.0 * u
+    yield f'{name}.__add__(scalar)', lambda: u + 1.0
+    yield f'{name}.__iadd__', lambda: u.__iadd__(v)
+    yield f'{name}.__imul__', lambda: u.__imul__(1.0)
+    yield f'{name}.axpy', lambda: u.axpy(0.5, v)
+
+
+@group
+def arithmetic(sizes):
+    for n in sizes:
+        u = Vector(np.arange(1, n + 1, dtype=float))
+        v = Vector(np.arange(n, 0, -1, dtype=float))
+        for (name, fn) in _operators('Vector', u, v):
+            yield f'{name}[n={n}]', fn
+        cu = CVector(u.data*1j)
+        cv = CVector(v.data*1j)
+        for (name, fn) in _operators('CVector', cu, cv):
+            yield f'{name}[n={n}]', fn
+    yield from _operators('Vector2D', Vector2D(3.0, 4.0), Vector2D(-1.0, 2.0))
+    yield from _operators('Vector3D', Vector3D(2.0, 3.0, 4.0),
+                          Vector3D(-1.0, 2.0, 0.5))
+
+
+@group
+def expressions(sizes):
+    for n in sizes:
+        a, b, c, d = (Vector(np.linspace(1, 2, n) + i) for i in range(4))
+        yield f'eager a*2+b-c/d[n={n}]', lambda: a * 2.0 + b - c / d
+        yield (f'lazy a*2+b-c/d[n={n}]',
+               lambda: (a.expr * 2.0 + b - c / d).eval())
+
+
+@group
+def reductions(sizes):
+    for n in sizes:
+        u = Vector(np.linspace(-1, 1, n))
+        v = Vector(np.linspace(1, -1, n))
+        yield f'Vector.dot[n={n}]', lambda: u.dot(v)
+        yield f'Vector.__abs__[n={n}]', lambda: abs(u)
+        cu = CVector(u.data*1j)
+        yield f'CVector.dot[n={n}]', lambda: cu.dot(cu)
+        yield f'CVector.__abs__[n={n}]', lambda: abs(cu)
+        yield f'CVector.CC[n={n}]', lambda: cu.CC()
+        yield f'CVector.conj cached[n={n}]', lambda: cu.conj
+    rng = np.random.default_rng(0)
+    for n in (2**16,):
+        signals = [CVector(rng.normal(size=n) + 1j*rng.normal(size=n))
+                   for i in range(64)]
+        yield (f'CVector.dot loop[64 x n={n}]',
+               lambda: [s.dot(s) for s in signals])
+        yield (f'CVector.batch_dot[64 x n={n}]',
+               lambda: CVector.batch_dot(signals, signals))
+        yield (f'CVector.batch_norm[64 x n={n}]',
+               lambda: CVector.batch_norm(signals))
+    short = rng.normal(size=(10**4, 16)) + 1j*rng.normal(size=(10**4, 16))
+    yield 'CVector.batch_dot[10000 x n=16]', lambda: CVector.batch_dot(short, short)
+    yield 'CVector.batch_norm[10000 x n=16]', lambda: CVector.batch_norm(short)
+    u, v = Vector2D(3.0, 4.0), Vector2D(-1.0, 2.0)
+    yield 'Vector2D.dot', lambda: u.dot(v)
+    yield 'Vector2D.__abs__', lambda: abs(u)
+    u, v = Vector3D(2.0, 3.0, 4.0), Vector3D(-1.0, 2.0, 0.5)
+    yield 'Vector3D.dot', lambda: u.dot(v)
+    yield 'Vector3D.__abs__', lambda: abs(u)
+    yield 'Vector3D.cross', lambda: u.cross(v)
+
+
+def _random_array(cls, n):
+    return cls(np.random.default_rng(0).standard_normal((n, cls.dim)))
+
+
+@group
+def angles(sizes):
+    u, v = Vector2D(3.0, 4.0), Vector2D(-1.0, 2.0)
+    yield 'Vector2D.angle', lambda: u.angle()
+    yield 'Vector2D.angle_between', lambda: Vector2D.angle_between(u, v)
+    yield 'Vector2D.create_from_angle', \
+        lambda: Vector2D.create_from_angle(math.pi/6, 2.0)
+    for n in BATCH_SIZES:
+        a = _random_array(Vector2DArray, n)
+        b = _random_array(Vector2DArray, n)[::-1]
+        yield f'Vector2DArray.angle[n={n}]', lambda: a.angle()
+        yield f'Vector2DArray.angle_between[n={n}]', \
+            lambda: Vector2DArray.angle_between(a, b)
+
+
+@group
+def coordinates(sizes):
+    u = Vector3D(2.0, 3.0, 4.0)
+    yield 'Vector3D.getSphericalCoords', lambda: u.getSphericalCoords()
+    yield 'Vector3D.getCylindricalCoords', lambda: u.getCylindricalCoords()
+    yield 'Vector3D.createSpherical', \
+        lambda: Vector3D.createSpherical(2.0, 0.5, 1.0)
+    yield 'Vector3D.createCylindrical', \
+        lambda: Vector3D.createCylindrical(2.0, 0.5, 1.0)
+    for n in BATCH_SIZES:
+        a = _random_array(Vector3DArray, n)
+        r, theta, phi = a.getSphericalCoords()
+        yield f'Vector3DArray.getSphericalCoords[n={n}]', \
+            lambda: a.getSphericalCoords()
+        yield f'Vector3DArray.getCylindricalCoords[n={n}]', \
+            lambda: a.getCylindricalCoords()
+        yield f'Vector3DArray.createSpherical[n={n}]', \
+            lambda: Vector3DArray.createSpherical(r, theta, phi)
+        yield f'Vector3DArray.cross[n={n}]', lambda: a.cross(a)
+
+
+def _small_vector_cases(cls2, cls3):
+    u, v = cls2(3.0, 4.0), cls2(-1.0, 2.0)
+    yield 'construct 2D', lambda: cls2(3.0, 4.0)
+    yield '2D __add__', lambda: u + v
+    yield '2D __mul__(scalar)', lambda: u * 2.0
+    yield '2D __iadd__', lambda: u.__iadd__(v)
+    yield '2D dot', lambda: u.dot(v)
+    yield '2D __abs__', lambda: abs(u)
+    yield '2D angle', lambda: u.angle()
+    yield '2D angle_between', lambda: cls2.angle_between(u, v)
+    u, v = cls3(2.0, 3.0, 4.0), cls3(-1.0, 2.0, 0.5)
+    yield 'construct 3D', lambda: cls3(2.0, 3.0, 4.0)
+    yield '3D __add__', lambda: u + v
+    yield '3D __sub__', lambda: u - v
+    yield '3D __mul__(scalar)', lambda: u * 2.0
+    yield '3D cross', lambda: u.cross(v)
+    yield '3D __abs__', lambda: abs(u)
+    yield '3D getSphericalCoords', lambda: u.getSphericalCoords()
+    yield '3D createCylindrical', lambda: cls3.createCylindrical(2.0, 0.5, 1.0)
+
+
+@group
+def matrices(sizes):
+    m = Matrix3D.rotation(0.5, (1.0, 2.0, 3.0)) @ Matrix3D.translation(1, 2, 3)
+    u = Vector3D(2.0, 3.0, 4.0)
+    yield 'Matrix3D @ Matrix3D', lambda: m @ m
+    yield 'Matrix3D @ Vector3D', lambda: m @ u
+    for n in BATCH_SIZES:
+        points = Vector3DArray(np.random.default_rng(0).uniform(-1, 1, (n, 3)))
+        yield f'Matrix3D @ Vector3DArray[n={n}]', lambda: m @ points
+        if n <= 10**3:
+            yield (f'Matrix3D @ Vector3D loop[n={n}]',
+                   lambda: [m @ p for p in points])
+
+
+@group
+def pairwise(sizes):
+    rng = np.random.default_rng(0)
+    for n in (200, 5000):
+        vectors = [Vector(row) for row in rng.normal(size=(n, 64))]
+        if n <= 200:
+            yield (f'abs(u - v) loop[n={n}]',
+                   lambda: [[abs(u - v) for v in vectors] for u in vectors])
+        yield (f'pairwise_distances[n={n}]',
+               lambda: linalg.pairwise_distances(vectors))
+        yield (f'cosine_similarity[n={n}]',
+               lambda: linalg.cosine_similarity(vectors))
+    corpus = rng.normal(size=(10**5, 64))
+    queries = corpus[:100]
+    yield ('top_k_nearest[q=100, n=100000, k=10]',
+           lambda: linalg.top_k_nearest(queries, corpus, 10))
+
+
+@group
+def spatial(sizes):
+    rng = np.random.default_rng(0)
+    for n in BATCH_SIZES:
+        points = rng.uniform(0, 100, (n, 3))
+        tree = linalg.KDTree(points)
+        q = points[n // 2] + 0.5
+        if n <= 10**3:
+            vectors = [Vector3D(*p) for p in points]
+            u = Vector3D(*q)
+            yield (f'nearest abs(u - v) loop[n={n}]',
+                   lambda: min(range(n), key=lambda i: abs(vectors[i] - u)))
+        yield (f'nearest brute force numpy[n={n}]',
+               lambda: np.argmin(((points - q)**2).sum(axis=1)))
+        yield f'KDTree build[n={n}]', lambda: linalg.KDTree(points)
+        yield f'KDTree.nearest k=10[n={n}]', lambda: tree.nearest(q, 10)
+        yield (f'KDTree.within_radius r=5[n={n}]',
+               lambda: tree.within_radius(q, 5.0))
+        yield (f'KDTree.within_box[n={n}]',
+               lambda: tree.within_box(q - 5, q + 5))
+        yield (f'KDTree.update + nearest[n={n}]',
+               lambda: (tree.update(7, rng.uniform(0, 100, 3)),
+                        tree.nearest(q, 10)))
+
+
+@group
+def parallel(sizes):
+    for n in sizes:
+        if n < 10**6:
+            continue
+        u = Vector(np.linspace(-1, 1, n))
+        v = Vector(np.linspace(1, 2, n))
+        for workers in (0, os.cpu_count()):
+            linalg.set_parallel(workers)
+            mode = f'{workers} threads' if workers else 'serial'
+            yield f'Vector.__add__ {mode}[n={n}]', lambda: u + v
+            yield f'Vector.__iadd__ {mode}[n={n}]', lambda: u.__iadd__(v)
+            yield f'Vector.dot {mode}[n={n}]', lambda: u.dot(v)
+        linalg.set_parallel(0)
+
+
+@group
+def pickling(sizes):
+    for n in sizes:
+        v = Vector(np.linspace(0, 1, n))
+        yield (f'pickle Vector protocol 4[n={n}]',
+               lambda: pickle.loads(pickle.dumps(v, 4)))
+        yield (f'pickle Vector protocol 5 out-of-band[n={n}]',
+               lambda: _out_of_band_roundtrip(v))
+    shared = linalg.SharedArray.from_array(np.linspace(0, 1, max(sizes)))
+    v = shared.vector()
+    yield (f'pickle shared Vector[n={max(sizes)}]',
+           lambda: pickle.loads(pickle.dumps(v)))
+    del v
+    shared.close()
+    shared.unlink()
+
+
+def _out_of_band_roundtrip(v):
+    buffers = []
+    data = pickle.dumps(v, 5, buffer_callback=buffers.append)
+    return pickle.loads(data, buffers=buffers)
+
+
+@group
+def statistics(sizes):
+    vectors = [Vector3D(1.0, 2.0, 3.0), Vector3D(-4.0, 0.5, 2.0)]
+    stats = linalg.VectorStats()
+    yield 'VectorStats add Vector3D', lambda: [stats.add(v) for v in vectors]
+    for n in sizes:
+        if n < 100:
+            continue
+        arr = Vector3DArray(np.random.default_rng(0).normal(size=(n, 3)))
+        yield (f'VectorStats add_batch[n={n}]',
+               lambda: linalg.VectorStats().add_batch(arr))
+        yield (f'VectorStats add_batch covariance[n={n}]',
+               lambda: linalg.VectorStats(covariance=True).add_batch(arr))
+
+
+@group
+def backends(sizes):
+    # cases are measured as they are yielded, so the python backend stays
+    # selected for all of them
+    previous = linalg.get_backend()
+    linalg.set_backend('python')
+    try:
+        for (name, fn) in _small_vector_cases(Vector2D, Vector3D):
+            yield f'python backend {name}', fn
+    finally:
+        linalg.set_backend(previous)
+
+
+@group
+def fast_vectors(sizes):
+    for (name, fn) in _small_vector_cases(FastVector2D, FastVector3D):
+        yield f'FastVector {name}', fn
+
+
+def memory_per_instance(factory, n=10000):
+    """
+    Returns the bytes allocated per object created by factory()
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [factory() for _ in range(n)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # don't count the list holding them
+    return (after - before - sys.getsizeof(objects)) / n
+
+
+def fast_vector_report(repeat, out=sys.stdout):
+    """
+    Prints memory per instance and ops/sec of FastVector2D/FastVector3D
+    next to Vector2D/Vector3D
+    """
+    print(f'{"bytes per instance":<28} {"Vector":>12} {"FastVector":>12}',
+          file=out)
+    for (name, slow, fast) in (
+            ('2D', lambda: Vector2D(3.0, 4.0), lambda: FastVector2D(3.0, 4.0)),
+            ('3D', lambda: Vector3D(2.0, 3.0, 4.0),
+             lambda: FastVector3D(2.0, 3.0, 4.0))):
+        print(f'{name:<28} {memory_per_instance(slow):>12.0f} '
+              f'{memory_per_instance(fast):>12.0f}', file=out)
+    print(f'\n{"ops/sec":<28} {"Vector":>12} {"FastVector":>12} '
+          f'{"speedup":>8}', file=out)
+    for ((name, slow), (_, fast)) in zip(
+            _small_vector_cases(Vector2D, Vector3D),
+            _small_vector_cases(FastVector2D, FastVector3D)):
+        slow, fast = measure(slow, repeat), measure(fast, repeat)
+        print(f'{name:<28} {1/slow:>12,.0f} {1/fast:>12,.0f} '
+              f'{slow/fast:>7.1f}x', file=out)
+
+
+def startup_time(backend, repeat):
+    """
+    Returns the best wall time in seconds of a fresh interpreter running
+    STARTUP_SCRIPT with the given backend, or an empty one if None
+    """
+    script = 'pass' if backend is None else STARTUP_SCRIPT
+    env = dict(os.environ, LINALG_BACKEND=backend or 'numpy')
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', script], cwd=HERE, env=env,
+                       check=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def startup_report(repeat, out=sys.stdout):
+    """
+    Prints how long a script importing linalg and doing a few 3D vector
+    operations takes with each backend, and over a bare interpreter
+    """
+    bare = startup_time(None, repeat)
+    print(f'{"startup":<28} {"total":>12} {"over python":>12}', file=out)
+    print(f'{"bare interpreter":<28} {format_time(bare):>12}', file=out)
+    for backend in ('numpy', 'python'):
+        total = startup_time(backend, repeat)
+        print(f'{backend + " backend":<28} {format_time(total):>12} '
+              f'{format_time(total - bare):>12}', file=out)
+
+
+def measure(fn, repeat):
+    """
+    Returns the best time per call of fn in seconds
+    """
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def run(sizes, pattern=None, repeat=5, out=sys.stdout):
+    results = {}
+    for fn in _groups:
+        for (name, case) in fn(sizes):
+            if pattern and pattern not in name:
+                continue
+            results[name] = measure(case, repeat)
+            print(f'{name:<50} {format_time(results[name]):>12}', file=out)
+    return results
+
+
+def format_time(seconds):
+    for (unit, scale) in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f'{seconds/scale:.3f} {unit}'
+    return f'{seconds/1e-9:.1f} ns'
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns the names of benchmarks more than threshold (a fraction)
+    slower than the baseline and of those missing from the baseline,
+    printing every benchmark's ratio
+    """
+    regressions = []
+    missing = []
+    for name in sorted(results):
+        if name not in baseline:
+            missing.append(name)
+            print(f'{name:<50} {"no baseline":>12} '
+                  f'-> {format_time(results[name]):>12}')
+            continue
+        ratio = results[name] / baseline[name]
+        flag = ''
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f'{name:<50} {format_time(baseline[name]):>12} '
+              f'-> {format_time(results[name]):>12} {ratio:6.2f}x{flag}')
+    return regressions, missing
+
+
+def metadata():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                        help='vector lengths for the size-dependent cases')
+    parser.add_argument('--filter', dest='pattern',
+                        help='only run benchmarks whose name contains this')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--baseline', default=BASELINE,
+                        help='baseline JSON file (default: %(default)s)')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='write results to the baseline file')
+    parser.add_argument('--compare', action='store_true',
+                        help='compare against the baseline file')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='slowdown fraction flagged as a regression')
+    parser.add_argument('--fast-vectors', action='store_true',
+                        help='only compare FastVector2D/3D with Vector2D/3D')
+    parser.add_argument('--startup', action='store_true',
+                        help='only time importing linalg with each backend')
+    args = parser.parse_args(argv)
+
+    if args.fast_vectors:
+        fast_vector_report(args.repeat)
+        return 0
+    if args.startup:
+        startup_report(args.repeat)
+        return 0
+
+    results = run(args.sizes, args.pattern, args.repeat)
+    report = {'meta': metadata(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        print()
+        (regressions, missing) = compare(results, baseline, args.threshold)
+        if missing:
+            print(f'\n{len(missing)} benchmark(s) missing from the baseline, '
+                  f'update it with --save-baseline', file=sys.stderr)
+        if regressions:
+            print(f'\n{len(regressions)} regression(s) over '
+                  f'{args.threshold:.0%}', file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
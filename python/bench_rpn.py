@@ -0,0 +1,100 @@
+"""
+Benchmarks for the RPN compiler's operator fusion and constant folding.
+
+Builds large synthetic formulas shaped like generated ones (a run of
+literal-only steps, e.g. unit conversion factors, then steps mixing
+variables and literals) and times compiling and calling them with and
+without optimize, printing how many operations were folded:
+
+    python bench_rpn.py
+    python bench_rpn.py --steps 100 10000 --literals 0.7
+"""
+import argparse
+import random
+import sys
+import timeit
+
+import numpy as np
+
+import rpn
+
+VARIABLES = ('a', 'b', 'c', 'd')
+
+
+def synthetic(steps, literals, seed=0):
+    """
+    Returns an expression of steps operators, the first quarter of them on
+    literals only and the rest with each operand a literal with
+    probability literals
+    """
+    rng = random.Random(seed)
+    tokens = []
+    for i in range(steps):
+        constant = i < steps // 4
+        for _ in range(rng.randint(1 if tokens else 2, 3)):
+            if constant or rng.random() < literals:
+                # no zeros, so that nothing fails to fold
+                tokens.append(str(rng.randint(1, 9)))
+            else:
+                tokens.append(rng.choice(VARIABLES))
+        tokens.append(rng.choice(('+', '-', 'x', '/')))
+    return ' '.join(tokens)
+
+
+def measure(fn, repeat):
+    """
+    Returns the best time per call of fn in seconds
+    """
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def format_time(seconds):
+    for (unit, scale) in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f'{seconds/scale:.3f} {unit}'
+    return f'{seconds/1e-9:.1f} ns'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--steps', type=int, nargs='+', default=(100, 1000),
+                        help='operators per expression')
+    parser.add_argument('--literals', type=float, default=0.5,
+                        help='fraction of literal operands after the '
+                             'literal-only run')
+    parser.add_argument('--size', type=int, default=10**5,
+                        help='length of the array inputs')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    scalars = dict(zip(VARIABLES, (1.5, -2.25, 3.0, 0.75)))
+    rng = np.random.default_rng(0)
+    arrays = {v: rng.uniform(1, 2, args.size) for v in VARIABLES}
+    for steps in args.steps:
+        expr = synthetic(steps, args.literals)
+        (plain, folded) = (rpn.Program(expr, False), rpn.Program(expr))
+        stats = folded.stats
+        print(f'{steps} steps: {stats["fusedSteps"]} fused, '
+              f'{stats["operations"]} operations, '
+              f'{stats["foldedOperations"]} folded '
+              f'({stats["foldedSteps"]} whole steps), {stats["literals"]} '
+              f'literals in {stats["constants"]} constants')
+        used = {v: scalars[v] for v in folded.variables}
+        assert repr(plain(**used)) == repr(folded(**used))
+        for (name, fn) in (
+                ('compile', lambda o: lambda: rpn.Program(expr, o)),
+                ('call(scalars)', lambda o: lambda: program[o](**used)),
+                (f'call(arrays[{args.size}])',
+                 lambda o: lambda: program[o](**{v: arrays[v] for v in used}))):
+            program = {False: plain, True: folded}
+            (before, after) = (measure(fn(False), args.repeat),
+                               measure(fn(True), args.repeat))
+            print(f'  {name:<24} {format_time(before):>12} -> '
+                  f'{format_time(after):>12} {before / after:6.2f}x')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
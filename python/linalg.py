@@ -1,27 +1,556 @@
-import numpy as np
+import array
+import importlib
+import operator
+import os
+import weakref
+from collections.abc import Iterator
 from numbers import Number
 import math
+import heapq
+
+
+class _LazyModule:
+    """
+    Stands in for a module until one of its attributes is first used, then
+    imports it and takes its place in this module's globals. Code that never
+    needs NumPy (e.g. the python backend) never pays for importing it.
+    """
+    def __init__(self, name, alias):
+        self._name = name
+        self._alias = alias
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._name)
+        globals()[self._alias] = module
+        return getattr(module, attr)
+
+
+np = _LazyModule('numpy', 'np')
+
+
+# dtype kinds accepted without per-element validation
+_NUMERIC_KINDS = 'biufc'
+# elements per block when streaming large (e.g. memory-mapped) vectors
+_CHUNK_SIZE = 1 << 20
+# elements per block of a lazy expression, small enough that the
+# intermediate buffers of a whole expression stay in cache
+_LAZY_CHUNK_SIZE = 1 << 14
+# elements of a pairwise distance/similarity block computed at once, and
+# corpus vectors per block when searching for nearest neighbours
+_TILE_SIZE = 1 << 22
+_TILE_COLUMNS = 1 << 12
+# vectors at least this long are reduced one BLAS call each in batches,
+# shorter ones are stacked and reduced together
+_BATCH_ROW_SIZE = 256
+# thread pool and elements per task of the parallel mode, see set_parallel()
+_executor = None
+_PARALLEL_CHUNK_SIZE = 1 << 20
+# vectors at least this long are run on the thread pool: two chunks in
+# parallel mode, none otherwise
+_parallel_size = math.inf
+
+
+def _chunks(n):
+    """
+    Yields slices covering range(n) in blocks of _CHUNK_SIZE elements
+    """
+    for start in range(0, n, _CHUNK_SIZE):
+        yield slice(start, min(start + _CHUNK_SIZE, n))
+
+
+def set_parallel(workers=None, chunk_size=None):
+    """
+    Enables multi-threaded execution of vector arithmetic, dot products and
+    norms: vectors of at least two chunks of chunk_size elements are split
+    into chunks processed by a pool of workers threads (os.cpu_count() if
+    None), which run concurrently as NumPy releases the GIL. workers=0
+    disables it again.
+
+    Reductions add the per-chunk partial sums with math.fsum, so results
+    depend on the chunk size but not on the number of workers.
+    """
+    global _executor, _PARALLEL_CHUNK_SIZE, _parallel_size
+    if chunk_size is not None:
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be at least 1')
+        _PARALLEL_CHUNK_SIZE = chunk_size
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+        _parallel_size = math.inf
+    if workers != 0:
+        from concurrent.futures import ThreadPoolExecutor
+
+        _executor = ThreadPoolExecutor(max_workers=workers,
+                                       thread_name_prefix='linalg')
+        _parallel_size = 2 * _PARALLEL_CHUNK_SIZE
+
+
+def _parallel_chunks(n):
+    """
+    Returns the slices to run on the thread pool for arrays of length n, or
+    None to run in the calling thread
+    """
+    if n < _parallel_size:
+        return None
+    step = _PARALLEL_CHUNK_SIZE
+    return [slice(start, min(start + step, n)) for start in range(0, n, step)]
+
+
+def _apply(ufunc, n, *args, out=None):
+    """
+    Returns ufunc(*args, out=out) for 1D arrays of length n and scalars,
+    run chunk by chunk on the thread pool. Callers check n against
+    _parallel_size first, so vectors too short for it never get here.
+    """
+    chunks = _parallel_chunks(n)
+
+    def part(s):
+        return tuple(a[s] if np.ndim(a) == 1 else a for a in args)
+
+    # dtype of the result, and any casting error for out, before any work
+    empty = ufunc(*part(slice(0, 0)), out=None if out is None else out[:0])
+    if out is None:
+        out = np.empty(n, dtype=empty.dtype)
+    for _ in _executor.map(lambda s: ufunc(*part(s), out=out[s]), chunks):
+        pass
+    return out
+
+
+def _fsum(partials):
+    """
+    Adds partial sums exactly rounded, independent of their order
+    """
+    dtype = np.result_type(*partials)
+    if dtype.kind in 'biu':
+        return sum(partials)
+    elif dtype.kind == 'c':
+        return dtype.type(complex(math.fsum(p.real for p in partials),
+                                  math.fsum(p.imag for p in partials)))
+    return dtype.type(math.fsum(partials))
+
+
+def _vdot(a, b):
+    """
+    Returns the Hermitian inner product sum(conj(a)*b) with np.vdot, which
+    conjugates inside the BLAS call instead of building conj(a)
+    """
+    if len(a) != len(b):
+        raise ValueError("Vectors must be same length")
+    if len(a) >= _parallel_size:
+        return _fsum(list(_executor.map(lambda s: np.vdot(a[s], b[s]),
+                                        _parallel_chunks(len(a)))))
+    if len(a) <= _CHUNK_SIZE:
+        return np.vdot(a, b)
+    return sum(np.vdot(a[s], b[s]) for s in _chunks(len(a)))
+
+
+def _real_view(arr):
+    """
+    Returns a complex array as a float array of its interleaved real and
+    imaginary parts, without copying when its last axis is contiguous
+    """
+    arr = np.asarray(arr)
+    if not arr.flags.c_contiguous:
+        arr = np.ascontiguousarray(arr)
+    return arr.view(arr.real.dtype)
+
+
+def _dot(a, b):
+    """
+    Returns sum(a*b). Long arrays are summed chunk by chunk so no full-length
+    temporary is allocated and memory-mapped data is read sequentially.
+    """
+    if len(a) >= _parallel_size and np.ndim(b) == 1:
+        if len(a) != len(b):
+            raise ValueError("Vectors must be same length")
+        return _fsum(list(_executor.map(lambda s: np.dot(a[s], b[s]),
+                                        _parallel_chunks(len(a)))))
+    if len(a) <= _CHUNK_SIZE:
+        return np.sum(a * b)
+    if len(a) != len(b):
+        raise ValueError("Vectors must be same length")
+    return sum(np.dot(a[s], b[s]) for s in _chunks(len(a)))
+
+
+def _numeric_array(data, dtype=None):
+    """
+    Returns a new array of data, which must be an array or an iterable of
+    numbers, converted to dtype if given. Sequences are converted in one
+    call and only inspected element by element if NumPy can't give them a
+    numeric dtype (e.g. Python ints too large for int64).
+    """
+    if isinstance(data, np.ndarray) and data.dtype.kind in _NUMERIC_KINDS:
+        # dtype already guarantees numeric elements; passing dtype=None is
+        # measurably slower than leaving it out
+        return np.array(data) if dtype is None else np.array(data, dtype)
+    try:
+        iter(data)
+    except TypeError as te:
+        raise TypeError('Invalid iterable data')
+    if not isinstance(data, (list, tuple, np.ndarray)):
+        data = list(data)
+
+    try:
+        arr = np.array(data)
+    except ValueError:
+        arr = None
+    if arr is None or arr.dtype.kind not in _NUMERIC_KINDS + 'O' \
+            or (arr.dtype.kind == 'O'
+                and not all(isinstance(x, Number) for x in data)):
+        raise ValueError('Invalid numeric data')
+    return arr if dtype is None else arr.astype(dtype, copy=False)
+
+
+# ufuncs of the operator functions Vector passes to its backend
+_UFUNC_NAMES = {operator.add: 'add', operator.sub: 'subtract',
+                operator.mul: 'multiply', operator.truediv: 'true_divide',
+                operator.floordiv: 'floor_divide', operator.pow: 'power',
+                operator.neg: 'negative'}
+# in-place versions of the operator functions, for ndarrays
+_INPLACE_OPS = {operator.add: operator.iadd, operator.sub: operator.isub,
+                operator.mul: operator.imul,
+                operator.truediv: operator.itruediv,
+                operator.floordiv: operator.ifloordiv,
+                operator.pow: operator.ipow}
+# ufuncs whose results Vector.__array_ufunc__ leaves as plain arrays
+_COMPARISON_UFUNCS = frozenset(('equal', 'not_equal', 'less', 'less_equal',
+                                'greater', 'greater_equal'))
+
+
+class _UfuncTable(dict):
+    """
+    Maps the operator functions to their ufuncs, each looked up once on
+    first use so that NumPy is still only imported when needed
+    """
+    def __missing__(self, op):
+        ufunc = self[op] = getattr(np, _UFUNC_NAMES[op])
+        return ufunc
+
+
+_UFUNCS = _UfuncTable()
+# dtypes the python backend can store
+_PYTHON_DTYPES = ('float', 'float64', 'double', 'd', 'f8', '<f8')
+
+
+class _NumpyBackend:
+    """
+    Stores vectors as 1D ndarrays of any numeric dtype and computes with
+    ufuncs, multi-threaded in parallel mode. The default backend.
+    """
+    name = 'numpy'
 
+    @staticmethod
+    def new(data, dtype=None):
+        if dtype is not None and np.dtype(dtype).kind not in _NUMERIC_KINDS:
+            raise ValueError(f'Invalid numeric dtype {dtype}')
+        arr = _numeric_array(data, dtype)
+        if arr.ndim != 1:
+            raise ValueError(f'Too many array dimensions ({arr.ndim})')
+        return arr
 
-'''
-Implements an N-dimensional column vector of real numbers.
-'''
-class Vector:
-    def __init__(self, data):
+    @staticmethod
+    def zeros(n, dtype=float):
+        return np.zeros(n, dtype=dtype)
+
+    @staticmethod
+    def operand(data, other):
+        """
+        Returns other as a scalar or an array of the same length as data.
+        ndarrays and buffer-protocol objects (array.array, memoryview, ...)
+        are wrapped without copying. Returns NotImplemented for VectorArrays
+        and types that set __array_ufunc__ = None, such as LazyExpr.
+        """
+        if isinstance(other, Vector):
+            return other.data
+        elif isinstance(other, Number):
+            return other
+        elif isinstance(other, VectorArray) \
+                or getattr(type(other), '__array_ufunc__', True) is None:
+            # NumPy's opt-out: let other's reflected operator handle it
+            return NotImplemented
+        if isinstance(other, Iterator):
+            other = list(other)
         try:
-            iter(data)
+            arr = np.asarray(other)
+        except (TypeError, ValueError) as e:
+            raise TypeError("Other must be a scalar "
+                            "or iterable of same length")
+        if arr.dtype.kind not in _NUMERIC_KINDS or arr.ndim > 1:
+            raise TypeError("Other must be a scalar "
+                            "or iterable of same length")
+        if arr.ndim == 1 and len(arr) != len(data):
+            raise ValueError("Incompatible lengths: expected "
+                             f"{len(data)} got {len(arr)}")
+        return arr
+
+    @staticmethod
+    def binary(op, a, b, reflected=False):
+        """
+        Returns op(a, b), or op(b, a) if reflected, for the data a of a
+        vector and a scalar or array of the same length b
+        """
+        ufunc = _UFUNCS[op]
+        if len(a) < _parallel_size:
+            return ufunc(b, a) if reflected else ufunc(a, b)
+        return _apply(ufunc, len(a), *((b, a) if reflected else (a, b)))
+
+    @staticmethod
+    def unary(op, a):
+        ufunc = _UFUNCS[op]
+        if len(a) < _parallel_size:
+            return ufunc(a)
+        return _apply(ufunc, len(a), a)
+
+    @staticmethod
+    def inplace(op, a, b):
+        """
+        Stores op(a, b) in a and returns it. Only when the result does not
+        fit a's dtype (e.g. dividing an integer vector) and a owns its data
+        is a new, promoted array returned instead.
+        """
+        ufunc = _UFUNCS[op]
+        try:
+            if len(a) < _parallel_size:
+                return ufunc(a, b, out=a)
+            return _apply(ufunc, len(a), a, b, out=a)
         except TypeError as te:
-            raise TypeError('Invalid iterable data')
+            # output casting error, the operands themselves are valid
+            if not a.flags.owndata:
+                raise
+            return ufunc(a, b)
 
-        if all(isinstance(x, Number) for x in data):
-            arr = np.array(data)
+    @staticmethod
+    def into(op, a, b, out):
+        ufunc = _UFUNCS[op]
+        if len(a) < _parallel_size:
+            ufunc(a, b, out=out)
         else:
+            _apply(ufunc, len(a), a, b, out=out)
+
+    @staticmethod
+    def dot(a, b):
+        return _dot(a, b)
+
+    @staticmethod
+    def sqrt(x):
+        return np.sqrt(x)
+
+    @staticmethod
+    def equal(a, b):
+        return all(a == b)
+
+    @staticmethod
+    def copy(a):
+        return a.copy()
+
+    @staticmethod
+    def cross(a, b):
+        return np.cross(a, b)
+
+    @staticmethod
+    def dtype(a):
+        return a.dtype
+
+    @staticmethod
+    def format(a):
+        return str(a)
+
+
+class _PythonBackend:
+    """
+    Stores vectors as array.array('d') and computes in pure Python, without
+    ever importing NumPy. Much slower per element, but for the few 2D/3D
+    vector operations of a short-lived script it saves the NumPy import and
+    the per-call overhead of ufuncs. Only float64 data is supported, and
+    arithmetic follows Python floats: dividing by zero raises
+    ZeroDivisionError instead of giving inf.
+    """
+    name = 'python'
+
+    @staticmethod
+    def new(data, dtype=None):
+        if dtype is not None \
+                and getattr(dtype, '__name__', dtype) not in _PYTHON_DTYPES:
+            raise ValueError(f'The python backend only stores float64, '
+                             f'not {dtype}')
+        try:
+            iter(data)
+        except TypeError as te:
+            raise TypeError('Invalid iterable data')
+        try:
+            return array.array('d', data)
+        except TypeError as te:
+            # nested sequences, strings, complex numbers, ...
             raise ValueError('Invalid numeric data')
 
-        if arr.ndim != 1:
-            raise ValueError(f'Too many array dimensions ({arr.ndim})')
+    @staticmethod
+    def zeros(n, dtype=float):
+        return _PythonBackend.new(bytes(8 * n), dtype)
+
+    @staticmethod
+    def operand(data, other):
+        """
+        Returns other as a number or a sequence of numbers of the same length
+        as data, or NotImplemented for VectorArrays and types that set
+        __array_ufunc__ = None
+        """
+        if isinstance(other, Vector):
+            other = other.data
+        elif isinstance(other, Number):
+            return other
+        elif isinstance(other, VectorArray) \
+                or getattr(type(other), '__array_ufunc__', True) is None:
+            return NotImplemented
+        elif type(other) is not array.array:
+            try:
+                other = list(other)
+            except TypeError as te:
+                raise TypeError("Other must be a scalar "
+                                "or iterable of same length")
+            if not all(isinstance(x, Number) for x in other):
+                raise TypeError("Other must be a scalar "
+                                "or iterable of same length")
+        if len(other) != len(data):
+            raise ValueError("Incompatible lengths: expected "
+                             f"{len(data)} got {len(other)}")
+        return other
+
+    @staticmethod
+    def binary(op, a, b, reflected=False):
+        if reflected:
+            (a, b) = (b, a)
+        if isinstance(b, Number):
+            return array.array('d', [op(x, b) for x in a])
+        elif isinstance(a, Number):
+            return array.array('d', [op(a, y) for y in b])
+        return array.array('d', map(op, a, b))
+
+    @staticmethod
+    def unary(op, a):
+        return array.array('d', map(op, a))
+
+    @staticmethod
+    def inplace(op, a, b):
+        a[:] = _PythonBackend.binary(op, a, b)
+        return a
+
+    @staticmethod
+    def into(op, a, b, out):
+        # slice assignment would resize out
+        if len(out) != len(a):
+            raise ValueError("Incompatible lengths: expected "
+                             f"{len(a)} got {len(out)}")
+        out[:] = _PythonBackend.binary(op, a, b)
+
+    @staticmethod
+    def dot(a, b):
+        # map() stops at the shorter one
+        if len(a) != len(b):
+            raise ValueError("Vectors must be same length")
+        return math.fsum(map(operator.mul, a, b))
+
+    @staticmethod
+    def sqrt(x):
+        return math.sqrt(x)
+
+    @staticmethod
+    def equal(a, b):
+        return len(a) == len(b) and all(map(operator.eq, a, b))
+
+    @staticmethod
+    def copy(a):
+        return array.array('d', a)
+
+    @staticmethod
+    def cross(a, b):
+        (ax, ay, az), (bx, by, bz) = a, b
+        return array.array('d', (ay*bz - az*by, az*bx - ax*bz, ax*by - ay*bx))
+
+    @staticmethod
+    def dtype(a):
+        return np.dtype(a.typecode)
+
+    @staticmethod
+    def format(a):
+        return str(a.tolist())
+
+
+_BACKENDS = {'numpy': _NumpyBackend, 'python': _PythonBackend}
+
+
+def _get_backend(name):
+    if name is None:
+        return _backend
+    try:
+        return _BACKENDS[name]
+    except KeyError as ke:
+        raise ValueError(f'Unknown backend {name!r}, expected one of '
+                         f'{sorted(_BACKENDS)}')
 
-        self.data = arr
+
+# backend of new vectors, unless a constructor is given one
+_backend = _get_backend(os.environ.get('LINALG_BACKEND', 'numpy'))
+
+
+def set_backend(name):
+    """
+    Selects the backend storing the vectors created from now on without an
+    explicit backend= argument: 'numpy' (the default, ndarrays) or 'python'
+    (array.array('d') and pure Python arithmetic, which does not import
+    NumPy). The LINALG_BACKEND environment variable sets it at import.
+    Existing vectors keep their backend, and the result of an operation has
+    the backend of its left operand.
+    """
+    global _backend
+    _backend = _get_backend(name)
+
+
+def get_backend():
+    """
+    Returns the name of the backend of new vectors, see set_backend()
+    """
+    return _backend.name
+
+
+'''
+Implements an N-dimensional column vector of real numbers.
+'''
+class Vector:
+    def __init__(self, data, dtype=None, backend=None):
+        impl = _backend if backend is None else _get_backend(backend)
+        self.data = impl.new(data, dtype)
+
+    @classmethod
+    def _from_array(cls, arr):
+        """
+        Wraps an already validated 1D ndarray (or array.array('d') of the
+        python backend) without copying or checking it. Used internally for
+        the results of vector operations.
+        """
+        vec = cls.__new__(cls)
+        vec.data = arr
+        return vec
+
+    @property
+    def _impl(self):
+        # the backend class is implied by the type of the data
+        if type(self.data) is array.array:
+            return _PythonBackend
+        return _NumpyBackend
+
+    '''
+    Returns the name of the backend storing the vector, see set_backend()
+    '''
+    @property
+    def backend(self):
+        return self._impl.name
+
+    '''
+    Returns a copy of the vector stored by the given backend
+    '''
+    def to_backend(self, backend):
+        return self._from_array(_get_backend(backend).new(self.data))
 
     def __iter__(self):
         return iter(self.data)
@@ -29,139 +558,371 @@ class Vector:
     def __getitem__(self, key):
         return self.data.__getitem__(key)
 
+    '''
+    Compares with a vector or a list and returns one bool. ndarrays and
+    other objects implementing __array_ufunc__ compare elementwise instead,
+    as in NumPy, and give the same boolean array on either side of ==, so
+    `if v == arr:` is ambiguous; use np.array_equal(v, arr) for one bool.
+    '''
     def __eq__(self, other):
         if isinstance(other, Vector):
-            return all(self.data == other.data)
+            return self._impl.equal(self.data, other.data)
         elif isinstance(other, list):
             if len(other) != len(self.data):
                 return False
             return all(x == y for (x, y) in zip(self.data, other))
+        elif getattr(type(other), '__array_ufunc__', None) is not None:
+            # ndarrays compare elementwise, with the same result whichever
+            # side the vector is on
+            return NotImplemented
         else:
             return False
 
+    def _operand(self, other):
+        """
+        Returns other as a scalar or a sequence of the same length as the
+        vector, in a form its backend computes with, or NotImplemented for
+        types that set __array_ufunc__ = None, such as LazyExpr
+        """
+        return self._impl.operand(self.data, other)
+
+    def _binary(self, op, other, reflected=False):
+        data = self.data
+        if type(data) is not array.array \
+                and (_executor is None or len(data) < _parallel_size):
+            # the default NumPy backend with ndarray's own operators (the
+            # same ufuncs), as call overhead dominates for small vectors
+            if isinstance(other, Vector):
+                other = other.data
+            elif not isinstance(other, Number):
+                other = _NumpyBackend.operand(data, other)
+                if other is NotImplemented:
+                    return NotImplemented
+            return self._from_array(op(other, data) if reflected
+                                    else op(data, other))
+        impl = self._impl
+        other = impl.operand(data, other)
+        if other is NotImplemented:
+            return NotImplemented
+        return self._from_array(impl.binary(op, data, other, reflected))
+
     '''
     Returns addition of vector with a scalar or vector of same length
     '''
     def __add__(self, other):
-        if isinstance(other, Vector):
-            if self.data.ndim != other.data.ndim:
-                raise ValueError('Incompatible vector dimensions')
-            return Vector(self.data + other.data)
-        elif isinstance(other, Number):
-            return Vector(self.data + other)
-        else:
-            try:
-                return Vector(x + y for (x, y) in zip(self.data, other))
-            except TypeError as te:
-                raise TypeError("Other must be a scalar "
-                                "or iterable of same length")
+        return self._binary(operator.add, other)
 
     '''
-    Returns addition of vector with a scalar or vector of same length
+    Returns subtraction of a scalar or vector of same length from vector
     '''
     def __sub__(self, other):
-        if isinstance(other, Vector):
-            if self.data.ndim != other.data.ndim:
-                raise ValueError('Incompatible vector dimensions')
-            return Vector(self.data - other.data)
-        elif isinstance(other, Number):
-            return Vector(self.data - other)
-        else:
-            try:
-                return Vector(x - y for (x, y) in zip(self.data, other))
-            except TypeError as te:
-                raise TypeError("Other must be a scalar "
-                                "or iterable of same length")
+        return self._binary(operator.sub, other)
 
     def __neg__(self):
-        return Vector(-self.data)
+        data = self.data
+        if type(data) is not array.array \
+                and (_executor is None or len(data) < _parallel_size):
+            return self._from_array(-data)
+        return self._from_array(self._impl.unary(operator.neg, data))
 
     '''
     Returns scalar or elementwise multiplication of vector
     '''
     def __mul__(self, other):
-        if isinstance(other, Number):
-            return Vector(other * self.data)
-        elif isinstance(other, Vector):
-            if self.data.ndim != other.data.ndim:
-                raise TypeError('Incompatible vector dimensions')
-            return Vector(self.data * other.data)
-        else:
-            try:
-                return Vector(x * y for (x, y) in zip(self.data, other))
-            except TypeError as te:
-                raise TypeError("Other must be a scalar "
-                                "or iterable of same length")
+        return self._binary(operator.mul, other)
 
     '''
     Returns scalar or elementwise division of vector
     '''
     def __truediv__(self, other):
-        if isinstance(other, Number):
-            return Vector(self.data/other)
-        if isinstance(other, Vector):
-            if self.data.ndim != other.data.ndim:
-                raise TypeError('Incompatible vector dimensions')
-            return Vector(self.data/other.data)
+        return self._binary(operator.truediv, other)
+
+    '''
+    Returns scalar or elementwise floor division of vector
+    '''
+    def __floordiv__(self, other):
+        return self._binary(operator.floordiv, other)
+
+    '''
+    Returns scalar or elementwise power of vector
+    '''
+    def __pow__(self, other):
+        return self._binary(operator.pow, other)
 
     def __rmul__(self, other):
-        if isinstance(other, Number):
-            return Vector(other * self.data)
-        else:
-            try:
-                return Vector(x*y for (x,y) in zip(self.data, other))
-            except TypeError as te:
-                raise TypeError("Other must be a scalar or iterable of same length")
+        return self._binary(operator.mul, other, reflected=True)
 
     '''
     Returns vector dot product
     '''
     def dot(self, other):
         if isinstance(other, Vector):
-            if self.data.ndim != other.data.ndim:
-                raise ValueError("Vectors must be same length")
-            return np.sum(self.data * other.data)
+            other = other.data
+            if len(other) != len(self.data):
+                raise ValueError("Incompatible lengths: expected "
+                                 f"{len(self.data)} got {len(other)}")
         else:
-            try:
-                if len(other) != self.data.ndim:
-                    raise ValueError("Incompatible lengths: expected "
-                                    "{self.data.ndim} got {len(other)}")
-                return sum(x * y for (x, y) in zip(self.data, other))
-            except TypeError as te:
+            other = self._operand(other)
+            if isinstance(other, Number) or other is NotImplemented:
                 raise TypeError("Other must be iterable of same length")
+        return self._impl.dot(self.data, other)
+
+    def __array__(self, dtype=None, copy=None):
+        if copy:
+            return np.array(self.data, dtype=dtype)
+        return np.asarray(self.data, dtype=dtype)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, out=None, **kwargs):
+        """
+        Runs NumPy ufuncs on vectors (np.sqrt(v), np.add(v, w, out=v), or
+        ndarray + v) directly on the underlying buffers. Results are
+        wrapped like the first vector operand. Comparisons give plain
+        boolean arrays, not vectors.
+        """
+        for x in inputs + (out or ()):
+            if not isinstance(x, (Vector, np.ndarray)) \
+                    and hasattr(type(x), '__array_ufunc__'):
+                return NotImplemented
+
+        like = next(x for x in inputs + (out or ()) if isinstance(x, Vector))
+        inputs = tuple(x.data if isinstance(x, Vector) else x for x in inputs)
+        if out is not None:
+            kwargs['out'] = tuple(x.data if isinstance(x, Vector) else x
+                                  for x in out)
+
+        result = getattr(ufunc, method)(*inputs, **kwargs)
+        if ufunc.__name__ in _COMPARISON_UFUNCS and out is None:
+            return result
+        if out is not None:
+            for x in out:
+                if isinstance(x, Vector):
+                    x._modified()
+            return out[0] if len(out) == 1 else out
+        if isinstance(result, tuple):
+            return tuple(like._wrap(x) for x in result)
+        return like._wrap(result)
+
+    def _wrap(self, result):
+        """
+        Wraps a NumPy result as the same type of vector when it is still a
+        vector of the same length, or a plain Vector for other 1D results
+        """
+        if not isinstance(result, np.ndarray) or result.ndim != 1:
+            return result
+        if len(result) != len(self.data):
+            return Vector._from_array(result)
+        return self._from_array(result)
 
     '''
     Returns a deep copy of the vector
     '''
     def copy(self):
-        return Vector(self.data.copy())
+        return self._from_array(self._impl.copy(self.data))
 
     @staticmethod
-    def zeros(n):
-        return Vector(np.zeros(n))
+    def zeros(n, dtype=float, backend=None):
+        return Vector._from_array(_get_backend(backend).zeros(n, dtype))
 
-    def __iadd__(self, other):
-        if isinstance(other, Vector):
-            self.data += other.data
-            return self
-        elif isinstance(other, Number):
-            self.data += other
-            return self
+    @property
+    def dtype(self):
+        return self._impl.dtype(self.data)
+
+    '''
+    Returns a copy of the vector converted to dtype, stored by NumPy
+    '''
+    def astype(self, dtype):
+        return self._from_array(np.asarray(self.data).astype(dtype))
+
+    def __reduce_ex__(self, protocol):
+        return _reduce_data(self, protocol)
+
+    # copies never go through pickling, which would attach to the same
+    # shared memory block instead of copying it
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    '''
+    Returns a lazy expression of the vector, see LazyExpr
+    '''
+    @property
+    def expr(self):
+        return LazyExpr(None, self)
+
+    def _modified(self):
+        """
+        Called after the vector's methods change its data in place, for
+        subclasses that cache values derived from it
+        """
+
+    def _inplace(self, op, other):
+        """
+        Stores op(self, other) in the vector's own buffer. Only when the
+        result does not fit the current dtype (e.g. dividing an integer
+        vector) is the buffer replaced by a new, promoted one, and only if
+        the vector owns it: memory maps, shared blocks and rows of a
+        VectorArray raise NumPy's casting error instead of being cut off
+        from the data they view.
+        """
+        data = self.data
+        if type(data) is not array.array \
+                and (_executor is None or len(data) < _parallel_size):
+            # as in _binary
+            if isinstance(other, Vector):
+                other = other.data
+            elif not isinstance(other, Number):
+                other = _NumpyBackend.operand(data, other)
+            if other is NotImplemented:
+                raise TypeError("Other must be a scalar "
+                                "or iterable of same length")
+            try:
+                _INPLACE_OPS[op](data, other)
+            except TypeError as te:
+                # output casting error, the operands themselves are valid
+                if not data.flags.owndata:
+                    raise
+                self.data = op(data, other)
         else:
-            raise TypeError("Other must be a scalar or Vector")
+            impl = self._impl
+            other = impl.operand(data, other)
+            if other is NotImplemented:
+                raise TypeError("Other must be a scalar "
+                                "or iterable of same length")
+            self.data = impl.inplace(op, data, other)
+        self._modified()
+        return self
+
+    def __iadd__(self, other):
+        return self._inplace(operator.add, other)
 
     def __isub__(self, other):
-        if isinstance(other, Vector):
-            self.data -= other.data
-            return self
-        elif isinstance(other, Number):
-            self.data -= other
+        return self._inplace(operator.sub, other)
+
+    def __imul__(self, other):
+        return self._inplace(operator.mul, other)
+
+    def __itruediv__(self, other):
+        return self._inplace(operator.truediv, other)
+
+    def __ifloordiv__(self, other):
+        return self._inplace(operator.floordiv, other)
+
+    def __ipow__(self, other):
+        return self._inplace(operator.pow, other)
+
+    def _into(self, op, other, out):
+        if not isinstance(out, Vector):
+            raise TypeError("out must be a Vector")
+        impl = self._impl
+        other = impl.operand(self.data, other)
+        if other is NotImplemented:
+            raise TypeError("Other must be a scalar or iterable of same length")
+        impl.into(op, self.data, other, out.data)
+        out._modified()
+        return out
+
+    '''
+    Stores self + other in out, an existing vector of the same length, and
+    returns out. out may be self.
+    '''
+    def add_into(self, other, out):
+        return self._into(operator.add, other, out)
+
+    '''
+    Stores self - other in out and returns out
+    '''
+    def sub_into(self, other, out):
+        return self._into(operator.sub, other, out)
+
+    '''
+    Stores self * other in out and returns out
+    '''
+    def mul_into(self, other, out):
+        return self._into(operator.mul, other, out)
+
+    '''
+    Stores self / other in out and returns out
+    '''
+    def div_into(self, other, out):
+        return self._into(operator.truediv, other, out)
+
+    def axpy(self, a, x, work=None):
+        """
+        Updates the vector in place to self + a*x (BLAS axpy) and returns it.
+        a*x needs a temporary buffer: pass a work vector of the same length
+        to reuse one across calls instead of allocating it each time.
+        """
+        if not isinstance(x, Vector):
+            raise TypeError("x must be a Vector")
+        if len(x.data) != len(self.data):
+            raise ValueError("Incompatible lengths: expected "
+                             f"{len(self.data)} got {len(x.data)}")
+        if self._impl is _PythonBackend:
+            return self._inplace(operator.add,
+                                 _PythonBackend.binary(operator.mul, x.data, a))
+        if (work is None and len(x.data) > _CHUNK_SIZE
+                and np.result_type(self.data, x.data, a) == self.data.dtype):
+            # keep the temporary to one chunk
+            for s in _chunks(len(x.data)):
+                self.data[s] += a * x.data[s]
+            self._modified()
             return self
+        scaled = np.multiply(x.data, a,
+                             out=None if work is None else work.data)
+        return self._inplace(operator.add, scaled)
+
+    @classmethod
+    def from_file(cls, path, dtype='float64', mode='r'):
+        """
+        Opens a vector written by save() as a memory map, without reading it
+        into memory. .npy files carry their own dtype, any other path is read
+        as raw binary of the given dtype. mode is as for np.memmap: 'r'
+        read-only, 'r+' read-write or 'c' copy-on-write.
+        """
+        if str(path).endswith('.npy'):
+            arr = np.load(path, mmap_mode=mode)
+        else:
+            arr = np.memmap(path, dtype=dtype, mode=mode)
+        if arr.dtype.kind not in _NUMERIC_KINDS:
+            raise ValueError('Invalid numeric data')
+        if arr.ndim != 1:
+            raise ValueError(f'Too many array dimensions ({arr.ndim})')
+        return cls._from_array(arr)
+
+    @classmethod
+    def memmap(cls, path, n, dtype='float64'):
+        """
+        Creates a file-backed vector of n zeros at path (.npy or raw binary)
+        and returns it opened read-write
+        """
+        if str(path).endswith('.npy'):
+            arr = np.lib.format.open_memmap(path, mode='w+', dtype=dtype,
+                                            shape=(n,))
+        else:
+            arr = np.memmap(path, dtype=dtype, mode='w+', shape=(n,))
+        return cls._from_array(arr)
+
+    def save(self, path):
+        """
+        Writes the vector to path in a format from_file() maps back without
+        copying: .npy keeps the dtype, other paths get the raw buffer
+        """
+        if str(path).endswith('.npy'):
+            np.save(path, self.data)
         else:
-            raise TypeError("Other must be a scalar or Vector")
+            np.asarray(self.data).tofile(path)
+
+    '''
+    Writes changes of a memory-mapped vector back to its file
+    '''
+    def flush(self):
+        if isinstance(self.data, np.memmap):
+            self.data.flush()
 
     def __str__(self):
-        return str(self.data)
+        return self._impl.format(self.data)
 
     def __repr__(self):
         return repr(self.data)
@@ -170,7 +931,7 @@ class Vector:
     Returns the H2 norm of the vector
     '''
     def __abs__(self):
-        return np.sqrt(self.dot(self))
+        return self._impl.sqrt(self.dot(self))
 
     '''
     Returns the dimensionality of the vector
@@ -185,125 +946,2182 @@ class Vector:
 Implements an N-dimensional vector of complex numbers.
 '''
 class CVector(Vector):
-    def __init__(self, data):
-        try:
-            iter(data)
-        except TypeError as te:
-            raise TypeError('Invalid iterable data')
-
-        if all(isinstance(x, Number) for x in data):
-            arr = np.array([complex(x) for x in data])
-        else:
-            raise ValueError('Invalid numeric data')
+    def __init__(self, data, dtype=complex):
+        if dtype is not complex and np.dtype(dtype).kind != 'c':
+            raise ValueError(f'Invalid complex dtype {dtype}')
+        arr = _numeric_array(data, dtype)
 
         if arr.ndim != 1:
             raise ValueError('Too many array dimensions')
 
         self.data = arr
 
-    def __add__(self, other):
-        return CVector(super().__add__(other).data)
+    @staticmethod
+    def zeros(n, dtype=complex):
+        return CVector._from_array(np.zeros(n, dtype=dtype))
+
+    def _wrap(self, result):
+        if isinstance(result, np.ndarray) and result.ndim == 1 \
+                and result.dtype.kind != 'c':
+            # e.g. np.abs or np.real of a complex vector
+            return Vector._from_array(result)
+        return super()._wrap(result)
+
+    '''
+    Returns a complex conjugate version of the vector
+    '''
+    def CC(self):
+        return self._from_array(np.conj(self.data))
+
+    '''
+    Returns the complex conjugate as a read-only vector, computed once and
+    cached until this vector is changed in place by its methods or a ufunc
+    (element writes straight to .data are not seen). Use CC() for a copy
+    that can be modified.
+    '''
+    @property
+    def conj(self):
+        # (data the conjugate was computed from, conjugate)
+        (data, conj) = getattr(self, '_conj', (None, None))
+        if data is not self.data:
+            arr = np.conj(self.data)
+            arr.flags.writeable = False
+            conj = self._from_array(arr)
+            self._conj = (self.data, conj)
+        return conj
+
+    def _modified(self):
+        self._conj = (None, None)
+
+    '''
+    Do an inner product in complex vector (Hilbert) space, conjugating
+    this vector
+    '''
+    def dot(self, other):
+        other = self._operand(other)
+        if isinstance(other, Number) or other is NotImplemented:
+            raise TypeError("Other must be iterable of same length")
+        return _vdot(self.data, other)
+
+    '''
+    Returns the H2 norm of the vector as a real number
+    '''
+    def __abs__(self):
+        return np.sqrt(_vdot(self.data, self.data).real)
+
+    @staticmethod
+    def batch_dot(us, vs):
+        """
+        Returns the inner products of each vector of us with the matching
+        vector of vs, given as lists of CVectors or (N, n) complex arrays.
+        Long vectors are each one vdot call; short ones are stacked and
+        reduced together on float views of the data, so conj(us) is never
+        built.
+        """
+        us, vs = _complex_batch(us), _complex_batch(vs)
+        if _batch_shape(us) != _batch_shape(vs):
+            raise ValueError('Vectors must be same length')
+        if len(us) == 0 or _batch_shape(us)[1] >= _BATCH_ROW_SIZE:
+            return np.array([np.vdot(u, v) for (u, v) in zip(us, vs)],
+                            dtype=complex).reshape(len(us))
+        u = _real_view(np.asarray(us)).reshape(len(us), -1, 2)
+        v = _real_view(np.asarray(vs)).reshape(len(vs), -1, 2)
+        # (a - bi)(c + di) = (ac + bd) + (ad - bc)i
+        real = np.einsum('ijk,ijk->i', u, v)
+        imag = (np.einsum('ij,ij->i', u[..., 0], v[..., 1])
+                - np.einsum('ij,ij->i', u[..., 1], v[..., 0]))
+        return real + 1j*imag
+
+    @staticmethod
+    def batch_norm(us):
+        """
+        Returns the H2 norm of each vector of us (a list of CVectors or an
+        (N, n) complex array)
+        """
+        us = _complex_batch(us)
+        if len(us) == 0 or _batch_shape(us)[1] >= _BATCH_ROW_SIZE:
+            return np.sqrt(np.array([np.vdot(u, u).real for u in us],
+                                    dtype=float))
+        u = _real_view(np.asarray(us)).reshape(len(us), -1)
+        return np.sqrt(np.einsum('ij,ij->i', u, u))
+
+
+def _complex_batch(vectors):
+    """
+    Returns an (N, n) complex array as it is, and a list of vectors as a
+    list of their 1D complex arrays
+    """
+    if isinstance(vectors, np.ndarray):
+        if vectors.ndim != 2:
+            raise ValueError(f'Expected an array of shape (N, n), '
+                             f'got {vectors.shape}')
+        return vectors if vectors.dtype.kind == 'c' else vectors.astype(complex)
+    rows = [v.data if isinstance(v, Vector) else np.asarray(v)
+            for v in vectors]
+    return [r if r.dtype.kind == 'c' else r.astype(complex) for r in rows]
+
+
+def _batch_shape(batch):
+    if isinstance(batch, np.ndarray):
+        return batch.shape
+    lengths = {len(r) for r in batch}
+    if len(lengths) > 1:
+        raise ValueError('Vectors must be same length')
+    return (len(batch), lengths.pop() if lengths else 0)
+
+
+'''
+Implements an 2-dimensional vector of real numbers.
+'''
+class Vector2D(Vector):
+    def __init__(self, *args, dtype=None, backend=None):
+        n = len(args)
+        if n == 2:
+            super().__init__(args, dtype, backend)
+        elif n == 1:
+            if isinstance(args[0], Vector):
+                if len(args[0]) != 2:
+                    raise ValueError('Only 2 dimensions are allowed')
+            elif len(args[0]) != 2:
+                raise TypeError('Only 2 dimensions are allowed')
+            super().__init__(args[0], dtype, backend)
+        else:
+            raise TypeError('Only 2 dimensions are allowed')
+
+
+    @property
+    def X(self):
+        return self.data[0]
+
+    @property
+    def Y(self):
+        return self.data[1]
+
+    @property
+    def XY(self):
+        return (self.data[0], self.data[1])
+
+    @X.setter
+    def X(self, x):
+        self.data[0] = x
+
+    @Y.setter
+    def Y(self, y):
+        self.data[1] = y
+
+    def angle(self):
+        """
+        Returns the angle, measured as 0 radians from x-axis, in radians
+        """
+        x, y = self.XY
+
+        if x == 0:
+            return math.pi/2 if y > 0 else -math.pi/2
+
+        if y == 0:
+            return 0 if x > 0 else math.pi
+
+        angle = math.atan2(y, x)
+
+        return angle
+
+    @staticmethod
+    def create_from_angle(angle, length):
+        """
+        Creates a vector according to the angle and length of the vector.
+
+        Angle: an angle in radians, where the angle is measured from 0 on the x-axis,
+        and angle goes from -180 (on the bottom) to +180 (on the top).
+        Length: must be a scalar number
+        """
+        # convert to radians
+        x = length * math.cos(angle)
+        y = length * math.sin(angle)
+        return Vector2D([x, y])
+
+    @staticmethod
+    def zero(dtype=float, backend=None):
+        return Vector2D._from_array(_get_backend(backend).zeros(2, dtype))
+
+    @staticmethod
+    def angle_between(u, v):
+        """
+        Finds the angle of v w.r.t to u.
+
+        :param u: Reference vector to measure angle to
+        :param v: Vector to measure angle of w.r.t u
+        :return: Angle between the two vectors, where 0 means they point in the same direction
+        -90 means v points to the west of u, etc. 0 is returned if either is a zero vector.
+        """
+        ux, uy = u.data.tolist()
+        vx, vy = v.data.tolist()
+        cross = ux*vy - uy*vx
+        dot = ux*vx + uy*vy
+        # adding 0.0 turns -0.0 into 0.0, so that anti-parallel vectors give
+        # +pi and zero vectors give 0
+        return math.atan2(cross + 0.0, dot + 0.0)
+
+
+'''
+Implements an 3-dimensional vector of real numbers.
+'''
+class Vector3D(Vector):
+    def __init__(self, *args, dtype=None, backend=None):
+        n = len(args)
+        if n == 3:
+            super().__init__(args, dtype, backend)
+        elif n == 1:
+            if isinstance(args[0], Vector):
+                if len(args[0]) != 3:
+                    raise ValueError('Only 3 dimensions are allowed')
+            elif len(args[0]) != 3:
+                raise TypeError('Only 3 dimensions are allowed')
+            super().__init__(args[0], dtype, backend)
+        else:
+            raise TypeError('Only 3 dimensions are allowed')
+
+
+    @property
+    def X(self):
+        return self.data[0]
+
+    @property
+    def Y(self):
+        return self.data[1]
+
+    @property
+    def Z(self):
+        return self.data[2]
+
+    @property
+    def XYZ(self):
+        return (self.data[0], self.data[1], self.data[2])
+
+    @X.setter
+    def X(self, x):
+        self.data[0] = x
+
+    @Y.setter
+    def Y(self, y):
+        self.data[1] = y
+
+    @Z.setter
+    def Z(self, z):
+        self.data[2] = z
+
+    '''
+    Gets spherical coordinates (physics standard) for the vector
+
+    r: radial distance from origin
+    theta: polar angle (0 to pi), where theta=0 in z-axis
+    phi: azimuthal angle (0 to 2pi), where phi=0 in x-axis
+    '''
+    def getSphericalCoords(self):
+        r = abs(self)
+        theta = math.acos(self.Z/r)
+        phi = math.atan2(self.Y, self.X)
+        return (r, theta, phi)
+
+    '''
+    Gets cylindrical coordinates for the vector
+
+    s: radial distance from origin
+    phi: azimuthal angle (0 to 2pi), where phi=0 in x-axis
+    z: height from origin
+    '''
+    def getCylindricalCoords(self):
+        s = math.sqrt(self.X**2 + self.Y**2)
+        phi = math.atan2(self.Y, self.X)
+        z = self.Z
+        return (s, phi, z)
+
+    '''
+    Creates a 3D vector using spherical coordinates (physics standard)
+
+    r: radial distance from origin
+    theta: polar angle (0 to pi), where theta=0 in z-axis
+    phi: azimuthal angle (0 to 2pi), where phi=0 in x-axis
+    '''
+    @staticmethod
+    def createSpherical(r, theta, phi):
+        x = r*math.sin(theta)*math.cos(phi)
+        y = r*math.sin(theta)*math.sin(phi)
+        z = r*math.cos(theta)
+        return Vector3D(x, y, z)
+
+    '''
+    Creates a 3D vector using cylindrical coordinates
+
+    s: radial distance from origin
+    phi: azimuthal angle (0 to 2pi), where phi=0 in x-axis
+    z: height from origin
+    '''
+    @staticmethod
+    def createCylindrical(s, phi, z):
+        x = s*math.cos(phi)
+        y = s*math.sin(phi)
+        z = z
+        return Vector3D(x, y, z)
+
+    @staticmethod
+    def zero(dtype=float, backend=None):
+        return Vector3D._from_array(_get_backend(backend).zeros(3, dtype))
+
+    '''
+    Returns vector cross product
+    '''
+    def cross(self, other):
+        if isinstance(other, Vector3D):
+            return self._from_array(self._impl.cross(self.data, other.data))
+        else:
+            raise TypeError("Other must be a Vector3D")
+
+
+'''
+Implements a vector expression that is recorded by the arithmetic operators
+instead of computed, and evaluated in one pass by eval(). Each chunk of the
+inputs runs through the whole expression while it is in cache, and the
+intermediate results only need chunk-sized buffers instead of full vectors.
+'''
+class LazyExpr:
+    # makes Vector and ndarray operators return NotImplemented, so that
+    # vector + expr is also recorded by the reflected operator below
+    __array_ufunc__ = None
+
+    def __init__(self, op, *args):
+        # op is a ufunc applied to args (LazyExprs or scalars), or None for
+        # a leaf holding a single Vector
+        self.op = op
+        self.args = args
+
+    @staticmethod
+    def _operand(other):
+        if isinstance(other, (LazyExpr, Number)):
+            return other
+        elif isinstance(other, Vector):
+            return LazyExpr(None, other)
+        return NotImplemented
+
+    def _binary(self, ufunc, other, reflected=False):
+        other = self._operand(other)
+        if other is NotImplemented:
+            return NotImplemented
+        if reflected:
+            return LazyExpr(ufunc, other, self)
+        return LazyExpr(ufunc, self, other)
+
+    def __add__(self, other):
+        return self._binary(np.add, other)
+
+    def __radd__(self, other):
+        return self._binary(np.add, other, reflected=True)
+
+    def __sub__(self, other):
+        return self._binary(np.subtract, other)
+
+    def __rsub__(self, other):
+        return self._binary(np.subtract, other, reflected=True)
+
+    def __mul__(self, other):
+        return self._binary(np.multiply, other)
+
+    def __rmul__(self, other):
+        return self._binary(np.multiply, other, reflected=True)
+
+    def __truediv__(self, other):
+        return self._binary(np.true_divide, other)
+
+    def __rtruediv__(self, other):
+        return self._binary(np.true_divide, other, reflected=True)
+
+    def __floordiv__(self, other):
+        return self._binary(np.floor_divide, other)
+
+    def __rfloordiv__(self, other):
+        return self._binary(np.floor_divide, other, reflected=True)
+
+    def __pow__(self, other):
+        return self._binary(np.power, other)
+
+    def __rpow__(self, other):
+        return self._binary(np.power, other, reflected=True)
+
+    def __neg__(self):
+        return LazyExpr(np.negative, self)
+
+    def _leaves(self):
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node.op is None:
+                yield node.args[0]
+            else:
+                # leftmost first, as the eager result type comes from it
+                stack.extend(a for a in reversed(node.args)
+                             if isinstance(a, LazyExpr))
+
+    def _evaluate(self, s, values, buffers, out=None):
+        """
+        Computes the expression for slice s of the inputs. values maps the
+        nodes already computed for this slice, so a subexpression used twice
+        is only computed once; buffers holds each node's reused chunk buffer.
+        """
+        if self.op is None:
+            return self.args[0].data[s]
+        if id(self) in values:
+            return values[id(self)]
+        args = [a._evaluate(s, values, buffers)
+                if isinstance(a, LazyExpr) else a for a in self.args]
+        if out is None:
+            buffer = buffers.get(id(self))
+            if buffer is None:
+                # the first chunk is the largest, and fixes the dtype
+                buffer = buffers[id(self)] = self.op(*args)
+                out = buffer
+            else:
+                out = self.op(*args, out=buffer[:s.stop - s.start])
+        else:
+            self.op(*args, out=out)
+        values[id(self)] = out
+        return out
+
+    def eval(self, out=None):
+        """
+        Evaluates the expression and returns the result as a vector of the
+        same type as the first input, or stores it in the vector out. The
+        result is identical to evaluating the same operators eagerly.
+        """
+        leaves = list(self._leaves())
+        if not leaves:
+            raise ValueError("Expression has no vectors")
+        n = len(leaves[0].data)
+        if any(len(v.data) != n for v in leaves):
+            raise ValueError("Vectors must be same length")
+        if self.op is None:
+            result = np.array(self.args[0].data)
+            if out is None:
+                return self.args[0]._from_array(result)
+            out.data[...] = result
+            out._modified()
+            return out
+
+        buffers = {}
+        chunks = [slice(start, min(start + _LAZY_CHUNK_SIZE, n))
+                  for start in range(0, n, _LAZY_CHUNK_SIZE)] or [slice(0, 0)]
+        first = self._evaluate(chunks[0], {}, buffers)
+        if out is None:
+            result = np.empty(n, dtype=first.dtype)
+        elif not isinstance(out, Vector) or len(out.data) != n \
+                or out.backend != 'numpy':
+            raise ValueError("out must be a NumPy Vector of the same length")
+        else:
+            result = out.data
+        np.copyto(result[chunks[0]], first, casting='same_kind')
+        for s in chunks[1:]:
+            self._evaluate(s, {}, buffers, out=result[s])
+        if out is None:
+            return type(leaves[0])._from_array(result)
+        out._modified()
+        return out
+
+    def __repr__(self):
+        if self.op is None:
+            return f'lazy({self.args[0]!r})'
+        return f'{self.op.__name__}({", ".join(map(repr, self.args))})'
+
+
+def lazy(*vectors):
+    """
+    Returns lazy expressions of the vectors, to combine with the usual
+    operators and then evaluate in one pass:
+
+        >>> (lazy(a) * 2.0 + b - c / d).eval()
+
+    Vectors mixed into the expression are included as they are, so only one
+    operand of each expression needs to be lazy. Returns a single expression
+    for a single vector and a tuple otherwise.
+    """
+    for v in vectors:
+        if not isinstance(v, Vector):
+            raise TypeError("lazy() arguments must be Vectors")
+    exprs = tuple(v.expr for v in vectors)
+    return exprs[0] if len(exprs) == 1 else exprs
+
+
+'''
+Implements a batch of N fixed-size vectors stored as the rows of a single
+contiguous (N, dim) array, so operations run once over all rows.
+'''
+class VectorArray:
+    # set by subclasses
+    dim = None
+    element = None
+
+    def __init__(self, data, dtype=None):
+        if isinstance(data, VectorArray):
+            arr = np.array(data.data, dtype=dtype)
+        elif isinstance(data, np.ndarray):
+            arr = np.array(data, dtype=dtype)
+        else:
+            try:
+                rows = [x.data if isinstance(x, Vector) else x for x in data]
+            except TypeError as te:
+                raise TypeError('Invalid iterable data')
+            arr = np.array(rows, dtype=dtype)
+
+        if arr.size == 0:
+            arr = arr.reshape(0, self.dim)
+        if arr.dtype.kind not in _NUMERIC_KINDS:
+            raise ValueError('Invalid numeric data')
+        if arr.ndim != 2 or arr.shape[1] != self.dim:
+            raise ValueError(f'Expected an array of shape (N, {self.dim}), '
+                             f'got {arr.shape}')
+
+        self.data = np.ascontiguousarray(arr)
+
+    @classmethod
+    def _from_array(cls, arr):
+        """
+        Wraps an already validated (N, dim) ndarray without copying it.
+        """
+        vecs = cls.__new__(cls)
+        vecs.data = arr
+        return vecs
+
+    def _operand(self, other):
+        """
+        Returns the array to combine with self.data for an elementwise
+        operation. A Vector is broadcast to every row and a 1D array of
+        length N is applied per row.
+        """
+        if isinstance(other, VectorArray):
+            if other.data.shape != self.data.shape:
+                raise ValueError('Incompatible array shapes')
+            return other.data
+        elif isinstance(other, Vector):
+            if len(other.data) != self.dim:
+                raise ValueError(f'Vector must have {self.dim} dimensions')
+            return other.data
+        elif isinstance(other, Number):
+            return other
+        arr = np.asarray(other)
+        if arr.ndim == 1 and len(arr) == len(self.data):
+            return arr[:, np.newaxis]
+        return arr
+
+    def __len__(self):
+        return len(self.data)
+
+    '''
+    Iterates over the rows as vector views into the array
+    '''
+    def __iter__(self):
+        for row in self.data:
+            yield self.element._from_array(row)
+
+    '''
+    Returns a vector view for an integer index, otherwise a view or copy
+    of the selected rows as the same array type
+    '''
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self.element._from_array(self.data[key])
+        rows = self.data[key]
+        if rows.ndim == 2 and rows.shape[1] == self.dim:
+            return self._from_array(rows)
+        return rows
+
+    def __setitem__(self, key, value):
+        if isinstance(value, (Vector, VectorArray)):
+            value = value.data
+        self.data[key] = value
+
+    def __eq__(self, other):
+        if isinstance(other, VectorArray):
+            return np.array_equal(self.data, other.data)
+        return False
+
+    def __add__(self, other):
+        return self._from_array(self.data + self._operand(other))
+
+    def __radd__(self, other):
+        return self._from_array(self._operand(other) + self.data)
+
+    def __sub__(self, other):
+        return self._from_array(self.data - self._operand(other))
+
+    def __rsub__(self, other):
+        return self._from_array(self._operand(other) - self.data)
+
+    def __neg__(self):
+        return self._from_array(-self.data)
+
+    def __mul__(self, other):
+        return self._from_array(self.data * self._operand(other))
+
+    def __rmul__(self, other):
+        return self._from_array(self._operand(other) * self.data)
+
+    def __truediv__(self, other):
+        return self._from_array(self.data / self._operand(other))
+
+    def __rtruediv__(self, other):
+        return self._from_array(self._operand(other) / self.data)
+
+    def __iadd__(self, other):
+        self.data += self._operand(other)
+        return self
+
+    def __isub__(self, other):
+        self.data -= self._operand(other)
+        return self
+
+    def __imul__(self, other):
+        self.data *= self._operand(other)
+        return self
+
+    def __itruediv__(self, other):
+        self.data /= self._operand(other)
+        return self
+
+    '''
+    Returns the dot product of each row with the matching row of other
+    (or with a single Vector) as an array of length N
+    '''
+    def dot(self, other):
+        if isinstance(other, Vector):
+            return self.data @ self._operand(other)
+        return np.einsum('ij,ij->i', self.data, self._operand(other))
+
+    '''
+    Returns the H2 norm of each row
+    '''
+    def __abs__(self):
+        return np.sqrt(np.einsum('ij,ij->i', self.data, self.data))
+
+    '''
+    Returns a deep copy of the array
+    '''
+    def copy(self):
+        return self._from_array(self.data.copy())
+
+    @classmethod
+    def zeros(cls, n, dtype=float):
+        return cls._from_array(np.zeros((n, cls.dim), dtype=dtype))
+
+    def __reduce_ex__(self, protocol):
+        return _reduce_data(self, protocol)
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def __str__(self):
+        return str(self.data)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.data!r})'
+
+
+'''
+Implements a batch of 2-dimensional vectors of real numbers.
+'''
+class Vector2DArray(VectorArray):
+    dim = 2
+    element = Vector2D
+
+    @property
+    def X(self):
+        return self.data[:, 0]
+
+    @property
+    def Y(self):
+        return self.data[:, 1]
+
+    @X.setter
+    def X(self, x):
+        self.data[:, 0] = x
+
+    @Y.setter
+    def Y(self, y):
+        self.data[:, 1] = y
+
+    def angle(self):
+        """
+        Returns the angle of each row, measured as 0 radians from x-axis,
+        with the same conventions as Vector2D.angle
+        """
+        x, y = self.X, self.Y
+        return np.where(x == 0, np.where(y > 0, math.pi/2, -math.pi/2),
+               np.where(y == 0, np.where(x > 0, 0.0, math.pi),
+                        np.arctan2(y, x)))
+
+    @staticmethod
+    def create_from_angle(angle, length):
+        """
+        Creates vectors from arrays (or scalars) of angles and lengths,
+        as in Vector2D.create_from_angle
+        """
+        angle, length = np.broadcast_arrays(
+            np.atleast_1d(np.asarray(angle, dtype=float)),
+            np.asarray(length, dtype=float))
+        return Vector2DArray._from_array(
+            np.stack((length*np.cos(angle), length*np.sin(angle)), axis=-1))
+
+    @staticmethod
+    def angle_between(u, v):
+        """
+        Finds the angle of each v w.r.t. the matching u in one pass, with
+        the same conventions as Vector2D.angle_between. Arguments may be
+        Vector2DArrays, (N, 2) arrays or single Vector2Ds, which are
+        compared against every row of the other argument.
+        """
+        u = np.asarray(u.data if isinstance(u, (Vector, VectorArray)) else u)
+        v = np.asarray(v.data if isinstance(v, (Vector, VectorArray)) else v)
+        if u.shape[-1:] != (2,) or v.shape[-1:] != (2,):
+            raise ValueError('Expected vectors with 2 dimensions')
+        ux, uy = u[..., 0], u[..., 1]
+        vx, vy = v[..., 0], v[..., 1]
+        cross = ux*vy - uy*vx
+        dot = ux*vx + uy*vy
+        # see Vector2D.angle_between for the 0.0 offsets
+        return np.arctan2(cross + 0.0, dot + 0.0)
+
+
+'''
+Implements a batch of 3-dimensional vectors of real numbers.
+'''
+class Vector3DArray(VectorArray):
+    dim = 3
+    element = Vector3D
+
+    @property
+    def X(self):
+        return self.data[:, 0]
+
+    @property
+    def Y(self):
+        return self.data[:, 1]
+
+    @property
+    def Z(self):
+        return self.data[:, 2]
+
+    @X.setter
+    def X(self, x):
+        self.data[:, 0] = x
+
+    @Y.setter
+    def Y(self, y):
+        self.data[:, 1] = y
+
+    @Z.setter
+    def Z(self, z):
+        self.data[:, 2] = z
+
+    '''
+    Returns the cross product of each row with the matching row of other
+    (or with a single Vector3D)
+    '''
+    def cross(self, other):
+        if isinstance(other, (Vector3DArray, Vector3D)):
+            return self._from_array(np.cross(self.data, self._operand(other)))
+        else:
+            raise TypeError("Other must be a Vector3D or Vector3DArray")
+
+    '''
+    Gets spherical coordinates (physics standard) for each row as
+    arrays (r, theta, phi), see Vector3D.getSphericalCoords
+    '''
+    def getSphericalCoords(self):
+        r = abs(self)
+        theta = np.arccos(self.Z/r)
+        phi = np.arctan2(self.Y, self.X)
+        return (r, theta, phi)
+
+    '''
+    Gets cylindrical coordinates for each row as arrays (s, phi, z),
+    see Vector3D.getCylindricalCoords
+    '''
+    def getCylindricalCoords(self):
+        s = np.sqrt(self.X**2 + self.Y**2)
+        phi = np.arctan2(self.Y, self.X)
+        z = self.Z.copy()
+        return (s, phi, z)
+
+    '''
+    Creates 3D vectors from arrays (or scalars) of spherical coordinates
+    '''
+    @staticmethod
+    def createSpherical(r, theta, phi):
+        r, theta, phi = np.broadcast_arrays(
+            np.atleast_1d(np.asarray(r, dtype=float)),
+            np.asarray(theta, dtype=float), np.asarray(phi, dtype=float))
+        x = r*np.sin(theta)*np.cos(phi)
+        y = r*np.sin(theta)*np.sin(phi)
+        z = r*np.cos(theta)
+        return Vector3DArray._from_array(np.stack((x, y, z), axis=-1))
+
+    '''
+    Creates 3D vectors from arrays (or scalars) of cylindrical coordinates
+    '''
+    @staticmethod
+    def createCylindrical(s, phi, z):
+        s, phi, z = np.broadcast_arrays(
+            np.atleast_1d(np.asarray(s, dtype=float)),
+            np.asarray(phi, dtype=float), np.asarray(z, dtype=float))
+        x = s*np.cos(phi)
+        y = s*np.sin(phi)
+        return Vector3DArray._from_array(np.stack((x, y, z), axis=-1))
+
+
+'''
+Implements a dense M x N matrix of real numbers stored as a 2D ndarray, so
+matrix products run as a single BLAS call.
+'''
+class Matrix:
+    # set by subclasses for homogeneous transforms of dim-dimensional points
+    dim = None
+
+    def __init__(self, data):
+        if isinstance(data, Matrix):
+            arr = np.array(data.data)
+        elif isinstance(data, np.ndarray):
+            arr = np.array(data)
+        else:
+            try:
+                rows = [x.data if isinstance(x, Vector) else x for x in data]
+            except TypeError as te:
+                raise TypeError('Invalid iterable data')
+            arr = np.array(rows)
+
+        if arr.dtype.kind not in _NUMERIC_KINDS:
+            raise ValueError('Invalid numeric data')
+        if arr.ndim != 2:
+            raise ValueError(f'Expected a 2D array, got {arr.ndim} dimensions')
+        if self.dim is not None and arr.shape != (self.dim + 1, self.dim + 1):
+            raise ValueError(f'Expected an array of shape ({self.dim + 1}, '
+                             f'{self.dim + 1}), got {arr.shape}')
+
+        self.data = arr
+
+    @classmethod
+    def _from_array(cls, arr):
+        """
+        Wraps an already validated 2D ndarray without copying it.
+        """
+        m = cls.__new__(cls)
+        m.data = arr
+        return m
+
+    def _wrap(self, result):
+        if result.shape == self.data.shape:
+            return self._from_array(result)
+        return Matrix._from_array(result)
+
+    def _operand(self, other):
+        if isinstance(other, Matrix):
+            other = other.data
+        elif isinstance(other, Number):
+            return other
+        other = np.asarray(other)
+        if other.shape != self.data.shape:
+            raise ValueError('Incompatible matrix shapes')
+        return other
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    '''
+    Returns the transposed matrix as a view of the same data
+    '''
+    @property
+    def T(self):
+        return self._wrap(self.data.T)
+
+    '''
+    Returns an element for a pair of indices, a Vector for a single row or
+    column and a Matrix for a block
+    '''
+    def __getitem__(self, key):
+        result = self.data[key]
+        if np.ndim(result) == 1:
+            return Vector._from_array(result)
+        elif np.ndim(result) == 2:
+            return Matrix._from_array(result)
+        return result
+
+    def __setitem__(self, key, value):
+        if isinstance(value, (Vector, Matrix)):
+            value = value.data
+        self.data[key] = value
+
+    def __eq__(self, other):
+        if isinstance(other, Matrix):
+            return np.array_equal(self.data, other.data)
+        return False
+
+    def __array__(self, dtype=None, copy=None):
+        if copy:
+            return np.array(self.data, dtype=dtype)
+        return np.asarray(self.data, dtype=dtype)
+
+    def __add__(self, other):
+        return self._wrap(self.data + self._operand(other))
+
+    def __sub__(self, other):
+        return self._wrap(self.data - self._operand(other))
+
+    def __neg__(self):
+        return self._wrap(-self.data)
+
+    '''
+    Returns scalar or elementwise multiplication of the matrix, use @ for
+    the matrix product
+    '''
+    def __mul__(self, other):
+        return self._wrap(self.data * self._operand(other))
+
+    def __rmul__(self, other):
+        return self._wrap(self._operand(other) * self.data)
+
+    def __truediv__(self, other):
+        return self._wrap(self.data / self._operand(other))
+
+    '''
+    Returns the matrix product with a Matrix, a Vector, or every row of a
+    VectorArray (see transform)
+    '''
+    def __matmul__(self, other):
+        if isinstance(other, Matrix):
+            result = self.data @ other.data
+            if type(other) is type(self):
+                return self._wrap(result)
+            return Matrix._from_array(result)
+        elif isinstance(other, Vector):
+            return other._wrap(
+                self._transform_rows(np.asarray(other.data)[np.newaxis])[0])
+        elif isinstance(other, VectorArray):
+            return self.transform(other)
+        try:
+            return self.data @ np.asarray(other)
+        except TypeError as te:
+            return NotImplemented
+
+    '''
+    Returns the product of a row vector with the matrix
+    '''
+    def __rmatmul__(self, other):
+        if isinstance(other, Vector):
+            return other._wrap(other.data @ self.data)
+        return NotImplemented
+
+    def _transform_rows(self, arr):
+        """
+        Multiplies each row of arr by the matrix. Rows of dim components are
+        homogeneous points: translated, and divided by w if the matrix is
+        a projection.
+        """
+        d = self.dim
+        if d is None or arr.shape[-1] != d:
+            return arr @ self.data.T
+        result = arr @ self.data[:d, :d].T
+        result += self.data[:d, d]
+        last = self.data[d]
+        if np.any(last[:d]) or last[d] != 1:
+            result = result / (arr @ last[:d] + last[d])[:, np.newaxis]
+        return result
+
+    def transform(self, points):
+        """
+        Applies the matrix to every row of a VectorArray or (N, n) array of
+        row vectors with one matrix product, points @ M.T, instead of one
+        call per vector. Returns the same array type when the rows keep
+        their dimension, otherwise an ndarray.
+        """
+        if isinstance(points, VectorArray):
+            arr = points.data
+        else:
+            arr = np.asarray(points)
+        if arr.ndim != 2:
+            raise ValueError(f'Expected an array of shape (N, n), '
+                             f'got {arr.shape}')
+        result = self._transform_rows(arr)
+        if isinstance(points, VectorArray) and result.shape[1] == points.dim:
+            return points._from_array(result)
+        return result
+
+    '''
+    Returns the inverse matrix
+    '''
+    def inverse(self):
+        return self._from_array(np.linalg.inv(self.data))
+
+    '''
+    Returns a deep copy of the matrix
+    '''
+    def copy(self):
+        return self._from_array(self.data.copy())
+
+    @classmethod
+    def identity(cls, n=None):
+        if n is None:
+            if cls.dim is None:
+                raise TypeError('identity() of a Matrix needs its size')
+            n = cls.dim + 1
+        return cls._from_array(np.eye(n))
+
+    @staticmethod
+    def zeros(m, n):
+        return Matrix._from_array(np.zeros((m, n)))
+
+    def __str__(self):
+        return str(self.data)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.data!r})'
+
+
+'''
+Implements a 2D transform as a 3x3 matrix in homogeneous coordinates, so
+rotations, scalings and translations compose with @. Applied to Vector2D
+or Vector2DArray points.
+'''
+class Matrix2D(Matrix):
+    dim = 2
+
+    @staticmethod
+    def rotation(angle):
+        """
+        Creates a counterclockwise rotation by angle radians about the origin
+        """
+        c, s = math.cos(angle), math.sin(angle)
+        return Matrix2D._from_array(np.array([[c, -s, 0.0],
+                                              [s, c, 0.0],
+                                              [0.0, 0.0, 1.0]]))
+
+    @staticmethod
+    def scaling(sx, sy=None):
+        """
+        Creates a scaling by sx along x and sy along y (sx if not given)
+        """
+        sy = sx if sy is None else sy
+        return Matrix2D._from_array(np.diag([sx, sy, 1.0]).astype(float))
+
+    @staticmethod
+    def translation(x, y):
+        m = np.eye(3)
+        m[:2, 2] = x, y
+        return Matrix2D._from_array(m)
+
+
+'''
+Implements a 3D transform as a 4x4 matrix in homogeneous coordinates, so
+rotations, scalings, translations and perspective projections compose
+with @. Applied to Vector3D or Vector3DArray points.
+'''
+class Matrix3D(Matrix):
+    dim = 3
+
+    @staticmethod
+    def rotation(angle, axis=(0.0, 0.0, 1.0)):
+        """
+        Creates a rotation by angle radians about an axis through the origin,
+        counterclockwise when looking down the axis towards the origin
+        """
+        x, y, z = axis
+        norm = math.sqrt(x*x + y*y + z*z)
+        if norm == 0:
+            raise ValueError('Rotation axis must not be zero')
+        x, y, z = x/norm, y/norm, z/norm
+        c, s = math.cos(angle), math.sin(angle)
+        C = 1 - c
+        return Matrix3D._from_array(np.array([
+            [c + x*x*C, x*y*C - z*s, x*z*C + y*s, 0.0],
+            [y*x*C + z*s, c + y*y*C, y*z*C - x*s, 0.0],
+            [z*x*C - y*s, z*y*C + x*s, c + z*z*C, 0.0],
+            [0.0, 0.0, 0.0, 1.0]]))
+
+    @staticmethod
+    def scaling(sx, sy=None, sz=None):
+        """
+        Creates a scaling by sx, sy and sz along the axes (sx if not given)
+        """
+        sy = sx if sy is None else sy
+        sz = sx if sz is None else sz
+        return Matrix3D._from_array(np.diag([sx, sy, sz, 1.0]).astype(float))
+
+    @staticmethod
+    def translation(x, y, z):
+        m = np.eye(4)
+        m[:3, 3] = x, y, z
+        return Matrix3D._from_array(m)
+
+    @staticmethod
+    def perspective(fov, aspect, near, far):
+        """
+        Creates an OpenGL-style perspective projection looking down -z, with
+        a vertical field of view of fov radians. Points between the near and
+        far planes inside the view map to [-1, 1] on each axis.
+        """
+        if near <= 0 or far <= near:
+            raise ValueError('Expected 0 < near < far')
+        f = 1 / math.tan(fov / 2)
+        return Matrix3D._from_array(np.array([
+            [f / aspect, 0.0, 0.0, 0.0],
+            [0.0, f, 0.0, 0.0],
+            [0.0, 0.0, (far + near) / (near - far),
+             2 * far * near / (near - far)],
+            [0.0, 0.0, -1.0, 0.0]]))
+
+
+'''
+Implements a NumPy array stored in a named multiprocessing.shared_memory
+block, so several processes read and write the same buffer. Vectors and
+vector arrays viewing it are pickled by block name, so passing them to a
+multiprocessing worker attaches to the block instead of copying the data.
+The process that created the block unlinks it when done.
+'''
+class SharedArray:
+    def __init__(self, shm, shape, dtype, owner=False):
+        # use create() or attach()
+        self._shm = shm
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.owner = owner
+        self.array = np.ndarray(self.shape, self.dtype, buffer=shm.buf)
+        # vectors viewing the block by id (they are unhashable), which
+        # close() must not unmap under
+        self._views = weakref.WeakValueDictionary()
+
+    @staticmethod
+    def _memory(name=None, size=0):
+        from multiprocessing import shared_memory
+
+        if name is None:
+            # zero sized blocks are not allowed
+            return shared_memory.SharedMemory(create=True, size=max(size, 1))
+        try:
+            # Python 3.13+: only the creating process tracks the block
+            return shared_memory.SharedMemory(name=name, track=False)
+        except TypeError as te:
+            return shared_memory.SharedMemory(name=name)
+
+    @classmethod
+    def create(cls, shape, dtype=float):
+        """
+        Allocates a new zero-filled shared block for an array of the given
+        shape and dtype
+        """
+        shape = (shape,) if isinstance(shape, int) else tuple(shape)
+        nbytes = math.prod(shape) * np.dtype(dtype).itemsize
+        return cls(cls._memory(size=nbytes), shape, dtype, owner=True)
+
+    @classmethod
+    def from_array(cls, data):
+        """
+        Allocates a shared block holding a copy of a Vector, VectorArray or
+        ndarray
+        """
+        arr = np.asarray(data.data if isinstance(data, (Vector, VectorArray))
+                         else data)
+        shared = cls.create(arr.shape, arr.dtype)
+        shared.array[...] = arr
+        return shared
+
+    @classmethod
+    def attach(cls, name, shape, dtype=float):
+        """
+        Opens an existing block by name, e.g. one created by another process
+        """
+        shape = (shape,) if isinstance(shape, int) else tuple(shape)
+        return cls(cls._memory(name), shape, dtype)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def vector(self, cls=Vector):
+        """
+        Returns a vector of type cls viewing the shared 1D array
+        """
+        if self.array.ndim != 1:
+            raise ValueError(f'Expected a 1D array, got shape {self.shape}')
+        return _shared_view(cls, self)
+
+    def vectors(self, cls):
+        """
+        Returns a VectorArray subclass viewing the shared (N, dim) array
+        """
+        if self.array.ndim != 2 or self.shape[1] != cls.dim:
+            raise ValueError(f'Expected an array of shape (N, {cls.dim}), '
+                             f'got {self.shape}')
+        return _shared_view(cls, self)
+
+    def close(self):
+        """
+        Detaches this process from the block. Raises BufferError while
+        vectors from vector() or vectors() still view it.
+        """
+        if self._views:
+            raise BufferError(f'{len(self._views)} vector(s) still view '
+                              f'the shared block {self.name}')
+        self.array = None
+        self._shm.close()
+
+    def unlink(self):
+        """
+        Frees the block once every process has closed it
+        """
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            self.close()
+        finally:
+            if self.owner:
+                self.unlink()
+
+    def __reduce__(self):
+        return (SharedArray.attach, (self.name, self.shape, self.dtype.str))
+
+    def __repr__(self):
+        return (f'{type(self).__name__}(name={self.name!r}, '
+                f'shape={self.shape}, dtype={self.dtype})')
+
+
+def _shared_view(cls, shared):
+    view = cls._from_array(shared.array)
+    # (block, array): pickled by name while the data is still this array
+    view._shared = (shared, shared.array)
+    shared._views[id(view)] = view
+    return view
+
+
+def _reduce_data(obj, protocol):
+    """
+    Returns the __reduce_ex__ value for a Vector or VectorArray: a reference
+    to its shared block if it views one, otherwise its data, as an
+    out-of-band PickleBuffer for protocol 5 when contiguous.
+    """
+    import pickle
+
+    (shared, data) = getattr(obj, '_shared', (None, None))
+    if shared is not None and data is obj.data:
+        return (_rebuild_shared, (type(obj), shared))
+    if type(obj.data) is array.array:
+        return (_rebuild, (type(obj), obj.data))
+    # plain ndarray, e.g. of a np.memmap, and no cached attributes
+    data = obj.data.view(np.ndarray)
+    if protocol >= 5 and data.flags.c_contiguous:
+        return (_rebuild, (type(obj), pickle.PickleBuffer(data),
+                           data.dtype.str, data.shape))
+    return (_rebuild, (type(obj), data))
+
+
+def _rebuild(cls, data, dtype=None, shape=None):
+    """
+    Unpickles a Vector or VectorArray from its array, or from a buffer which
+    is used without copying when it is writable (out-of-band buffers)
+    """
+    if dtype is not None:
+        data = np.frombuffer(data, dtype=dtype).reshape(shape)
+        if not data.flags.writeable:
+            data = data.copy()
+    return cls._from_array(data)
+
+
+def _rebuild_shared(cls, shared):
+    return _shared_view(cls, shared)
+
+
+def _rows(vectors):
+    """
+    Returns a collection of vectors (a list of Vectors or sequences, a
+    VectorArray, a 2D array, or a single vector) as a 2D floating point
+    array with one vector per row.
+    """
+    if isinstance(vectors, VectorArray):
+        arr = vectors.data
+    elif isinstance(vectors, (Vector, np.ndarray)):
+        arr = np.asarray(vectors)
+    else:
+        try:
+            rows = [x.data if isinstance(x, Vector) else x for x in vectors]
+        except TypeError as te:
+            raise TypeError('Expected a collection of vectors')
+        arr = np.array(rows)
+    if arr.ndim == 1:
+        # [] has no dimension to make an empty (0, dim) collection of, and
+        # as one vector it would be a single point in 0 dimensions
+        if len(arr) == 0:
+            raise ValueError('Expected at least one vector')
+        # a single vector
+        arr = arr[np.newaxis]
+    if arr.dtype.kind not in 'biuf':
+        raise ValueError('Invalid numeric data')
+    if arr.ndim != 2:
+        raise ValueError(f'Too many array dimensions ({arr.ndim})')
+    # float32 stays float32 for speed, integers are promoted to float64
+    return np.asarray(arr, dtype=np.result_type(arr.dtype, np.float32))
+
+
+def _is_single(vectors):
+    """
+    Returns whether vectors is one vector rather than a collection of them
+    """
+    # (Vector.ndim is its length, so np.ndim cannot be used on one)
+    return isinstance(vectors, Vector) or (
+        not isinstance(vectors, VectorArray) and np.ndim(vectors) == 1)
+
+
+def _sq_norms(arr):
+    return np.einsum('ij,ij->i', arr, arr)
+
+
+def _normalized(arr):
+    norms = np.sqrt(_sq_norms(arr))
+    norms[norms == 0] = 1 # zero vectors stay zero
+    return arr / norms[:, np.newaxis]
+
+
+def _tiles(n, step):
+    for start in range(0, n, step):
+        yield slice(start, min(start + step, n))
+
+
+def _smallest_k(keys, ids, k):
+    """
+    Returns the k smallest keys of each row and their ids, in no particular
+    order. Keys tied with the k-th smallest are taken by smallest id, so
+    the selection does not depend on how argpartition orders ties.
+    """
+    part = np.argpartition(keys, k - 1, axis=1)
+    kth = np.take_along_axis(keys, part[:, k - 1:k], axis=1)
+    part = part[:, :k]
+    # only rows with more keys tied at the boundary than fit need sorting
+    for i in np.flatnonzero(np.count_nonzero(keys <= kth, axis=1) > k):
+        part[i] = np.lexsort((ids[i], keys[i]))[:k]
+    return (np.take_along_axis(keys, part, axis=1),
+            np.take_along_axis(ids, part, axis=1))
+
+
+def _pairwise_out(x, y, out):
+    if x.shape[1] != y.shape[1]:
+        raise ValueError('Vectors must be same length')
+    if out is None:
+        return np.empty((len(x), len(y)), dtype=np.result_type(x, y))
+    if isinstance(out, Matrix):
+        out = out.data
+    if out.shape != (len(x), len(y)):
+        raise ValueError(f'out must have shape {(len(x), len(y))}')
+    return out
+
+
+def pairwise_distances(X, Y=None, out=None):
+    """
+    Returns the (N, M) array of Euclidean distances between every vector
+    of X and every vector of Y (X itself if not given). Vectors may be given
+    as lists of Vectors or stacked 2D arrays. The result is computed in row
+    blocks from |x|^2 + |y|^2 - 2 x.y, so each block is one matrix product;
+    pass a preallocated out (e.g. a np.memmap) to write large results
+    without holding them in memory.
+    """
+    x = _rows(X)
+    y = x if Y is None else _rows(Y)
+    out = _pairwise_out(x, y, out)
+    xx, yy = _sq_norms(x), _sq_norms(y)
+    for s in _tiles(len(x), max(1, _TILE_SIZE // max(1, len(y)))):
+        block = out[s]
+        np.matmul(x[s], y.T, out=block)
+        block *= -2
+        block += xx[s, np.newaxis]
+        block += yy
+        # rounding can leave tiny negatives for (nearly) equal vectors
+        np.maximum(block, 0, out=block)
+        np.sqrt(block, out=block)
+    if Y is None:
+        np.fill_diagonal(out, 0)
+    return out
+
+
+def cosine_similarity(X, Y=None, out=None):
+    """
+    Returns the (N, M) array of cosine similarities between every vector of
+    X and every vector of Y (X itself if not given), computed in row blocks
+    like pairwise_distances. Zero vectors have similarity 0 to everything.
+    """
+    x = _normalized(_rows(X))
+    y = x if Y is None else _normalized(_rows(Y))
+    out = _pairwise_out(x, y, out)
+    for s in _tiles(len(x), max(1, _TILE_SIZE // max(1, len(y)))):
+        block = out[s]
+        np.matmul(x[s], y.T, out=block)
+        np.clip(block, -1, 1, out=block)
+    return out
+
+
+def top_k_nearest(query, corpus, k, metric='euclidean'):
+    """
+    Finds the k vectors of corpus nearest to each query vector, by Euclidean
+    distance or by cosine similarity (metric='cosine'). Returns the corpus
+    indices and the distances (or similarities), nearest first, as arrays
+    of length k for a single query vector or of shape (Q, k).
+
+    The corpus is scanned in blocks, keeping only the best k candidates per
+    query between blocks with a partial sort (argpartition), so memory is
+    bounded however large the corpus is. Equally near vectors are ranked
+    by index, also at the k-th place: of several tied for it, the ones
+    with the smallest indices are returned.
+    """
+    single = _is_single(query)
+    q = _rows(query)
+    c = _rows(corpus)
+    if q.shape[1] != c.shape[1]:
+        raise ValueError('Vectors must be same length')
+    if not 0 < k <= len(c):
+        raise ValueError(f'k must be between 1 and the corpus size {len(c)}')
+    if metric == 'euclidean':
+        # ranks by |c|^2 - 2 q.c, |q|^2 is added back for the k results
+        cc = _sq_norms(c)
+    elif metric == 'cosine':
+        q, c = _normalized(q), _normalized(c)
+    else:
+        raise ValueError(f'Unknown metric {metric!r}')
+
+    columns = max(k, _TILE_COLUMNS)
+    indices = np.empty((len(q), k), dtype=np.intp)
+    keys = np.empty((len(q), k), dtype=np.result_type(q, c))
+    for qs in _tiles(len(q), max(1, _TILE_SIZE // (columns + k))):
+        best_keys = best = None
+        for cs in _tiles(len(c), columns):
+            # smaller keys are nearer
+            block = q[qs] @ c[cs].T
+            if metric == 'euclidean':
+                block *= -2
+                block += cc[cs]
+            else:
+                np.negative(block, out=block)
+            ids = np.broadcast_to(np.arange(cs.start, cs.stop), block.shape)
+            if best is not None:
+                block = np.concatenate((best_keys, block), axis=1)
+                ids = np.concatenate((best, ids), axis=1)
+            if block.shape[1] > k:
+                (block, ids) = _smallest_k(block, ids, k)
+            best_keys, best = block, ids
+        # nearest first, ties by index
+        order = np.lexsort((best, best_keys))
+        indices[qs] = np.take_along_axis(best, order, axis=1)
+        keys[qs] = np.take_along_axis(best_keys, order, axis=1)
+
+    if metric == 'euclidean':
+        keys += _sq_norms(q)[:, np.newaxis]
+        np.maximum(keys, 0, out=keys)
+        values = np.sqrt(keys, out=keys)
+    else:
+        values = np.clip(-keys, -1, 1)
+    if single:
+        return indices[0], values[0]
+    return indices, values
+
+
+'''
+Implements a KD-tree over 2D, 3D or N-dimensional points for k-nearest,
+radius and box queries that visit O(log N) nodes instead of comparing
+against every point. Points are identified by ids: their index in the
+initial sequence, then the id returned by insert().
+
+Moving points are supported without rebuilding on every change: inserted
+and updated points are kept in a small pending buffer that is searched by
+brute force, removed ones are marked dead in the tree, and the tree is
+rebuilt once either exceeds rebuild_fraction of its size.
+'''
+class KDTree:
+    def __init__(self, points, leaf_size=16, rebuild_fraction=0.1):
+        points = _rows(points)
+        if leaf_size < 1:
+            raise ValueError('leaf_size must be at least 1')
+        self.dim = points.shape[1]
+        self.leaf_size = leaf_size
+        self.rebuild_fraction = rebuild_fraction
+        self._element = {2: Vector2D, 3: Vector3D}.get(self.dim, Vector)
+        # current coordinates by id, with spare capacity for inserts
+        self._points = np.array(points, dtype=float)
+        self._size = len(points)
+        self._alive = np.ones(len(points), dtype=bool)
+        self._count = len(points)
+        self._pending = {}
+        self._pending_cache = None
+        self.rebuild()
+
+    def rebuild(self):
+        """
+        Builds the tree over all live points, emptying the pending buffer.
+        Nodes split their points at the median of the widest dimension and
+        store their bounding box and contiguous range of the point order.
+        """
+        ids = np.flatnonzero(self._alive[:self._size])
+        pts = self._points[ids]
+        order = np.arange(len(ids))
+        starts, ends, left, right, lo, hi = [], [], [], [], [], []
+
+        def build(s, e):
+            node = len(starts)
+            starts.append(s)
+            ends.append(e)
+            left.append(-1)
+            right.append(-1)
+            seg = pts[order[s:e]]
+            lo.append(seg.min(axis=0) if e > s else np.zeros(self.dim))
+            hi.append(seg.max(axis=0) if e > s else np.zeros(self.dim))
+            if e - s > self.leaf_size:
+                split = int(np.argmax(hi[node] - lo[node]))
+                mid = (s + e) // 2
+                order[s:e] = order[s:e][np.argpartition(seg[:, split], mid - s)]
+                left[node] = build(s, mid)
+                right[node] = build(mid, e)
+            return node
+
+        build(0, len(ids))
+        self._ids = ids[order]
+        self._tree_points = pts[order]
+        self._in_tree = np.zeros(len(self._alive), dtype=bool)
+        self._in_tree[ids] = True
+        self._dead = 0
+        self._starts, self._ends = starts, ends
+        self._left, self._right = left, right
+        # plain lists, traversal compares single coordinates
+        self._lo = np.array(lo).tolist()
+        self._hi = np.array(hi).tolist()
+        self._pending.clear()
+        self._pending_cache = None
+
+    def _point(self, point):
+        p = np.asarray(point.data if isinstance(point, Vector) else point)
+        if p.shape != (self.dim,):
+            raise ValueError(f'Expected a point with {self.dim} dimensions')
+        return p.astype(float)
+
+    def _maybe_rebuild(self):
+        limit = max(self.leaf_size, self.rebuild_fraction * len(self._ids))
+        if len(self._pending) > limit or self._dead > limit:
+            self.rebuild()
+
+    def _check_id(self, id):
+        if not (0 <= id < self._size and self._alive[id]):
+            raise KeyError(id)
+
+    def insert(self, point):
+        """
+        Adds a point and returns its id
+        """
+        p = self._point(point)
+        if self._size == len(self._points):
+            capacity = max(2 * self._size, 16)
+            points = np.empty((capacity, self.dim))
+            points[:self._size] = self._points[:self._size]
+            self._points = points
+            alive = np.zeros(capacity, dtype=bool)
+            alive[:self._size] = self._alive[:self._size]
+            self._alive = alive
+            in_tree = np.zeros(capacity, dtype=bool)
+            in_tree[:len(self._in_tree)] = self._in_tree
+            self._in_tree = in_tree
+        id = self._size
+        self._size += 1
+        self._points[id] = p
+        self._alive[id] = True
+        self._count += 1
+        self._pending[id] = None
+        self._pending_cache = None
+        self._maybe_rebuild()
+        return id
+
+    def remove(self, id):
+        self._check_id(id)
+        self._alive[id] = False
+        self._count -= 1
+        self._discard(id)
+        self._maybe_rebuild()
+
+    def update(self, id, point):
+        """
+        Moves the point with the given id
+        """
+        self._check_id(id)
+        p = self._point(point)
+        self._discard(id)
+        self._points[id] = p
+        self._pending[id] = None
+        self._pending_cache = None
+        self._maybe_rebuild()
+
+    def _discard(self, id):
+        if self._in_tree[id]:
+            self._in_tree[id] = False
+            self._dead += 1
+        else:
+            del self._pending[id]
+            self._pending_cache = None
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, id):
+        self._check_id(id)
+        return self._element(self._points[id].copy())
+
+    def _pending_points(self):
+        if self._pending_cache is None:
+            ids = np.fromiter(self._pending, dtype=np.intp,
+                              count=len(self._pending))
+            self._pending_cache = ids, self._points[ids]
+        return self._pending_cache
+
+    @staticmethod
+    def _box_distance2(lo, hi, p):
+        """
+        Returns the squared distance from p to the box lo..hi, and from p
+        to the box's farthest corner
+        """
+        near = far = 0.0
+        for (l, h, x) in zip(lo, hi, p):
+            if x < l:
+                near += (l - x)**2
+            elif x > h:
+                near += (x - h)**2
+            far += max(x - l, h - x)**2
+        return near, far
+
+    def _nearest(self, p, k):
+        # max-heap of (-squared distance, -id) of the best k so far
+        best = []
+        ids, pts = self._pending_points()
+        d2 = ((pts - p)**2).sum(axis=1)
+        for (d, i) in zip(d2.tolist(), ids.tolist()):
+            heapq.heappush(best, (-d, -i))
+            if len(best) > k:
+                heapq.heappop(best)
+        q = p.tolist()
+        heap = [(0.0, 0)]
+        while heap:
+            (d, node) = heapq.heappop(heap)
+            if len(best) == k and d > -best[0][0]:
+                break
+            left = self._left[node]
+            if left >= 0:
+                for child in (left, self._right[node]):
+                    d = self._box_distance2(self._lo[child], self._hi[child], q)[0]
+                    if len(best) < k or d <= -best[0][0]:
+                        heapq.heappush(heap, (d, child))
+                continue
+            s, e = self._starts[node], self._ends[node]
+            d2 = ((self._tree_points[s:e] - p)**2).sum(axis=1)
+            ids = self._ids[s:e]
+            for (d, i, live) in zip(d2.tolist(), ids.tolist(),
+                                    self._in_tree[ids].tolist()):
+                if live and (len(best) < k or (-d, -i) > best[0]):
+                    heapq.heappush(best, (-d, -i))
+                    if len(best) > k:
+                        heapq.heappop(best)
+        best.sort(reverse=True)
+        return ([-i for (d, i) in best], [math.sqrt(-d) for (d, i) in best])
+
+    def nearest(self, points, k=1):
+        """
+        Finds the k points nearest to a point, or to each of a batch of
+        points. Returns the ids and distances, nearest first (ties by id),
+        as arrays of length k for a single point or of shape (Q, k).
+        """
+        if not 0 < k <= len(self):
+            raise ValueError(f'k must be between 1 and the number of points '
+                             f'{len(self)}')
+        if _is_single(points):
+            ids, dists = self._nearest(self._point(points), k)
+            return np.array(ids, dtype=np.intp), np.array(dists)
+        results = [self._nearest(p, k) for p in _rows(points).astype(float)]
+        return (np.array([ids for (ids, dists) in results],
+                         dtype=np.intp).reshape(-1, k),
+                np.array([dists for (ids, dists) in results]).reshape(-1, k))
+
+    def _collect(self, inside, contains, filter):
+        """
+        Returns the sorted ids of live points in the nodes that overlap the
+        query region, taking whole subtrees the region contains and testing
+        points of partly covered leaves with filter
+        """
+        ids, pts = self._pending_points()
+        found = [ids[filter(pts)]]
+        stack = [0] if self._ids.size else []
+        while stack:
+            node = stack.pop()
+            lo, hi = self._lo[node], self._hi[node]
+            if not inside(lo, hi):
+                continue
+            s, e = self._starts[node], self._ends[node]
+            if contains(lo, hi):
+                ids = self._ids[s:e]
+            elif self._left[node] >= 0:
+                stack += (self._left[node], self._right[node])
+                continue
+            else:
+                ids = self._ids[s:e][filter(self._tree_points[s:e])]
+            found.append(ids[self._in_tree[ids]])
+        return np.sort(np.concatenate(found))
+
+    def _within_radius(self, p, r):
+        q = p.tolist()
+        r2 = r*r
+        return self._collect(
+            lambda lo, hi: self._box_distance2(lo, hi, q)[0] <= r2,
+            lambda lo, hi: self._box_distance2(lo, hi, q)[1] <= r2,
+            lambda pts: ((pts - p)**2).sum(axis=1) <= r2)
+
+    def within_radius(self, points, r):
+        """
+        Returns the sorted ids of the points within distance r of a point,
+        or a list of them for each of a batch of points
+        """
+        if _is_single(points):
+            return self._within_radius(self._point(points), r)
+        return [self._within_radius(p, r) for p in _rows(points).astype(float)]
+
+    def within_box(self, lo, hi):
+        """
+        Returns the sorted ids of the points inside the axis-aligned box with
+        corners lo and hi, including its boundary
+        """
+        lo, hi = self._point(lo), self._point(hi)
+        l, h = lo.tolist(), hi.tolist()
+        return self._collect(
+            lambda a, b: all(x <= y for (x, y) in zip(l, b))
+                         and all(x <= y for (x, y) in zip(a, h)),
+            lambda a, b: all(x <= y for (x, y) in zip(l, a))
+                         and all(x <= y for (x, y) in zip(b, h)),
+            lambda pts: np.all((pts >= lo) & (pts <= hi), axis=1))
+
+    def __repr__(self):
+        return f'{type(self).__name__}({len(self)} points, dim={self.dim})'
+
+
+# vectors added one at a time are buffered and summarized this many at once
+_STATS_BUFFER_ROWS = 256
+
+
+def _merge_moments(n_a, mean_a, m2_a, n_b, mean_b, m2_b):
+    """
+    Returns the mean and sum of squared deviations of two sets of samples
+    from those of each (Chan et al.), and the difference of their means.
+    Works on scalars and per-coordinate arrays alike.
+    """
+    n = n_a + n_b
+    delta = mean_b - mean_a
+    mean = mean_a + delta * (n_b / n)
+    m2 = m2_a + m2_b + delta * delta * (n_a * n_b / n)
+    return mean, m2, delta
+
+
+'''
+Accumulates statistics of a stream of real vectors of the same dimension,
+in O(dimension) memory (O(dimension^2) with the covariance) however many
+are added: the mean and variance of each coordinate, optionally the
+covariance matrix, the axis-aligned bounds, and the mean, variance and
+range of the vector norms. Vectors are added one at a time with add() or
+in batches with add_batch(), and the accumulators of parts of a stream
+(e.g. computed by different workers) are combined with merge().
+'''
+class VectorStats:
+    def __init__(self, covariance=False):
+        self.dim = None
+        self._covariance = covariance
+        # vector type of the results, of the first vectors added
+        self._element = None
+        self._n = 0
+        # per coordinate mean, sum of squared deviations and bounds
+        self._mean = self._m2 = self._lo = self._hi = None
+        # sum of the outer products of the deviations
+        self._comoment = None
+        # (mean, sum of squared deviations, min, max) of the norms
+        self._norms = None
+        self._buffer = None
+        self._pending = 0
+
+    def _start(self, dim, element):
+        if self.dim is None:
+            self.dim = dim
+            self._element = element
+        elif dim != self.dim:
+            raise ValueError(f'Expected vectors with {self.dim} dimensions, '
+                             f'got {dim}')
+
+    '''
+    Adds one vector (a Vector or a sequence of numbers)
+    '''
+    def add(self, v):
+        if isinstance(v, CVector):
+            raise ValueError('Complex vectors are not supported')
+        x = v.data if isinstance(v, Vector) else v
+        if self._buffer is None:
+            self._start(len(x), type(v) if isinstance(v, Vector) else Vector)
+            self._buffer = np.empty((_STATS_BUFFER_ROWS, self.dim))
+        elif len(x) != self.dim:
+            raise ValueError(f'Expected vectors with {self.dim} dimensions, '
+                             f'got {len(x)}')
+        self._buffer[self._pending] = x
+        self._pending += 1
+        if self._pending == _STATS_BUFFER_ROWS:
+            self._flush()
+
+    '''
+    Adds a batch of vectors: a VectorArray, an (N, dim) array or an
+    iterable of vectors
+    '''
+    def add_batch(self, vectors):
+        element = Vector
+        if isinstance(vectors, VectorArray):
+            (arr, element) = (vectors.data, vectors.element)
+        elif isinstance(vectors, np.ndarray):
+            arr = vectors
+        else:
+            vectors = list(vectors)
+            if vectors and isinstance(vectors[0], Vector):
+                element = type(vectors[0])
+            arr = np.array([v.data if isinstance(v, Vector) else v
+                            for v in vectors])
+        if arr.dtype.kind == 'c':
+            raise ValueError('Complex vectors are not supported')
+        if arr.size == 0:
+            return
+        if arr.dtype.kind not in _NUMERIC_KINDS or arr.ndim != 2:
+            raise ValueError(f'Expected an array of shape (N, dim), '
+                             f'got {arr.shape}')
+        self._start(arr.shape[1], element)
+        # bounded temporaries for huge batches
+        step = max(1, _CHUNK_SIZE // self.dim)
+        for start in range(0, len(arr), step):
+            self._add_rows(arr[start:start + step])
+
+    def _add_rows(self, x):
+        x = np.asarray(x, dtype=float)
+        mean = x.mean(axis=0)
+        d = x - mean
+        comoment = d.T @ d if self._covariance else None
+        norms = np.sqrt(np.einsum('ij,ij->i', x, x))
+        norm_mean = norms.mean()
+        norm_d = norms - norm_mean
+        self._combine(len(x), mean, np.einsum('ij,ij->j', d, d), comoment,
+                      x.min(axis=0), x.max(axis=0),
+                      (norm_mean, norm_d.dot(norm_d), norms.min(),
+                       norms.max()))
+
+    def _flush(self):
+        if self._pending:
+            n, self._pending = self._pending, 0
+            self._add_rows(self._buffer[:n])
+
+    def _combine(self, n, mean, m2, comoment, lo, hi, norms):
+        """
+        Merges the statistics of n other vectors into the accumulator
+        """
+        if self._n == 0:
+            self._n = n
+            (self._mean, self._m2, self._lo, self._hi) = (
+                mean.copy(), m2.copy(), lo.copy(), hi.copy())
+            self._comoment = comoment.copy() if self._covariance else None
+            self._norms = norms
+            return
+        n_a = self._n
+        (self._mean, self._m2, delta) = _merge_moments(
+            n_a, self._mean, self._m2, n, mean, m2)
+        if self._comoment is not None:
+            self._comoment += comoment + np.outer(delta, delta) * (
+                n_a * n / (n_a + n))
+        np.minimum(self._lo, lo, out=self._lo)
+        np.maximum(self._hi, hi, out=self._hi)
+        (norm_mean, norm_m2, _) = _merge_moments(
+            n_a, self._norms[0], self._norms[1], n, norms[0], norms[1])
+        self._norms = (norm_mean, norm_m2, min(self._norms[2], norms[2]),
+                       max(self._norms[3], norms[3]))
+        self._n += n
+
+    '''
+    Adds the statistics of another accumulator of vectors of the same
+    dimension, as if its vectors had been added to this one, and returns
+    this one
+    '''
+    def merge(self, other):
+        if not isinstance(other, VectorStats):
+            raise TypeError("Other must be a VectorStats")
+        if self._covariance and not other._covariance and other.count:
+            raise ValueError("Other does not accumulate the covariance")
+        other._flush()
+        if other._n == 0:
+            return self
+        self._flush()
+        self._start(other.dim, other._element)
+        self._combine(other._n, other._mean, other._m2, other._comoment,
+                      other._lo, other._hi, other._norms)
+        return self
+
+    '''
+    Returns the number of vectors added
+    '''
+    @property
+    def count(self):
+        return self._n + self._pending
 
-    def __sub__(self, other):
-        return CVector(super().__sub__(other).data)
+    def _summary(self, ddof=0):
+        self._flush()
+        if self._n <= ddof:
+            raise ValueError(f'Needs more than {ddof} vectors, '
+                             f'got {self._n}')
+        return self._n - ddof
 
-    def __mul__(self, other):
-        return CVector(super().__mul__(other).data)
+    '''
+    Returns the mean vector
+    '''
+    @property
+    def mean(self):
+        self._summary()
+        return self._element._from_array(self._mean.copy())
 
-    def __truediv__(self, other):
-        return CVector(super().__truediv__(other).data)
+    '''
+    Returns the variance of each coordinate, dividing by count - ddof
+    (ddof=1 for the unbiased sample variance)
+    '''
+    def variance(self, ddof=0):
+        n = self._summary(ddof)
+        return self._element._from_array(self._m2 / n)
 
-    def __neg__(self):
-        return CVector(-(self.data))
+    '''
+    Returns the standard deviation of each coordinate
+    '''
+    def std(self, ddof=0):
+        n = self._summary(ddof)
+        return self._element._from_array(np.sqrt(self._m2 / n))
 
-    def __rmul__(self, other):
-        return CVector(other*(self.data))
+    '''
+    Returns the covariance Matrix of the coordinates, dividing by
+    count - ddof. Needs VectorStats(covariance=True).
+    '''
+    def covariance(self, ddof=0):
+        if not self._covariance:
+            raise ValueError('Covariance is not accumulated, '
+                             'use VectorStats(covariance=True)')
+        n = self._summary(ddof)
+        return Matrix._from_array(self._comoment / n)
 
     '''
-    Returns a deep copy of the vector
+    Returns the axis-aligned bounding box of the vectors as (lo, hi)
     '''
-    def copy(self):
-        return CVector(self.data.copy())
+    @property
+    def bounds(self):
+        self._summary()
+        return (self._element._from_array(self._lo.copy()),
+                self._element._from_array(self._hi.copy()))
 
-    @staticmethod
-    def zeros(n):
-        return CVector(np.zeros(n))
+    '''
+    Returns the mean of the norms of the vectors
+    '''
+    @property
+    def norm_mean(self):
+        self._summary()
+        return float(self._norms[0])
 
     '''
-    Returns a complex conjugate version of the vector
+    Returns the variance of the norms, dividing by count - ddof
     '''
-    def CC(self):
-        return CVector(np.conj(self.data))
+    def norm_variance(self, ddof=0):
+        n = self._summary(ddof)
+        return float(self._norms[1] / n)
 
     '''
-    Do an inner product in complex vector (Hilbert) space
+    Returns the smallest and largest norms as (min, max)
     '''
-    def dot(self, other):
-        return Vector.dot(self.CC(), other)
+    @property
+    def norm_range(self):
+        self._summary()
+        return (float(self._norms[2]), float(self._norms[3]))
+
+    def __getstate__(self):
+        # pickled without the buffer, e.g. to merge results of workers
+        self._flush()
+        state = dict(self.__dict__)
+        state['_buffer'] = None
+        return state
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.count} vectors, dim={self.dim})'
 
 
 '''
-Implements an 2-dimensional vector of real numbers.
+Implements a lightweight 2-dimensional vector of floats. Stores the two
+components in __slots__ and uses plain float math, which is smaller and
+faster than Vector2D for single small vectors.
 '''
-class Vector2D(Vector):
+class FastVector2D:
+    __slots__ = ('X', 'Y')
+
     def __init__(self, *args):
         n = len(args)
-        if n == 2:
-            super().__init__(args)
-        elif n == 1:
-            if isinstance(args[0], Vector):
-                if len(args[0]) != 2:
-                    raise ValueError('Only 2 dimensions are allowed')
-            elif len(args[0]) != 2:
-                raise TypeError('Only 2 dimensions are allowed')
-            super().__init__(args[0])
-        else:
+        if n == 1:
+            data = args[0]
+            if isinstance(data, Vector):
+                data = data.data.tolist()
+            try:
+                args = tuple(data)
+            except TypeError as te:
+                raise TypeError('Invalid iterable data')
+            n = len(args)
+        if n != 2:
             raise TypeError('Only 2 dimensions are allowed')
+        if not all(isinstance(x, Number) for x in args):
+            raise ValueError('Invalid numeric data')
+        self.X = float(args[0])
+        self.Y = float(args[1])
+
+    @classmethod
+    def _new(cls, x, y):
+        """
+        Creates a vector from float components without validating them
+        """
+        vec = object.__new__(cls)
+        vec.X = x
+        vec.Y = y
+        return vec
+
+    @property
+    def XY(self):
+        return (self.X, self.Y)
+
+    def __iter__(self):
+        yield self.X
+        yield self.Y
 
+    def __len__(self):
+        return 2
+
+    def __getitem__(self, key):
+        return (self.X, self.Y)[key]
+
+    def __eq__(self, other):
+        if isinstance(other, FastVector2D):
+            return self.X == other.X and self.Y == other.Y
+        elif isinstance(other, (Vector, list, tuple)):
+            other = list(other)
+            return len(other) == 2 and all(x == y for (x, y) in zip(self, other))
+        else:
+            return False
 
     def __add__(self, other):
-        return Vector2D(super().__add__(other).data)
+        if isinstance(other, FastVector2D):
+            return self._new(self.X + other.X, self.Y + other.Y)
+        elif isinstance(other, Number):
+            return self._new(self.X + other, self.Y + other)
+        return NotImplemented
 
     def __sub__(self, other):
-        return Vector2D(super().__sub__(other).data)
+        if isinstance(other, FastVector2D):
+            return self._new(self.X - other.X, self.Y - other.Y)
+        elif isinstance(other, Number):
+            return self._new(self.X - other, self.Y - other)
+        return NotImplemented
 
+    def __neg__(self):
+        return self._new(-self.X, -self.Y)
+
+    '''
+    Returns scalar or elementwise multiplication of vector
+    '''
     def __mul__(self, other):
-        return Vector2D(super().__mul__(other).data)
+        if isinstance(other, Number):
+            return self._new(other * self.X, other * self.Y)
+        elif isinstance(other, FastVector2D):
+            return self._new(self.X * other.X, self.Y * other.Y)
+        return NotImplemented
+
+    __rmul__ = __mul__
 
     def __truediv__(self, other):
-        return Vector2D(super().__truediv__(other).data)
+        if isinstance(other, Number):
+            return self._new(self.X / other, self.Y / other)
+        elif isinstance(other, FastVector2D):
+            return self._new(self.X / other.X, self.Y / other.Y)
+        return NotImplemented
 
-    def __neg__(self):
-        return Vector2D(-(self.data))
+    def __iadd__(self, other):
+        if isinstance(other, FastVector2D):
+            self.X += other.X
+            self.Y += other.Y
+        elif isinstance(other, Number):
+            self.X += other
+            self.Y += other
+        else:
+            raise TypeError("Other must be a scalar or FastVector2D")
+        return self
 
-    def __rmul__(self, other):
-        return Vector2D(other*(self.data))
+    def __isub__(self, other):
+        if isinstance(other, FastVector2D):
+            self.X -= other.X
+            self.Y -= other.Y
+        elif isinstance(other, Number):
+            self.X -= other
+            self.Y -= other
+        else:
+            raise TypeError("Other must be a scalar or FastVector2D")
+        return self
+
+    def __imul__(self, other):
+        if not isinstance(other, Number):
+            raise TypeError("Other must be a scalar")
+        self.X *= other
+        self.Y *= other
+        return self
+
+    def __itruediv__(self, other):
+        if not isinstance(other, Number):
+            raise TypeError("Other must be a scalar")
+        self.X /= other
+        self.Y /= other
+        return self
 
-    @property
-    def X(self):
-        return self.data[0]
+    def dot(self, other):
+        return self.X*other.X + self.Y*other.Y
 
-    @property
-    def Y(self):
-        return self.data[1]
+    def __abs__(self):
+        return math.hypot(self.X, self.Y)
 
-    @property
-    def XY(self):
-        return (self.data[0], self.data[1])
+    def copy(self):
+        return self._new(self.X, self.Y)
 
-    @X.setter
-    def X(self, x):
-        self.data[0] = x
+    def __str__(self):
+        return f'[{self.X} {self.Y}]'
 
-    @Y.setter
-    def Y(self, y):
-        self.data[1] = y
+    def __repr__(self):
+        return f'FastVector2D({self.X!r}, {self.Y!r})'
+
+    '''
+    Returns an equivalent ndarray-backed Vector2D
+    '''
+    def to_vector(self):
+        return Vector2D._from_array(np.array([self.X, self.Y]))
+
+    @staticmethod
+    def zero():
+        return FastVector2D._new(0.0, 0.0)
 
     def angle(self):
         """
-        Returns the angle, measured as 0 radians from x-axis, in radians
+        Returns the angle, measured as 0 radians from x-axis, in radians,
+        with the same conventions as Vector2D.angle
         """
-        x, y = self.XY
+        x, y = self.X, self.Y
 
         if x == 0:
             return math.pi/2 if y > 0 else -math.pi/2
@@ -311,135 +3129,208 @@ class Vector2D(Vector):
         if y == 0:
             return 0 if x > 0 else math.pi
 
-        angle = math.atan2(y, x)
-
-        return angle
+        return math.atan2(y, x)
 
     @staticmethod
     def create_from_angle(angle, length):
         """
-        Creates a vector according to the angle and length of the vector.
-
-        Angle: an angle in radians, where the angle is measured from 0 on the x-axis,
-        and angle goes from -180 (on the bottom) to +180 (on the top).
-        Length: must be a scalar number
+        Creates a vector according to the angle and length of the vector,
+        see Vector2D.create_from_angle
         """
-        # convert to radians
-        x = length * math.cos(angle)
-        y = length * math.sin(angle)
-        return Vector2D([x, y])
-
-    '''
-    Returns a deep copy of the vector
-    '''
-    def copy(self):
-        return Vector2D(self.data.copy())
-
-    @staticmethod
-    def zero():
-        return Vector2D(np.zeros(2))
+        return FastVector2D._new(length * math.cos(angle),
+                                 length * math.sin(angle))
 
     @staticmethod
     def angle_between(u, v):
         """
-        Finds the angle of v w.r.t to u.
-
-        :param u: Reference vector to measure angle to
-        :param v: Vector to measure angle of w.r.t u
-        :return: Angle between the two vectors, where 0 means they point in the same direction
-        -90 means v points to the west of u, etc. 0 is returned if either is a zero vector.
+        Finds the angle of v w.r.t to u, see Vector2D.angle_between
         """
-        if u == Vector2D.zero() or v == Vector2D.zero():
-            return 0
-        # Use dot product to find angle
-        angle = math.acos(Vector2D.dot(u, v) / (abs(u) * abs(v)))
-
-        u_angle = u.angle()
-        v_angle = v.angle()
-
-        if u_angle >= 0:
-            if v_angle < u_angle:
-                return -angle if v_angle > u_angle - math.pi else angle
-            else:
-                return angle
-        else:
-            if v_angle > u_angle:
-                return angle if v_angle <= u_angle + math.pi else -angle
-            else:
-                return -angle
+        cross = u.X*v.Y - u.Y*v.X
+        dot = u.X*v.X + u.Y*v.Y
+        return math.atan2(cross + 0.0, dot + 0.0)
 
 
 '''
-Implements an 3-dimensional vector of real numbers.
+Implements a lightweight 3-dimensional vector of floats, see FastVector2D.
 '''
-class Vector3D(Vector):
+class FastVector3D:
+    __slots__ = ('X', 'Y', 'Z')
+
     def __init__(self, *args):
         n = len(args)
-        if n == 3:
-            super().__init__(args)
-        elif n == 1:
-            if isinstance(args[0], Vector):
-                if len(args[0]) != 3:
-                    raise ValueError('Only 3 dimensions are allowed')
-            elif len(args[0]) != 3:
-                raise TypeError('Only 3 dimensions are allowed')
-            super().__init__(args[0])
-        else:
+        if n == 1:
+            data = args[0]
+            if isinstance(data, Vector):
+                data = data.data.tolist()
+            try:
+                args = tuple(data)
+            except TypeError as te:
+                raise TypeError('Invalid iterable data')
+            n = len(args)
+        if n != 3:
             raise TypeError('Only 3 dimensions are allowed')
+        if not all(isinstance(x, Number) for x in args):
+            raise ValueError('Invalid numeric data')
+        self.X = float(args[0])
+        self.Y = float(args[1])
+        self.Z = float(args[2])
+
+    @classmethod
+    def _new(cls, x, y, z):
+        """
+        Creates a vector from float components without validating them
+        """
+        vec = object.__new__(cls)
+        vec.X = x
+        vec.Y = y
+        vec.Z = z
+        return vec
+
+    @property
+    def XYZ(self):
+        return (self.X, self.Y, self.Z)
+
+    def __iter__(self):
+        yield self.X
+        yield self.Y
+        yield self.Z
+
+    def __len__(self):
+        return 3
+
+    def __getitem__(self, key):
+        return (self.X, self.Y, self.Z)[key]
 
+    def __eq__(self, other):
+        if isinstance(other, FastVector3D):
+            return self.X == other.X and self.Y == other.Y and self.Z == other.Z
+        elif isinstance(other, (Vector, list, tuple)):
+            other = list(other)
+            return len(other) == 3 and all(x == y for (x, y) in zip(self, other))
+        else:
+            return False
 
     def __add__(self, other):
-        return Vector3D(super().__add__(other).data)
+        if isinstance(other, FastVector3D):
+            return self._new(self.X + other.X, self.Y + other.Y,
+                             self.Z + other.Z)
+        elif isinstance(other, Number):
+            return self._new(self.X + other, self.Y + other, self.Z + other)
+        return NotImplemented
 
     def __sub__(self, other):
-        return Vector3D(super().__sub__(other).data)
+        if isinstance(other, FastVector3D):
+            return self._new(self.X - other.X, self.Y - other.Y,
+                             self.Z - other.Z)
+        elif isinstance(other, Number):
+            return self._new(self.X - other, self.Y - other, self.Z - other)
+        return NotImplemented
+
+    def __neg__(self):
+        return self._new(-self.X, -self.Y, -self.Z)
 
+    '''
+    Returns scalar or elementwise multiplication of vector
+    '''
     def __mul__(self, other):
-        return Vector3D(super().__mul__(other).data)
+        if isinstance(other, Number):
+            return self._new(other * self.X, other * self.Y, other * self.Z)
+        elif isinstance(other, FastVector3D):
+            return self._new(self.X * other.X, self.Y * other.Y,
+                             self.Z * other.Z)
+        return NotImplemented
 
-    def __truediv__(self, other):
-        return Vector3D(super().__truediv__(other).data)
+    __rmul__ = __mul__
 
-    def __neg__(self):
-        return Vector3D(-(self.data))
+    def __truediv__(self, other):
+        if isinstance(other, Number):
+            return self._new(self.X / other, self.Y / other, self.Z / other)
+        elif isinstance(other, FastVector3D):
+            return self._new(self.X / other.X, self.Y / other.Y,
+                             self.Z / other.Z)
+        return NotImplemented
 
-    def __rmul__(self, other):
-        return Vector3D(other*(self.data))
+    def __iadd__(self, other):
+        if isinstance(other, FastVector3D):
+            self.X += other.X
+            self.Y += other.Y
+            self.Z += other.Z
+        elif isinstance(other, Number):
+            self.X += other
+            self.Y += other
+            self.Z += other
+        else:
+            raise TypeError("Other must be a scalar or FastVector3D")
+        return self
 
-    @property
-    def X(self):
-        return self.data[0]
+    def __isub__(self, other):
+        if isinstance(other, FastVector3D):
+            self.X -= other.X
+            self.Y -= other.Y
+            self.Z -= other.Z
+        elif isinstance(other, Number):
+            self.X -= other
+            self.Y -= other
+            self.Z -= other
+        else:
+            raise TypeError("Other must be a scalar or FastVector3D")
+        return self
+
+    def __imul__(self, other):
+        if not isinstance(other, Number):
+            raise TypeError("Other must be a scalar")
+        self.X *= other
+        self.Y *= other
+        self.Z *= other
+        return self
+
+    def __itruediv__(self, other):
+        if not isinstance(other, Number):
+            raise TypeError("Other must be a scalar")
+        self.X /= other
+        self.Y /= other
+        self.Z /= other
+        return self
 
-    @property
-    def Y(self):
-        return self.data[1]
+    def dot(self, other):
+        return self.X*other.X + self.Y*other.Y + self.Z*other.Z
 
-    @property
-    def Z(self):
-        return self.data[2]
+    def __abs__(self):
+        return math.sqrt(self.X*self.X + self.Y*self.Y + self.Z*self.Z)
 
-    @property
-    def XYZ(self):
-        return (self.data[0], self.data[1], self.data[2])
+    '''
+    Returns vector cross product
+    '''
+    def cross(self, other):
+        if isinstance(other, FastVector3D):
+            return self._new(self.Y*other.Z - self.Z*other.Y,
+                             self.Z*other.X - self.X*other.Z,
+                             self.X*other.Y - self.Y*other.X)
+        else:
+            raise TypeError("Other must be a FastVector3D")
 
-    @X.setter
-    def X(self, x):
-        self.data[0] = x
+    def copy(self):
+        return self._new(self.X, self.Y, self.Z)
 
-    @Y.setter
-    def Y(self, y):
-        self.data[1] = y
+    def __str__(self):
+        return f'[{self.X} {self.Y} {self.Z}]'
 
-    @Z.setter
-    def Z(self, z):
-        self.data[2] = z
+    def __repr__(self):
+        return f'FastVector3D({self.X!r}, {self.Y!r}, {self.Z!r})'
 
     '''
-    Gets spherical coordinates (physics standard) for the vector
+    Returns an equivalent ndarray-backed Vector3D
+    '''
+    def to_vector(self):
+        return Vector3D._from_array(np.array([self.X, self.Y, self.Z]))
 
-    r: radial distance from origin
-    theta: polar angle (0 to pi), where theta=0 in z-axis
-    phi: azimuthal angle (0 to 2pi), where phi=0 in x-axis
+    @staticmethod
+    def zero():
+        return FastVector3D._new(0.0, 0.0, 0.0)
+
+    '''
+    Gets spherical coordinates (physics standard) for the vector,
+    see Vector3D.getSphericalCoords
     '''
     def getSphericalCoords(self):
         r = abs(self)
@@ -448,61 +3339,29 @@ class Vector3D(Vector):
         return (r, theta, phi)
 
     '''
-    Gets cylindrical coordinates for the vector
-
-    s: radial distance from origin
-    phi: azimuthal angle (0 to 2pi), where phi=0 in x-axis
-    z: height from origin
+    Gets cylindrical coordinates for the vector,
+    see Vector3D.getCylindricalCoords
     '''
     def getCylindricalCoords(self):
         s = math.sqrt(self.X**2 + self.Y**2)
         phi = math.atan2(self.Y, self.X)
-        z = self.Z
-        return (s, phi, z)
+        return (s, phi, self.Z)
 
     '''
     Creates a 3D vector using spherical coordinates (physics standard)
-
-    r: radial distance from origin
-    theta: polar angle (0 to pi), where theta=0 in z-axis
-    phi: azimuthal angle (0 to 2pi), where phi=0 in x-axis
     '''
     @staticmethod
     def createSpherical(r, theta, phi):
         x = r*math.sin(theta)*math.cos(phi)
         y = r*math.sin(theta)*math.sin(phi)
         z = r*math.cos(theta)
-        return Vector3D(x, y, z)
+        return FastVector3D._new(x, y, z)
 
     '''
     Creates a 3D vector using cylindrical coordinates
-
-    s: radial distance from origin
-    phi: azimuthal angle (0 to 2pi), where phi=0 in x-axis
-    z: height from origin
     '''
     @staticmethod
     def createCylindrical(s, phi, z):
         x = s*math.cos(phi)
         y = s*math.sin(phi)
-        z = z
-        return Vector3D(x, y, z)
-
-    '''
-    Returns a deep copy of the vector
-    '''
-    def copy(self):
-        return Vector3D(self.data.copy())
-
-    @staticmethod
-    def zero():
-        return Vector3D(np.zeros(3))
-
-    '''
-    Returns vector cross product
-    '''
-    def cross(self, other):
-        if isinstance(other, Vector3D):
-            return Vector3D(np.cross(self.data, other.data))
-        else:
-            raise TypeError("Other must be a Vector3D")
+        return FastVector3D._new(x, y, float(z))
@@ -1,17 +1,32 @@
+import argparse
+import builtins
+import collections
+import functools
+import itertools
+import keyword
+import math
+import operator
+import os
 import sys
+import time
+
+def _sum(args):
+    # plain left to right addition, like the code Program generates: sum()
+    # of floats is compensated from Python 3.12 and would round differently
+    return functools.reduce(operator.add, args, 0)
+
 def execOp(op, *args):
     if len(args) < 2:
-        raise TypeError(op + " operation needs at least 2 arguments! " + len(args) + " given.")
+        raise TypeError(op + " operation needs at least 2 arguments! " + str(len(args)) + " given.")
 
     ans = args[0]
 
     if op == '+':
-        ans = sum(args)
+        ans = _sum(args)
     elif op == '-':
-        ans -= sum(args[1:])
+        ans -= _sum(args[1:])
     elif op == 'x':
-        for x in args[1:]:
-            ans *= x
+        ans = math.prod(args)
     elif op == '/':
         for x in args[1:]:
             ans /= x
@@ -31,23 +46,442 @@ def parseLine(tokens):
 def isOp(c):
     return (c == '+' or c == '-' or c == 'x' or c == '/' or c == '//')
 
-if __name__ == "__main__":
+def _isNumber(c):
+    try:
+        float(c)
+    except ValueError:
+        return False
+    return True
+
+def isVariable(c):
+    return (c.isidentifier() and not isOp(c) and not keyword.iskeyword(c)
+            and not c.startswith('_'))
+
+def tokenize(lines):
+    """
+    Yields the whitespace separated tokens of an iterable of lines, such as
+    an open file or sys.stdin, without reading it all into memory
+    """
+    for line in lines:
+        yield from line.split()
+
+# operators whose chains "a b op c op" are the same left fold as "a b c op",
+# and so can be reduced by one execOp call. Not '-', where a b - c - is
+# (a - b) - c but a b c - is a - (b + c).
+_FUSABLE = frozenset(('+', 'x', '/', '//'))
+# operands of a fused chain reduced at once, bounding the memory of long
+# streamed chains and the size of the generated code
+_MAX_FUSED = 256
+
+def evaluate(tokens):
+    """
+    Evaluates an RPN expression given as any iterable of tokens, in one pass.
+
+    Numbers are pushed on a stack and each operator is applied by execOp to
+    all the values on the stack, which are replaced by the result. So
+    "1 2 3 +" is 6 and "1 2 + 4 x" is 12.
+
+    Chains of the same operator each adding operands, like "1 2 + 3 + 4 +",
+    are fused into one execOp call on all the operands ("1 2 3 4 +"), which
+    gives the same result without the intermediate ones.
+    """
     stack = []
-    if len(sys.argv) < 2:
+    # operator whose operands are still on the stack, below the fresh
+    # values pushed since
+    pending = None
+    fresh = 0
+    for token in tokens:
+        if isOp(token):
+            if pending is not None:
+                if token == pending and fresh and len(stack) <= _MAX_FUSED:
+                    fresh = 0
+                    continue
+                if fresh:
+                    n = len(stack) - fresh
+                    stack[:n] = [execOp(pending, *stack[:n])]
+                else:
+                    stack = [execOp(pending, *stack)]
+                pending = None
+            if token in _FUSABLE and len(stack) >= 2:
+                pending = token
+            else:
+                stack = [execOp(token, *stack)]
+            fresh = 0
+        else:
+            try:
+                stack.append(float(token))
+            except ValueError:
+                raise TypeError("Invalid operator: " + token)
+            fresh += 1
+
+    if pending is not None:
+        n = len(stack) - fresh
+        stack[:n] = [execOp(pending, *stack[:n])]
+    if not stack:
+        raise ValueError("Empty expression")
+    if len(stack) > 1:
+        raise ValueError(f"Incomplete expression: {len(stack)} values "
+                         "left without an operator")
+    return stack[0]
+
+# Python source for applying an operator to all the stack values, with the
+# same evaluation order as execOp
+def _opSource(op, args):
+    if op == '+':
+        return ' + '.join(['0'] + args)
+    elif op == '-':
+        return args[0] + ' - (' + ' + '.join(['0'] + args[1:]) + ')'
+    elif op == 'x':
+        return ' * '.join(args)
+    else:
+        return (' ' + op + ' ').join(args)
+
+_UFUNCS = {'+': 'add', '-': 'subtract', 'x': 'multiply', '/': 'true_divide',
+           '//': 'floor_divide'}
+
+def _fits(out, x):
+    """
+    Returns whether out can hold the result of a binary ufunc of out and x
+    """
+    import numpy as np
+
+    # the result of a step on scalars only is a NumPy scalar, not a buffer
+    return (isinstance(out, np.ndarray)
+            and np.broadcast_shapes(np.shape(out), np.shape(x)) == out.shape
+            and np.can_cast(np.result_type(out, x), out.dtype))
+
+def _foldArrays(ufunc, args, owned):
+    """
+    Left fold of ufunc over args. Returns the result and whether it is a
+    fresh array that can be overwritten: after the first ufunc call the
+    running result is updated in place instead of allocating per argument.
+    """
+    import numpy as np
+
+    ans = args[0]
+    for x in args[1:]:
+        if owned and _fits(ans, x):
+            ufunc(ans, x, out=ans)
+        else:
+            ans = ufunc(ans, x)
+            owned = isinstance(ans, np.ndarray)
+    return ans, owned
+
+def _applyArrays(op, args, owned=False):
+    """
+    Applies an operator to all args like execOp, but with NumPy ufuncs so
+    that array arguments are processed elementwise. owned says whether
+    args[0] may be overwritten.
+    """
+    import numpy as np
+
+    if op == '-':
+        # a - (b + c + ...), as execOp subtracts the sum of the rest
+        total, totalOwned = _foldArrays(np.add, args[1:], False)
+        if totalOwned and _fits(total, args[0]):
+            return np.subtract(args[0], total, out=total)
+        return _foldArrays(np.subtract, [args[0], total], owned)[0]
+    return _foldArrays(getattr(np, _UFUNCS[op]), args, owned)[0]
+
+def _foldStep(op, args, constants, constant):
+    """
+    Returns the argument names of a step with its constant operations
+    precomputed, as a single constant name if they all are. Only folds that
+    give bit-identical results are made: whole constant steps, and a
+    constant prefix of the left to right reduction (of args[1:] for '-',
+    which subtracts their sum). A fold that raises, like 1 0 /, is left for
+    run time.
+    """
+    try:
+        if all(a in constants for a in args):
+            return [constant(execOp(op, *(constants[a] for a in args)))]
+        start = 1 if op == '-' else 0
+        end = start
+        while end < len(args) and args[end] in constants:
+            end += 1
+        if end - start < 2:
+            return args
+        prefix = [constants[a] for a in args[start:end]]
+        # a sum starting from 0 is never -0.0, so 0 + value == value
+        value = _sum(prefix) if op in ('+', '-') else execOp(op, *prefix)
+    except ArithmeticError:
+        return args
+    return args[:start] + [constant(value)] + args[end:]
+
+class Program:
+    """
+    An RPN expression parsed once into a Python function of its variables,
+    for evaluating the same formula many times. Variables are identifiers
+    other than the operators, passed as keywords when calling the program:
+
+        >>> Program('a b + c x')(a=1, b=2, c=3)
+        9
+
+    With optimize, chains of the same operator are fused into one step like
+    evaluate() does, constant operations are computed once when compiling
+    and repeated literals share one constant, without changing any result.
+    stats counts the steps (operators) and binary operations of the
+    expression and how many were fused or folded.
+    """
+    def __init__(self, expr, optimize=True):
+        self.expr = expr
+        self.variables = []
+        # (operator, argument names) of each reduction, for array inputs
+        self._steps = []
+        self.stats = dict.fromkeys(('literals', 'constants', 'steps',
+                                    'operations', 'fusedSteps', 'foldedSteps',
+                                    'foldedOperations'), 0)
+        constants = {}
+        # name of each distinct value (by its hex, so -0.0 and nan are kept
+        # apart) when sharing constants
+        names = {}
+
+        def constant(value):
+            key = value.hex()
+            if not optimize or key not in names:
+                names[key] = f'_c{len(constants)}'
+                constants[names[key]] = value
+            return names[key]
+
+        body = []
+
+        def emit(op, args):
+            """
+            Adds a step and returns the name of its result
+            """
+            if optimize:
+                folded = _foldStep(op, args, constants, constant)
+                self.stats['foldedOperations'] += len(args) - len(folded)
+                if len(folded) == 1:
+                    self.stats['foldedSteps'] += 1
+                    return folded[0]
+                args = folded
+            body.append(f'    _t{len(body)} = {_opSource(op, args)}')
+            self._steps.append((op, args))
+            return f'_t{len(body) - 1}'
+
+        stack = []
+        # the step being built, whose result is stack[0], and the values
+        # pushed since
+        (op, args) = (None, None)
+        fresh = 0
+        for token in expr.split():
+            if isOp(token):
+                if len(stack) < 2:
+                    raise TypeError(token + " operation needs at least 2 "
+                                    "arguments! " + str(len(stack)) + " given.")
+                self.stats['steps'] += 1
+                self.stats['operations'] += len(stack) - 1
+                if (optimize and token == op and token in _FUSABLE
+                        and len(args) + fresh <= _MAX_FUSED):
+                    self.stats['fusedSteps'] += 1
+                    args += stack[1:]
+                else:
+                    if op is not None:
+                        stack[0] = emit(op, args)
+                    (op, args) = (token, stack)
+                stack = [None]
+                fresh = 0
+            elif _isNumber(token):
+                self.stats['literals'] += 1
+                stack.append(constant(float(token)))
+                fresh += 1
+            elif isVariable(token):
+                if token not in self.variables:
+                    self.variables.append(token)
+                stack.append(token)
+                fresh += 1
+            else:
+                raise TypeError("Invalid operator: " + token)
+
+        if op is not None:
+            stack[0] = emit(op, args)
+        if not stack:
+            raise ValueError("Empty expression")
+        if len(stack) > 1:
+            raise ValueError(f"Incomplete expression: {len(stack)} values "
+                             "left without an operator")
+
+        if optimize:
+            # drop the literals that were folded away
+            used = {a for (_, args) in self._steps for a in args} | {stack[0]}
+            constants = {k: v for (k, v) in constants.items() if k in used}
+
+        # temporaries keep the generated code flat however long the
+        # expression is; variables are keyword-only arguments
+        params = ', '.join(['*'] + self.variables) if self.variables else ''
+        source = '\n'.join([f'def _program({params}):'] + body +
+                           [f'    return {stack[0]}'])
+        namespace = dict(constants)
+        exec(builtins.compile(source, f'<rpn: {expr}>', 'exec'), namespace)
+        self._function = namespace['_program']
+        self._constants = constants
+        self._result = stack[0]
+        self.stats['constants'] = len(constants)
+
+    def __call__(self, **values):
+        """
+        Evaluates the program for the given variable values. If any value is
+        a NumPy array or linalg.Vector the whole expression is evaluated
+        with ufuncs over the arrays, broadcasting scalars.
+        """
+        if all(isinstance(v, (int, float)) for v in values.values()):
+            return self._function(**values)
+        return self._callArrays(values)
+
+    def _callArrays(self, values):
+        import numpy as np
+        import linalg
+
+        if set(values) != set(self.variables):
+            missing = [v for v in self.variables if v not in values]
+            unknown = [v for v in values if v not in self.variables]
+            raise TypeError(f"Program {self.expr!r} expects variables "
+                            f"{self.variables}, missing {missing}, "
+                            f"unexpected {unknown}")
+
+        env = dict(self._constants)
+        vectorType = None
+        for (name, value) in values.items():
+            if isinstance(value, linalg.Vector):
+                vectorType = vectorType or type(value)
+                value = value.data
+            env[name] = value
+
+        for (i, (op, args)) in enumerate(self._steps):
+            # only the previous step's result (always the first argument)
+            # may be overwritten, never the caller's arrays
+            owned = args[0].startswith('_t')
+            env[f'_t{i}'] = _applyArrays(op, [env[a] for a in args], owned)
+
+        ans = env[self._result]
+        if vectorType is not None and np.ndim(ans) == 1:
+            return vectorType._from_array(np.asarray(ans))
+        return ans
+
+    def __repr__(self):
+        return f'Program({self.expr!r})'
+
+@functools.lru_cache(maxsize=1024)
+def compile(expr, optimize=True):
+    """
+    Returns the Program for an RPN expression string, reusing the one from a
+    previous call with the same arguments
+    """
+    return Program(expr, optimize)
+
+# lines per task of batch evaluation, enough to amortize sending them to a
+# worker process
+_BATCH_CHUNK_SIZE = 2000
+
+def evaluateLine(line):
+    """
+    Returns the output line of one expression of a batch: its result, an
+    empty line for a blank one, or "error: <message>" if it is invalid
+    """
+    tokens = line.split()
+    if not tokens:
+        return ''
+    try:
+        return str(evaluate(tokens))
+    except (ArithmeticError, TypeError, ValueError) as e:
+        return f'error: {e}'
+
+def _evaluateChunk(lines):
+    return [evaluateLine(line) for line in lines]
+
+def evaluateLines(lines, out, workers=None, chunkSize=_BATCH_CHUNK_SIZE):
+    """
+    Evaluates each of lines (e.g. an open file) as a separate expression
+    and writes one output line per input line to out, in input order (see
+    evaluateLine). Lines are read lazily and evaluated by a pool of workers
+    processes (os.cpu_count() if None, 0 to evaluate in this process) in
+    chunks of chunkSize; at most two chunks per worker are in flight, and
+    each is written as soon as it and the ones before it are done.
+
+    Returns the number of lines and of errors.
+    """
+    lines = iter(lines)
+    chunks = iter(lambda: list(itertools.islice(lines, chunkSize)), [])
+    counts = [0, 0]
+
+    def write(results):
+        counts[0] += len(results)
+        counts[1] += sum(r.startswith('error: ') for r in results)
+        out.write(''.join(r + '\n' for r in results))
+        out.flush()
+
+    if workers == 0:
+        for chunk in chunks:
+            write(_evaluateChunk(chunk))
+        return tuple(counts)
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = workers or os.cpu_count() or 1
+    pending = collections.deque()
+    with ProcessPoolExecutor(workers) as pool:
+        for chunk in chunks:
+            pending.append(pool.submit(_evaluateChunk, chunk))
+            if len(pending) >= 2 * workers:
+                write(pending.popleft().result())
+        while pending:
+            write(pending.popleft().result())
+    return tuple(counts)
+
+def _batchMain(argv):
+    parser = argparse.ArgumentParser(
+        prog='rpn.py',
+        description='Evaluates a file with one RPN expression per line')
+    parser.add_argument('--file', default='-',
+                        help='expressions file, - for stdin (default)')
+    parser.add_argument('--batch', action='store_true',
+                        help='read expressions from stdin, one per line')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes, 0 for none '
+                             '(default: one per CPU)')
+    parser.add_argument('--chunk-size', type=int, default=_BATCH_CHUNK_SIZE,
+                        help='lines per task (default: %(default)s)')
+    args = parser.parse_args(argv)
+    if args.chunk_size < 1 or (args.workers is not None and args.workers < 0):
+        parser.error('--chunk-size must be positive and --workers >= 0')
+
+    start = time.perf_counter()
+    if args.file == '-':
+        (n, errors) = evaluateLines(sys.stdin, sys.stdout, args.workers,
+                                    args.chunk_size)
+    else:
+        with open(args.file) as f:
+            (n, errors) = evaluateLines(f, sys.stdout, args.workers,
+                                        args.chunk_size)
+    elapsed = time.perf_counter() - start
+    print(f'{n} lines, {errors} errors in {elapsed:.3f} s '
+          f'({n / elapsed:,.0f} lines/s)', file=sys.stderr)
+
+def main(argv=None):
+    """
+    Command line entry point: evaluates the expression given as arguments,
+    typed in or piped to stdin. Options starting with -- (which no RPN
+    token does) select batch mode instead, one expression per line:
+
+        rpn.py --file exprs.txt --workers 4 > results.txt
+        rpn.py --batch < exprs.txt
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0].startswith('--'):
+        _batchMain(argv)
+        return
+
+    if argv:
+        tokens = argv
+    elif sys.stdin.isatty():
         print("Enter RPN command:")
-        line = input()
-        stack = line.split()
+        tokens = input().split()
     else:
-        stack = (sys.argv[1:])
-    while(len(stack) > 1):
-        for i, c in enumerate(stack):
-            if isOp(c):
-                op, args = parseLine(stack[:i+1])
-                ans = execOp(op, *args)
-                del stack[:i]
-                stack[0] = ans
-                break
-            elif not c.isdigit():
-                raise TypeError("Invalid operator: " + c)
-
-    print(stack[0])
+        # stream piped input instead of reading it all at once
+        tokens = tokenize(sys.stdin)
+
+    print(evaluate(tokens))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+"""
+Asyncio server evaluating RPN expressions for many clients.
+
+The protocol is line based: each line a client sends is an expression
+(evaluated like rpn.evaluate, so "1 2 3 +" or "1 2 + 4 x") and gets one line
+back with its result or "error: <message>". Clients may pipeline any number
+of lines; the responses of a connection come back in request order. The
+line STATS returns the server's counters as JSON.
+
+Requests of all connections are queued and evaluated in batches, each
+distinct expression once, and results are kept in an LRU cache so repeated
+expressions are answered without evaluating them again.
+
+    python rpn_server.py serve --port 7777
+    python rpn_server.py load --port 7777 --requests 100000 --connections 8
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import random
+import sys
+import time
+
+import rpn
+
+# responses a connection may have pending before the server stops reading
+# from it
+_PIPELINE_LIMIT = 1024
+# server side latencies kept for the percentiles of the stats
+_LATENCY_SAMPLES = 10000
+
+def _evaluateBatch(lines):
+    return [rpn.evaluateLine(line) for line in lines]
+
+def _percentile(values, fraction):
+    """
+    Returns the value at fraction of the sorted values, None if empty
+    """
+    if not values:
+        return None
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+class Server:
+    """
+    Evaluates RPN expressions sent over TCP or a Unix socket:
+
+        server = Server()
+        (host, port) = await server.start(port=7777)
+        ...
+        await server.close()
+
+    Queued requests are evaluated together, up to batchSize at a time; when
+    fewer are waiting the server waits batchDelay seconds for more to
+    arrive first. With workers > 0 batches are evaluated by a pool of
+    processes instead of in the event loop. cacheSize results of distinct
+    expressions are cached.
+    """
+    def __init__(self, batchSize=256, batchDelay=0.0005, cacheSize=10000,
+                 workers=0):
+        self.batchSize = batchSize
+        self.batchDelay = batchDelay
+        self.cacheSize = cacheSize
+        self.workers = workers
+        self.counters = dict.fromkeys(
+            ('connections', 'requests', 'cacheHits', 'evaluated', 'errors',
+             'batches'), 0)
+        self._cache = collections.OrderedDict()
+        self._latencies = collections.deque(maxlen=_LATENCY_SAMPLES)
+        self._queue = None
+        self._server = None
+        self._batcher = None
+        # tasks serving the open connections
+        self._handlers = set()
+        self._pool = None
+        self._started = time.perf_counter()
+
+    async def start(self, host='127.0.0.1', port=0, path=None):
+        """
+        Starts listening on host:port (port 0 picks a free one), or on the
+        Unix socket path if given, and returns the bound address
+        """
+        self._queue = asyncio.Queue()
+        if self.workers:
+            from concurrent.futures import ProcessPoolExecutor
+            self._pool = ProcessPoolExecutor(self.workers)
+        self._batcher = asyncio.create_task(self._batchLoop())
+        if path is not None:
+            self._server = await asyncio.start_unix_server(self._handle, path)
+        else:
+            self._server = await asyncio.start_server(self._handle, host, port)
+        self._started = time.perf_counter()
+        return self._server.sockets[0].getsockname()
+
+    async def serveForever(self):
+        await self._server.serve_forever()
+
+    async def close(self):
+        self._server.close()
+        # from Python 3.12 wait_closed() also waits for the open connections,
+        # which only end when their clients disconnect
+        for handler in self._handlers:
+            handler.cancel()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        await self._server.wait_closed()
+        self._batcher.cancel()
+        try:
+            await self._batcher
+        except asyncio.CancelledError:
+            pass
+        if self._pool is not None:
+            self._pool.shutdown()
+
+    def submit(self, line):
+        """
+        Returns a future of the response line for one expression
+        """
+        self.counters['requests'] += 1
+        future = asyncio.get_running_loop().create_future()
+        key = ' '.join(line.split())
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self.counters['cacheHits'] += 1
+            self._latencies.append(0.0)
+            future.set_result(self._cache[key])
+        else:
+            self._queue.put_nowait((key, future, time.perf_counter()))
+        return future
+
+    def stats(self):
+        """
+        Returns the counters, throughput since start() and the latency
+        percentiles in seconds of the recent requests (from being read to
+        having a result, 0 for cache hits)
+        """
+        elapsed = time.perf_counter() - self._started
+        latencies = sorted(self._latencies)
+        stats = dict(self.counters)
+        stats.update(
+            uptime=elapsed,
+            throughput=self.counters['requests'] / elapsed,
+            meanBatch=(self.counters['evaluated']
+                       / max(self.counters['batches'], 1)),
+            latencyP50=_percentile(latencies, 0.5),
+            latencyP99=_percentile(latencies, 0.99),
+            latencyMax=latencies[-1] if latencies else None)
+        return stats
+
+    async def _handle(self, reader, writer):
+        self.counters['connections'] += 1
+        self._handlers.add(asyncio.current_task())
+        responses = asyncio.Queue(_PIPELINE_LIMIT)
+        sender = asyncio.create_task(self._send(responses, writer))
+        try:
+            try:
+                async for line in reader:
+                    text = line.decode(errors='replace').strip()
+                    if text == 'STATS':
+                        future = self._response(json.dumps(self.stats()))
+                    else:
+                        future = self.submit(text)
+                    # waits once _PIPELINE_LIMIT responses are pending
+                    await responses.put(future)
+            except ValueError:
+                # a line over the reader's limit: what follows it can't be
+                # told apart from the next request, so the connection ends
+                # after the responses of the lines before it
+                await responses.put(self._response('error: line too long'))
+            except ConnectionError:
+                pass
+            await responses.put(None)
+            await sender
+        finally:
+            # only still running if the handler was cancelled by close()
+            sender.cancel()
+            writer.close()
+            self._handlers.discard(asyncio.current_task())
+
+    @staticmethod
+    def _response(text):
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(text)
+        return future
+
+    async def _send(self, responses, writer):
+        """
+        Writes the responses of a connection in request order
+        """
+        try:
+            while (future := await responses.get()) is not None:
+                writer.write(((await future) + '\n').encode())
+                if responses.empty():
+                    await writer.drain()
+        except ConnectionError:
+            # the client went away, drain the rest
+            while await responses.get() is not None:
+                pass
+
+    async def _batchLoop(self):
+        while True:
+            batch = [await self._queue.get()]
+            if self.batchDelay and self._queue.qsize() < self.batchSize:
+                await asyncio.sleep(self.batchDelay)
+            while self._queue.qsize() and len(batch) < self.batchSize:
+                batch.append(self._queue.get_nowait())
+            try:
+                await self._evaluate(batch)
+            except Exception as e:
+                # e.g. a broken process pool: fail the batch, not the server
+                for (_, future, _) in batch:
+                    if not future.done():
+                        future.set_result(f'error: {e}')
+
+    async def _evaluate(self, batch):
+        # each distinct expression once, some may have been cached by the
+        # batch before
+        keys = dict.fromkeys(k for (k, _, _) in batch)
+        cached = {k: self._cache[k] for k in keys if k in self._cache}
+        lines = [k for k in keys if k not in cached]
+        if self._pool is not None:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self._pool, _evaluateBatch, lines)
+        else:
+            results = _evaluateBatch(lines)
+        self.counters['batches'] += 1
+        self.counters['evaluated'] += len(lines)
+        self.counters['errors'] += sum(r.startswith('error: ') for r in results)
+        self._cache.update(zip(lines, results))
+        while len(self._cache) > self.cacheSize:
+            self._cache.popitem(last=False)
+
+        # requests not answered by their own evaluation: repeats within
+        # the batch, and those cached by the batch before
+        self.counters['cacheHits'] += len(batch) - len(lines)
+        cached.update(zip(lines, results))
+        now = time.perf_counter()
+        for (key, future, submitted) in batch:
+            self._latencies.append(now - submitted)
+            if not future.done():
+                future.set_result(cached[key])
+
+async def load(lines, host='127.0.0.1', port=7777, path=None, connections=8,
+               pipeline=64):
+    """
+    Sends lines to a server split over connections, each keeping up to
+    pipeline requests in flight. Returns the responses in order of lines
+    and the round trip latency of each request in seconds.
+    """
+    lines = list(lines)
+    responses = [None] * len(lines)
+    latencies = [None] * len(lines)
+
+    async def client(indices):
+        if path is not None:
+            (reader, writer) = await asyncio.open_unix_connection(path)
+        else:
+            (reader, writer) = await asyncio.open_connection(host, port)
+        sent = collections.deque()
+        indices = iter(indices)
+
+        def send(n):
+            for i in itertools.islice(indices, n):
+                writer.write((lines[i] + '\n').encode())
+                sent.append((i, time.perf_counter()))
+
+        send(pipeline)
+        while sent:
+            await writer.drain()
+            response = await reader.readline()
+            if not response:
+                raise ConnectionError('Server closed the connection')
+            (i, start) = sent.popleft()
+            latencies[i] = time.perf_counter() - start
+            responses[i] = response.decode().rstrip('\n')
+            send(1)
+        writer.close()
+        await writer.wait_closed()
+
+    await asyncio.gather(*(client(range(c, len(lines), connections))
+                           for c in range(connections)))
+    return responses, latencies
+
+def randomExpressions(n, distinct, seed=0):
+    """
+    Returns n expressions drawn from distinct random ones, like
+    "3 -7 25 x"
+    """
+    rng = random.Random(seed)
+    pool = [' '.join([str(rng.randint(-99, 99))
+                      for _ in range(rng.randint(2, 4))]
+                     + [rng.choice(('+', '-', 'x', '/', '//'))])
+            for _ in range(distinct)]
+    return [rng.choice(pool) for _ in range(n)]
+
+async def _serveMain(args):
+    server = Server(args.batch_size, args.batch_delay, args.cache_size,
+                    args.workers)
+    address = await server.start(args.host, args.port, args.unix)
+    print(f'Serving on {address}', file=sys.stderr)
+    try:
+        await server.serveForever()
+    finally:
+        await server.close()
+
+async def _loadMain(args):
+    lines = randomExpressions(args.requests, args.distinct)
+    start = time.perf_counter()
+    (responses, latencies) = await load(lines, args.host, args.port,
+                                        args.unix, args.connections,
+                                        args.pipeline)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    errors = sum(r.startswith('error: ') for r in responses)
+    print(f'{len(lines)} requests, {errors} errors in {elapsed:.3f} s '
+          f'({len(lines) / elapsed:,.0f} requests/s)')
+    print('latency p50 {:.3f} ms, p99 {:.3f} ms, max {:.3f} ms'.format(
+        *(1e3 * _percentile(latencies, f) for f in (0.5, 0.99, 1))))
+    (server, _) = await load(['STATS'], args.host, args.port, args.unix, 1)
+    print('server:', server[0])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help='run the server')
+    client = commands.add_parser('load', help='benchmark a running server')
+    for p in (serve, client):
+        p.add_argument('--host', default='127.0.0.1')
+        p.add_argument('--port', type=int, default=7777)
+        p.add_argument('--unix', help='Unix socket path instead of TCP')
+    serve.add_argument('--batch-size', type=int, default=256)
+    serve.add_argument('--batch-delay', type=float, default=0.0005,
+                       help='seconds to wait for a batch to fill')
+    serve.add_argument('--cache-size', type=int, default=10000)
+    serve.add_argument('--workers', type=int, default=0,
+                       help='processes evaluating batches, 0 for none')
+    client.add_argument('--requests', type=int, default=100000)
+    client.add_argument('--distinct', type=int, default=1000,
+                        help='distinct expressions among the requests')
+    client.add_argument('--connections', type=int, default=8)
+    client.add_argument('--pipeline', type=int, default=64,
+                        help='requests in flight per connection')
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(_serveMain(args) if args.command == 'serve'
+                    else _loadMain(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,25 @@
+import linalg
 from linalg import Vector, CVector, Vector2D, Vector3D
+from linalg import Vector2DArray, Vector3DArray, FastVector2D, FastVector3D
+from linalg import Matrix, Matrix2D, Matrix3D
 import unittest
 import numpy as np
 import math
+import os
+import tempfile
+import array
+import pickle
+import copy
+import multiprocessing
+import gc
+import subprocess
+import sys
+
+def _scale_in_place(v):
+    # multiprocessing worker for TestSharedArray
+    v *= 2
+    return float(v.dot(v))
+
 
 class TestVectorMethods(unittest.TestCase):
 
@@ -16,6 +34,64 @@ class TestVectorMethods(unittest.TestCase):
         self.assertTrue(all(v.data == [x**2 for x in range(5)]))
         self.assertTrue(v.ndim == 5)
 
+    def test_init_ndarray(self):
+        arr = np.arange(5.0)
+        v = Vector(arr)
+        self.assertTrue(v == list(range(5)))
+        arr[0] = 10 # constructor copies its input
+        self.assertEqual(v[0], 0)
+        with self.assertRaises(ValueError):
+            v = Vector(np.array([1, 2, '3'], dtype=object))
+        with self.assertRaises(ValueError):
+            v = Vector(np.array(['1', '2']))
+        with self.assertRaises(ValueError):
+            v = Vector(np.zeros((2, 2)))
+
+    def test_dtype(self):
+        v = Vector([1, 2, 3], dtype=np.float32)
+        self.assertEqual(v.dtype, np.float32)
+        for w in (v + v, v - 1, -v, 2*v, v*v, v/2, v//2, v**2, v + 0.5,
+                  v.copy(), Vector(v.data)):
+            self.assertEqual(w.dtype, np.float32)
+        self.assertEqual(v.astype(np.float64).dtype, np.float64)
+        v /= 3
+        v += Vector([1, 1, 1])
+        self.assertEqual(v.dtype, np.float32)
+        self.assertEqual(Vector.zeros(3, np.float32).dtype, np.float32)
+        self.assertEqual(Vector(range(3), dtype=float).dtype, np.float64)
+        self.assertEqual(Vector3D(1, 2, 3, dtype=np.float32).dtype, np.float32)
+        self.assertEqual(Vector2D([1, 2], dtype=np.float32).dtype, np.float32)
+        self.assertEqual(Vector2D.zero(np.float32).dtype, np.float32)
+        self.assertEqual(Vector3DArray.zeros(2, np.float32).data.dtype,
+                         np.float32)
+        self.assertEqual(Vector2DArray([[1, 2]], dtype=np.float32).data.dtype,
+                         np.float32)
+        # integer vectors still promote on in-place division
+        i = Vector([1, 2, 3])
+        i /= 2
+        self.assertEqual(i, [0.5, 1, 1.5])
+        with self.assertRaises(ValueError):
+            Vector([1, 2], dtype=str)
+
+    def test_init_iterables(self):
+        self.assertEqual(Vector(x for x in range(3)), [0, 1, 2])
+        self.assertEqual(Vector((1, 2.5)), [1, 2.5])
+        self.assertEqual(Vector([True, 2]), [1, 2])
+        v = Vector([2**70, 1])
+        self.assertEqual(v[0], 2**70)
+        with self.assertRaises(ValueError):
+            Vector([1, [2, 3]])
+        with self.assertRaises(ValueError):
+            Vector([2**70, '1'])
+        with self.assertRaises(ValueError):
+            Vector('123')
+
+    def test_result_types(self):
+        v = Vector(range(5))
+        for w in (v + v, v - 1, -v, 2*v, v*v, v/2, v.copy(), v + [1]*5):
+            self.assertIs(type(w), Vector)
+        self.assertIs(type(Vector.zeros(3)), Vector)
+
     def test_iter(self):
         v = Vector(range(5))
         a = [x for x in v]
@@ -76,6 +152,124 @@ class TestVectorMethods(unittest.TestCase):
         self.assertTrue(v == Vector.zeros(5))
         self.assertTrue(w == c)
 
+    def test_inplace(self):
+        v = Vector(range(5))
+        buffer = v.data
+        w = v
+        w *= 3
+        w **= 2
+        w //= 9
+        self.assertIs(w, v)
+        self.assertIs(v.data, buffer)
+        self.assertTrue(v == [x**2 for x in range(5)])
+        v /= 2 # integer data is promoted to hold the result
+        self.assertIs(w, v)
+        self.assertTrue(v == [x**2/2 for x in range(5)])
+        buffer = v.data
+        v *= Vector([2]*5)
+        v /= Vector([1, 1, 1, 1, 2])
+        self.assertIs(v.data, buffer)
+        self.assertTrue(v == [0, 1, 4, 9, 8])
+        with self.assertRaises(TypeError):
+            v *= 'a'
+
+    def test_into(self):
+        u = Vector(range(5))
+        v = Vector([2.0]*5)
+        out = Vector.zeros(5)
+        buffer = out.data
+        self.assertIs(u.add_into(v, out), out)
+        self.assertTrue(out == [2, 3, 4, 5, 6])
+        self.assertTrue(u.sub_into(v, out) == [-2, -1, 0, 1, 2])
+        self.assertTrue(u.mul_into(2, out) == [0, 2, 4, 6, 8])
+        self.assertTrue(u.div_into(v, out) == [0, 0.5, 1, 1.5, 2])
+        self.assertIs(out.data, buffer)
+        self.assertTrue(v.add_into(v, v) == [4]*5)
+        with self.assertRaises(TypeError):
+            u.add_into(v, [0]*5)
+
+    def test_axpy(self):
+        y = Vector([1.0]*5)
+        x = Vector(range(5))
+        buffer = y.data
+        self.assertIs(y.axpy(2, x), y)
+        self.assertTrue(y == [1, 3, 5, 7, 9])
+        work = Vector.zeros(5)
+        y.axpy(-1, x, work=work)
+        self.assertTrue(y == [1, 2, 3, 4, 5])
+        self.assertTrue(work == [0, -1, -2, -3, -4])
+        self.assertIs(y.data, buffer)
+        # longer than one chunk, x shorter by more than one
+        y = Vector.zeros(3 * linalg._CHUNK_SIZE)
+        with self.assertRaises(ValueError):
+            y.axpy(2.0, Vector.zeros(2 * linalg._CHUNK_SIZE))
+        with self.assertRaises(ValueError):
+            Vector([1.0, 2.0], backend='python').axpy(2.0, Vector([1.0]))
+
+    def test_array_like_operands(self):
+        v = Vector(range(5))
+        for other in ([1]*5, (1,)*5, np.ones(5), array.array('d', [1]*5),
+                      memoryview(array.array('l', [1]*5)), (1 for _ in range(5))):
+            self.assertTrue(v + other == [1, 2, 3, 4, 5])
+        other = array.array('d', [2]*5)
+        self.assertTrue(v - other == [-2, -1, 0, 1, 2])
+        self.assertTrue(v * other == [0, 2, 4, 6, 8])
+        self.assertTrue(other * v == [0, 2, 4, 6, 8])
+        self.assertTrue(v / other == [0, 0.5, 1, 1.5, 2])
+        self.assertEqual(v.dot(other), 20)
+        self.assertEqual(v.dot(memoryview(other)), 20)
+        w = v.copy()
+        w += other
+        self.assertTrue(w == [2, 3, 4, 5, 6])
+        with self.assertRaises(ValueError):
+            v + [1, 2]
+        with self.assertRaises(ValueError):
+            v.dot(np.ones(4))
+        with self.assertRaises(TypeError):
+            v + ['a']*5
+        with self.assertRaises(TypeError):
+            v + np.ones((5, 5))
+        with self.assertRaises(TypeError):
+            v.dot(2)
+
+    def test_numpy_interop(self):
+        v = Vector([1.0, 4.0, 9.0])
+        self.assertIs(np.asarray(v), v.data)
+        self.assertTrue(np.sqrt(v) == [1, 2, 3])
+        self.assertIs(type(np.sqrt(v)), Vector)
+        self.assertEqual(np.dot(v, v), v.dot(v))
+        self.assertEqual(np.sum(v), 14)
+        self.assertIs(type(np.ones(3) + v), Vector)
+        self.assertTrue(np.ones(3) - v == [0, -3, -8])
+        self.assertIs(type(np.float64(2) * v), Vector)
+        out = Vector.zeros(3)
+        self.assertIs(np.add(v, v, out=out), out)
+        self.assertTrue(out == [2, 8, 18])
+        self.assertEqual(np.add.outer(v, v).shape, (3, 3))
+
+    def test_numpy_comparisons(self):
+        v = Vector([1.0, 4.0, 9.0])
+        a = np.array([1.0, 5.0, 9.0])
+        for (actual, expected) in [(a == v, [True, False, True]),
+                                   (v == a, [True, False, True]),
+                                   (a != v, [False, True, False]),
+                                   (v != a, [False, True, False]),
+                                   (a < v, [False, False, False]),
+                                   (np.greater(v, a), [False, False, False])]:
+            self.assertIs(type(actual), np.ndarray)
+            np.testing.assert_array_equal(actual, expected)
+        self.assertTrue(v == Vector([1, 4, 9]))
+        self.assertFalse(v == 'x')
+        self.assertTrue(np.array_equal(v, a[[0, 0, 2]] + [0, 3, 0]))
+        with self.assertRaises(ValueError):
+            bool(v == a) # elementwise, like ndarray == ndarray
+
+    def test_floordiv_pow(self):
+        v = Vector(range(5))
+        self.assertTrue(v // 2 == [0, 0, 1, 1, 2])
+        self.assertTrue(v ** 2 == [0, 1, 4, 9, 16])
+        self.assertTrue(v ** v == [1, 1, 4, 27, 256])
+
     def test_mul(self):
         a = list(range(5))
         b = list(range(5))
@@ -122,6 +316,456 @@ class TestVectorMethods(unittest.TestCase):
 
 
 
+class TestVectorFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.chunk_size = linalg._CHUNK_SIZE
+        linalg._CHUNK_SIZE = 4 # exercise the chunked paths
+
+    def tearDown(self):
+        linalg._CHUNK_SIZE = self.chunk_size
+        self.tmpdir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def test_save_and_map(self):
+        v = Vector(np.arange(10.0))
+        for name in ('v.npy', 'v.bin'):
+            v.save(self.path(name))
+            u = Vector.from_file(self.path(name))
+            self.assertIsInstance(u.data, np.memmap)
+            self.assertTrue(u == v)
+            with self.assertRaises(ValueError):
+                u += 1 # read-only by default
+
+        u = CVector.from_file(self.path('v.bin'), dtype=np.complex128)
+        self.assertEqual(u.ndim, 5)
+
+    def test_memmap(self):
+        v = Vector.memmap(self.path('v.npy'), 10)
+        self.assertTrue(v == Vector.zeros(10))
+        v += Vector(range(10))
+        v.flush()
+        u = Vector.from_file(self.path('v.npy'), mode='r+')
+        self.assertTrue(u == list(range(10)))
+        u.axpy(2, Vector([1.0]*10))
+        u.flush()
+        self.assertTrue(Vector.from_file(self.path('v.npy')) ==
+                        [x + 2 for x in range(10)])
+
+    def test_no_promotion_of_views(self):
+        # the result of dividing integers can't be stored in the file, and
+        # a promoted copy would silently stop writing to it
+        m = Vector.memmap(self.path('i.npy'), 4, dtype='int64')
+        m += 8
+        with self.assertRaises(TypeError):
+            m /= 2
+        self.assertIsInstance(m.data, np.memmap)
+        m.flush()
+        self.assertEqual(Vector.from_file(self.path('i.npy')), [8] * 4)
+        points = Vector3DArray(np.arange(6).reshape(2, 3))
+        row = points[0]
+        with self.assertRaises(TypeError):
+            row /= 2
+        row += 1
+        self.assertEqual(points[0], [1, 2, 3])
+        with linalg.SharedArray.create(3, dtype=np.int64) as shared:
+            v = shared.vector()
+            with self.assertRaises(TypeError):
+                v *= 0.5
+            self.assertIs(v.data, shared.array)
+            del v
+
+    def test_chunked_reductions(self):
+        v = Vector(np.arange(10.0))
+        v.save(self.path('v.bin'))
+        u = Vector.from_file(self.path('v.bin'))
+        self.assertEqual(u.dot(u), sum(x*x for x in range(10)))
+        self.assertAlmostEqual(abs(u), math.sqrt(285))
+        with self.assertRaises(ValueError):
+            u.dot(Vector(range(9)))
+
+
+class TestLazyExpr(unittest.TestCase):
+
+    def setUp(self):
+        self.chunk_size = linalg._LAZY_CHUNK_SIZE
+        linalg._LAZY_CHUNK_SIZE = 7 # several chunks and a partial last one
+        rng = np.random.default_rng(0)
+        self.a, self.b, self.c, self.d = (Vector(rng.uniform(1, 10, 100))
+                                          for i in range(4))
+
+    def tearDown(self):
+        linalg._LAZY_CHUNK_SIZE = self.chunk_size
+
+    def test_matches_eager(self):
+        a, b, c, d = self.a, self.b, self.c, self.d
+        la, lb, lc, ld = linalg.lazy(a, b, c, d)
+        self.assertIsInstance(la * 2.0 + b, linalg.LazyExpr)
+        np.testing.assert_array_equal((la * 2.0 + b - c / d).eval().data,
+                                      (a * 2.0 + b - c / d).data)
+        np.testing.assert_array_equal((2.0 * a.expr - (b // lc) ** 2).eval().data,
+                                      (a * 2.0 - (b // c) ** 2).data)
+        np.testing.assert_array_equal((1 / (-la) + a - 3 ** lb).eval().data,
+                                      np.true_divide(1, -a.data) + a.data
+                                      - np.power(3, b.data))
+        t = la * lb # shared subexpression
+        np.testing.assert_array_equal((t + t / c).eval().data,
+                                      (a * b + (a * b) / c).data)
+
+    def test_types(self):
+        v = Vector3D(1, 2, 3)
+        u = (v.expr * 2 + v).eval()
+        self.assertIs(type(u), Vector3D)
+        self.assertEqual(u, Vector3D(3, 6, 9))
+        # dtypes follow the eager promotion rules
+        i = Vector(range(20))
+        self.assertEqual((i.expr + 1).eval().data.dtype, (i + 1).data.dtype)
+        np.testing.assert_array_equal((i.expr / 2).eval().data, (i / 2).data)
+        f = Vector(np.ones(20, dtype=np.float32))
+        self.assertEqual((f.expr * 2.0).eval().data.dtype, np.float32)
+
+    def test_out(self):
+        a, b = self.a, self.b
+        out = Vector.zeros(100)
+        self.assertIs((a.expr + b * 2).eval(out=out), out)
+        self.assertEqual(out, a + b * 2)
+        # out may be one of the inputs
+        expected = a * a + b
+        self.assertIs((a.expr * a + b).eval(out=a), a)
+        self.assertEqual(a, expected)
+        with self.assertRaises(ValueError):
+            (a.expr + 1).eval(out=Vector.zeros(3))
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            (self.a.expr + Vector(range(3))).eval()
+        with self.assertRaises(TypeError):
+            self.a.expr + 'x'
+        with self.assertRaises(TypeError):
+            linalg.lazy([1, 2])
+        with self.assertRaises(TypeError):
+            self.a += self.b.expr
+        # the leaf alone evaluates to a copy
+        u = self.a.expr.eval()
+        self.assertEqual(u, self.a)
+        self.assertIsNot(u.data, self.a.data)
+
+
+class TestParallel(unittest.TestCase):
+
+    def setUp(self):
+        self.chunk_size = linalg._PARALLEL_CHUNK_SIZE
+        rng = np.random.default_rng(0)
+        self.u = Vector(rng.normal(size=1001))
+        self.v = Vector(rng.uniform(1, 2, size=1001))
+
+    def tearDown(self):
+        linalg.set_parallel(0, self.chunk_size)
+
+    def test_elementwise(self):
+        u, v = self.u, self.v
+        expected = [u + v, u - v, u * v, u / v, u // v, v ** u, -u, 2.5 * u,
+                    u + 1]
+        linalg.set_parallel(3, chunk_size=64)
+        actual = [u + v, u - v, u * v, u / v, u // v, v ** u, -u, 2.5 * u,
+                  u + 1]
+        for (a, e) in zip(actual, expected):
+            self.assertIs(type(a), type(e))
+            np.testing.assert_array_equal(a.data, e.data)
+        w = u.copy()
+        buffer = w.data
+        w += v
+        w *= 2
+        self.assertIs(w.data, buffer)
+        np.testing.assert_array_equal(w.data, (u.data + v.data) * 2)
+        out = Vector.zeros(1001)
+        u.mul_into(v, out)
+        np.testing.assert_array_equal(out.data, u.data * v.data)
+        # integer vectors are still promoted, untouched by the failed cast
+        i = Vector(np.arange(1001))
+        i /= 2
+        np.testing.assert_array_equal(i.data, np.arange(1001) / 2)
+        with self.assertRaises(TypeError):
+            Vector(np.arange(1001)).div_into(2, Vector(np.arange(1001)))
+        f32 = Vector(np.ones(1001), dtype=np.float32)
+        self.assertEqual((f32 * 2.0).dtype, np.float32)
+
+    def test_deterministic_reductions(self):
+        u, v = self.u, self.v
+        cu = CVector(u.data + 1j * v.data)
+        linalg.set_parallel(1, chunk_size=16)
+        dot, norm, cdot = u.dot(v), abs(u), cu.dot(cu)
+        self.assertAlmostEqual(dot, np.dot(u.data, v.data), places=12)
+        self.assertAlmostEqual(cdot, np.vdot(cu.data, cu.data), places=10)
+        for workers in (2, 3, 8):
+            linalg.set_parallel(workers)
+            self.assertEqual(u.dot(v), dot)
+            self.assertEqual(abs(u), norm)
+            self.assertEqual(cu.dot(cu), cdot)
+        self.assertEqual(Vector(range(1001)).dot(Vector(range(1001))),
+                         sum(x * x for x in range(1001)))
+        with self.assertRaises(ValueError):
+            u.dot(Vector(range(1000)))
+
+    def test_short_vectors_stay_serial(self):
+        linalg.set_parallel(2, chunk_size=16)
+        calls = []
+        apply = linalg._apply
+        linalg._apply = lambda *args, **kwargs: (calls.append(args[1]),
+                                                 apply(*args, **kwargs))[1]
+        try:
+            u = Vector3D(1, 2, 3)
+            w = -(u + u * 2) / 2
+            w += u
+            w.mul_into(u, w)
+            self.assertEqual(w, [-0.5, -2, -4.5])
+            self.assertEqual(calls, [])
+            self.u + self.v
+            self.assertEqual(calls, [1001])
+        finally:
+            linalg._apply = apply
+
+    def test_disable(self):
+        linalg.set_parallel(2, chunk_size=16)
+        self.assertIsNotNone(linalg._executor)
+        self.assertEqual(linalg._parallel_size, 32)
+        linalg.set_parallel(0)
+        self.assertIsNone(linalg._executor)
+        self.assertEqual(linalg._parallel_size, math.inf)
+        with self.assertRaises(ValueError):
+            linalg.set_parallel(2, chunk_size=0)
+
+
+class TestSharedArray(unittest.TestCase):
+
+    def test_create_and_attach(self):
+        with linalg.SharedArray.create(5) as shared:
+            self.assertEqual(shared.array.tolist(), [0]*5)
+            v = shared.vector()
+            v += Vector(range(5))
+            other = linalg.SharedArray.attach(shared.name, 5)
+            u = other.vector()
+            self.assertEqual(u, [0, 1, 2, 3, 4])
+            u *= 3 # same buffer
+            self.assertEqual(v, [0, 3, 6, 9, 12])
+            del u
+            other.close()
+            del v
+
+    def test_vector_arrays(self):
+        points = Vector3DArray([[1, 2, 3], [4, 5, 6]])
+        with linalg.SharedArray.from_array(points) as shared:
+            self.assertEqual(shared.vectors(Vector3DArray), points)
+            with self.assertRaises(ValueError):
+                shared.vectors(Vector2DArray)
+            with self.assertRaises(ValueError):
+                shared.vector()
+
+    def test_copy(self):
+        for (data, view) in ((np.arange(6.0), lambda s: s.vector(Vector)),
+                             (np.zeros((3, 2)),
+                              lambda s: s.vectors(Vector2DArray))):
+            with linalg.SharedArray.from_array(data) as shared:
+                v = view(shared)
+                for copier in (copy.copy, copy.deepcopy):
+                    w = copier(v)
+                    self.assertIs(type(w), type(v))
+                    self.assertEqual(w, v)
+                    self.assertFalse(np.shares_memory(w.data, shared.array))
+                    self.assertIsNone(getattr(w, '_shared', None))
+                    w.data[0] = 100 # not the shared block
+                    self.assertEqual(shared.array.flat[0], data.flat[0])
+                del v
+
+    def test_close_with_views(self):
+        shared = linalg.SharedArray.create(4)
+        v = shared.vector()
+        with self.assertRaises(BufferError):
+            shared.close()
+        self.assertEqual(v, [0, 0, 0, 0]) # still mapped
+        with self.assertRaises(BufferError):
+            with shared:
+                pass
+        del v
+        shared.close()
+
+        with linalg.SharedArray.create((2, 3)) as shared:
+            points = shared.vectors(Vector3DArray)
+            del points
+
+    def test_pickle_by_name(self):
+        with linalg.SharedArray.from_array(np.arange(4.0)) as shared:
+            v = shared.vector(Vector)
+            u = pickle.loads(pickle.dumps(v))
+            self.assertIs(type(u), Vector)
+            u += 1 # attached to the same block, not a copy
+            self.assertEqual(v, [1, 2, 3, 4])
+            del u, v
+            gc.collect()
+
+    def test_workers(self):
+        ctx = multiprocessing.get_context('fork')
+        with linalg.SharedArray.from_array(np.arange(3.0)) as shared:
+            v = shared.vector()
+            with ctx.Pool(2) as pool:
+                self.assertEqual(pool.apply(_scale_in_place, (v,)), 20.0)
+            self.assertEqual(v, [0, 2, 4])
+            del v
+
+
+class TestVectorPickle(unittest.TestCase):
+
+    def test_roundtrip(self):
+        for v in (Vector([1.5, 2, 3]), CVector([1j, 2]), Vector3D(1, 2, 3),
+                  Vector(np.arange(6.0)[::2]), Vector2DArray([[1, 2], [3, 4]]),
+                  Vector([1, 2], dtype=np.float32)):
+            for protocol in range(2, pickle.HIGHEST_PROTOCOL + 1):
+                u = pickle.loads(pickle.dumps(v, protocol))
+                self.assertIs(type(u), type(v))
+                self.assertEqual(u, v)
+                self.assertEqual(u.data.dtype, v.data.dtype)
+                u.data[0] = 7 # writable, independent copy
+                self.assertNotEqual(u, v)
+
+    def test_out_of_band(self):
+        v = CVector(np.arange(1000) * 1j)
+        v.conj
+        buffers = []
+        data = pickle.dumps(v, protocol=5, buffer_callback=buffers.append)
+        self.assertEqual(len(buffers), 1)
+        self.assertLess(len(data), 200) # the buffer and the CC cache are not in data
+        u = pickle.loads(data, buffers=buffers)
+        self.assertTrue(np.shares_memory(u.data, v.data))
+        self.assertEqual(u, v)
+        # read-only buffers are copied
+        u = pickle.loads(data, buffers=[bytes(b.raw()) for b in buffers])
+        u += 1
+        self.assertEqual(u, v + 1)
+
+    def test_memmap(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'v.npy')
+            Vector(range(4)).save(path)
+            v = Vector.from_file(path)
+            u = pickle.loads(pickle.dumps(v, 5))
+            self.assertIs(type(u.data), np.ndarray)
+            self.assertEqual(u, [0, 1, 2, 3])
+            del v
+
+
+class TestBackends(unittest.TestCase):
+
+    def tearDown(self):
+        linalg.set_backend('numpy')
+
+    def test_matches_numpy(self):
+        u, v = [1.5, -2, 3], [4, 0.25, -6]
+        for (p, n) in ((Vector3D(*u, backend='python'), Vector3D(*u)),
+                       (Vector(u, backend='python'), Vector(u))):
+            self.assertEqual(p.backend, 'python')
+            self.assertIs(type(p.data), array.array)
+            for (x, y) in ((p + v, n + v), (p - v, n - v), (p * 2, n * 2),
+                           (2 * p, 2 * n), (p / 4, n / 4), (p // 2, n // 2),
+                           (p ** 2, n ** 2), (-p, -n), (p * p, n * n)):
+                self.assertIs(type(x), type(y))
+                self.assertEqual(x.backend, 'python')
+                self.assertEqual(list(x), list(y))
+            self.assertAlmostEqual(p.dot(v), n.dot(v))
+            self.assertAlmostEqual(abs(p), abs(n))
+            self.assertEqual(p, n)
+            self.assertEqual(p, u)
+            self.assertEqual(p.dtype, np.float64)
+            self.assertEqual(str(p), '[1.5, -2.0, 3.0]')
+        p, n = Vector3D(*u, backend='python'), Vector3D(*u)
+        self.assertEqual(p.cross(v := Vector3D(*v)), n.cross(v))
+        self.assertEqual(p.getSphericalCoords(), n.getSphericalCoords())
+        self.assertEqual(Vector2D.zero(backend='python'), [0, 0])
+        self.assertEqual(Vector.zeros(4, backend='python').backend, 'python')
+
+    def test_in_place(self):
+        v = Vector([1, 2, 3], backend='python')
+        data = v.data
+        v += 1
+        v *= [1, 2, 3]
+        v.axpy(2, Vector([1, 1, 1]))
+        self.assertIs(v.data, data)
+        self.assertEqual(v, [4, 8, 14])
+        out = Vector.zeros(3, backend='python')
+        self.assertIs(v.sub_into(1, out), out)
+        self.assertEqual(out, [3, 7, 13])
+        w = v.copy()
+        w.X = 0
+        self.assertEqual(v, [4, 8, 14])
+
+    def test_length_mismatch(self):
+        for (p, n) in ((Vector([1, 2, 3], backend='python'), Vector([1, 2])),
+                       (Vector([1, 2, 3]), Vector([1], backend='python'))):
+            for (u, v) in ((p, n), (n, p)):
+                with self.assertRaises(ValueError):
+                    u.dot(v)
+        p = Vector([1, 2, 3], backend='python')
+        out = Vector.zeros(2, backend='python')
+        with self.assertRaises(ValueError):
+            p.add_into(p, out)
+        self.assertEqual(out, [0, 0])
+
+    def test_mixed(self):
+        p, n = Vector([1, 2], backend='python'), Vector([3, 4])
+        self.assertEqual((p + n).backend, 'python')
+        self.assertEqual((n + p).backend, 'numpy')
+        self.assertEqual(p + n, [4, 6])
+        self.assertEqual(n.to_backend('python').backend, 'python')
+        self.assertEqual(p.to_backend('numpy'), p)
+        self.assertEqual(p.to_backend('numpy').backend, 'numpy')
+        self.assertEqual(np.sqrt(p), [1, math.sqrt(2)])
+        self.assertEqual(Matrix2D.scaling(2) @ Vector2D(1, 2, backend='python'),
+                         [2, 4])
+        u = pickle.loads(pickle.dumps(p))
+        self.assertEqual(u.backend, 'python')
+        self.assertEqual(u, p)
+
+    def test_errors(self):
+        with self.assertRaises(TypeError):
+            Vector(3, backend='python')
+        with self.assertRaises(ValueError):
+            Vector([1, '2'], backend='python')
+        with self.assertRaises(ValueError):
+            Vector([[1, 2]], backend='python')
+        with self.assertRaises(ValueError):
+            Vector([1, 2], dtype=int, backend='python')
+        with self.assertRaises(ValueError):
+            Vector([1, 2], backend='fortran')
+        with self.assertRaises(ValueError):
+            Vector([1, 2], backend='python') + [1, 2, 3]
+        with self.assertRaises(TypeError):
+            Vector([1, 2], backend='python') + ['a', 'b']
+        with self.assertRaises(ZeroDivisionError):
+            Vector([1, 2], backend='python') / 0
+
+    def test_set_backend(self):
+        linalg.set_backend('python')
+        self.assertEqual(linalg.get_backend(), 'python')
+        self.assertEqual(Vector2D(1, 2).backend, 'python')
+        self.assertEqual(Vector2D.create_from_angle(0, 1).backend, 'python')
+        self.assertEqual(Vector2D(1, 2, backend='numpy').backend, 'numpy')
+        self.assertEqual(CVector([1j]).backend, 'numpy')
+        with self.assertRaises(ValueError):
+            linalg.set_backend('fortran')
+
+    def test_numpy_not_imported(self):
+        code = ('import sys, linalg\n'
+                'v = linalg.Vector3D(1, 2, 3) + linalg.Vector3D(4, 5, 6)\n'
+                'print(abs(v.cross(linalg.Vector3D(0, 0, 1))), "numpy" in sys.modules)')
+        result = subprocess.run(
+            [sys.executable, '-c', code], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(linalg.__file__)),
+            env=dict(os.environ, LINALG_BACKEND='python'), check=True)
+        self.assertEqual(result.stdout.split(), [str(math.hypot(5, 7)), 'False'])
+
+
 class TestCVectorMethods(unittest.TestCase):
 
     def test_init(self):
@@ -134,14 +778,120 @@ class TestCVectorMethods(unittest.TestCase):
         v = CVector([complex(x, x**2) for x in range(5)])
         self.assertTrue(all(v.data == [complex(x, x**2) for x in range(5)]))
 
+    def test_result_types(self):
+        u = CVector(range(3))
+        for w in (u + u, u - 1, -u, 2*u, u*1j, u/2, u.copy(), u.CC()):
+            self.assertIs(type(w), CVector)
+            self.assertEqual(w.data.dtype.kind, 'c')
+        self.assertEqual(CVector(np.arange(3)).data.dtype.kind, 'c')
+        self.assertEqual(CVector.zeros(3).data.dtype.kind, 'c')
+
+    def test_dtype(self):
+        u = CVector([1, 2j, 3.5], dtype=np.complex64)
+        self.assertEqual(u.dtype, np.complex64)
+        np.testing.assert_array_equal(u.data, [1, 2j, 3.5])
+        for w in (u + u, u - 1, -u, 2*u, u*1j, u/2, u.copy(), u.CC()):
+            self.assertEqual(w.dtype, np.complex64)
+        self.assertEqual(CVector(np.arange(3.0), np.complex64).dtype,
+                         np.complex64)
+        self.assertEqual(CVector.zeros(3, np.complex64).dtype, np.complex64)
+        self.assertEqual(CVector(range(3)).dtype, np.complex128)
+        with self.assertRaises(ValueError):
+            CVector([1, 2], dtype=np.float32)
+
+    def test_inplace(self):
+        u = CVector(range(3))
+        buffer = u.data
+        u *= 1j
+        u /= 2
+        u **= 2
+        u += Vector([1, 1, 1])
+        self.assertIs(type(u), CVector)
+        self.assertIs(u.data, buffer)
+        self.assertTrue(u == [1, 0.75, 0])
+
+    def test_numpy_interop(self):
+        u = CVector([1j, 2, -3j])
+        self.assertIs(type(np.conj(u)), CVector)
+        self.assertTrue(np.conj(u) == u.CC())
+        self.assertIs(type(np.abs(u)), Vector)
+        self.assertTrue(np.abs(u) == [1, 2, 3])
+
     def test_CC(self):
         u = CVector(range(5))*1j
         self.assertEqual(u.CC(), -u)
+        # a new, writable vector every time
+        w = u.CC()
+        self.assertIsNot(u.CC(), w)
+        w *= 2
+        w.data[0] = 5
+        self.assertEqual(w, [5, -2j, -4j, -6j, -8j])
+        self.assertEqual(u.CC(), -u)
+
+    def test_conj_cache(self):
+        u = CVector([1j, 2, 3 - 1j])
+        self.assertIs(u.conj, u.conj)
+        self.assertEqual(u.conj, u.CC())
+        with self.assertRaises(ValueError):
+            u.conj.data[0] = 0 # the cached conjugate is read-only
+        for change in (lambda: u.__iadd__(1j), lambda: u.add_into(1, u),
+                       lambda: np.multiply(u, 2, out=u),
+                       lambda: u.axpy(1j, CVector([1, 1, 1])),
+                       lambda: (u.expr * 1j).eval(out=u)):
+            conj = u.conj
+            change()
+            self.assertIsNot(u.conj, conj)
+            self.assertEqual(u.conj, np.conj(u.data).tolist())
+        u.data = np.array([1j])
+        self.assertEqual(u.conj, [-1j])
 
     def test_dot(self):
         u = CVector(range(3))*1j
         v = CVector(range(3))*1j
         self.assertTrue(u.dot(v) == 5)
+        u = CVector([1 + 2j, 3 - 1j])
+        v = CVector([2j, 1])
+        self.assertEqual(u.dot(v), (1 - 2j)*2j + (3 + 1j))
+        self.assertEqual(u.dot(Vector([1, 2])), (1 - 2j) + 2*(3 + 1j))
+        with self.assertRaises(TypeError):
+            u.dot(2)
+        with self.assertRaises(ValueError):
+            u.dot(CVector([1]))
+
+    def test_abs(self):
+        u = CVector([3j, 4])
+        self.assertEqual(abs(u), 5)
+        self.assertIsInstance(abs(u), float)
+        self.assertEqual(abs(CVector([3j, 4], np.complex64)), 5)
+        # non-contiguous data
+        self.assertEqual(abs(CVector._from_array(np.array([3j, 0, 4])[::2])), 5)
+
+    def test_batch(self):
+        rng = np.random.default_rng(0)
+        us = [CVector(rng.normal(size=8) + 1j*rng.normal(size=8))
+              for i in range(5)]
+        vs = [CVector(rng.normal(size=8) + 1j*rng.normal(size=8))
+              for i in range(5)]
+        np.testing.assert_allclose(CVector.batch_dot(us, vs),
+                                   [u.dot(v) for (u, v) in zip(us, vs)],
+                                   rtol=1e-12)
+        np.testing.assert_allclose(CVector.batch_norm(us),
+                                   [abs(u) for u in us], rtol=1e-12)
+        stacked = np.array([u.data for u in us])
+        np.testing.assert_allclose(CVector.batch_norm(stacked),
+                                   CVector.batch_norm(us), rtol=1e-15)
+        # long vectors take the per-vector path
+        long = [CVector(np.tile(u.data, 40)) for u in us]
+        np.testing.assert_allclose(CVector.batch_dot(long, long),
+                                   [u.dot(u) for u in long], rtol=1e-12)
+        np.testing.assert_allclose(CVector.batch_norm(long),
+                                   [abs(u) for u in long], rtol=1e-12)
+        with self.assertRaises(ValueError):
+            CVector.batch_dot(us, vs[:4])
+        with self.assertRaises(ValueError):
+            CVector.batch_norm(stacked[0])
+        self.assertEqual(len(CVector.batch_dot([], [])), 0)
+        self.assertEqual(len(CVector.batch_norm([])), 0)
 
 
 class TestVector2DMethods(unittest.TestCase):
@@ -166,6 +916,11 @@ class TestVector2DMethods(unittest.TestCase):
         v = Vector2D(3, 4)
         self.assertTrue(v == [3, 4])
 
+    def testResultTypes(self):
+        v = self.vectorQ1
+        for w in (v + v, v - 1, -v, 2*v, v*2, v/2, v.copy(), Vector2D.zero()):
+            self.assertIs(type(w), Vector2D)
+
     def testAdditionToZero(self):
         for vector in self.vectors:
             actual = vector + Vector2D.zero()
@@ -225,6 +980,22 @@ class TestVector2DMethods(unittest.TestCase):
         expected = Vector2D(1.5, 2)
         self.assertEqual(actual, expected)
 
+    def testNumpyInterop(self):
+        actual = np.array([1.0, 1.0]) + self.vectorQ1
+        self.assertIs(type(actual), Vector2D)
+        self.assertEqual(actual, Vector2D(4, 5))
+        self.assertIs(type(np.hypot(self.vectorQ1, self.vectorQ2)), Vector2D)
+
+    def testInPlaceOperators(self):
+        actual = self.vectorQ1.copy()
+        actual *= 2
+        actual /= 4
+        self.assertIs(type(actual), Vector2D)
+        self.assertEqual(actual, Vector2D(1.5, 2))
+        velocity = Vector2D(1.0, -1.0)
+        actual.axpy(0.5, velocity)
+        self.assertEqual(actual, Vector2D(2, 1.5))
+
     def testDotProduct(self):
         actual = self.vectorQ1.dot(self.vectorQ2)
         expected = 7
@@ -295,6 +1066,10 @@ class TestVector2DMethods(unittest.TestCase):
             Vector2D.angle_between(southwest, west), -math.pi/4)
         self.assertAlmostEqual(
             Vector2D.angle_between(southwest, southwest), 0, 5)
+        self.assertEqual(Vector2D.angle_between(west, west), 0)
+        self.assertEqual(Vector2D.angle_between(northwest, southeast), math.pi)
+        self.assertEqual(Vector2D.angle_between(Vector2D.zero(), north), 0)
+        self.assertEqual(Vector2D.angle_between(southwest, Vector2D.zero()), 0)
 
     def testCreateFromAngle(self):
         specialTriangle30 = Vector2D.create_from_angle(math.pi/6, 2)
@@ -410,6 +1185,12 @@ class TestVector3D(unittest.TestCase):
         expected = 11
         self.assertEqual(actual, expected)
 
+    def testResultTypes(self):
+        v = self.vectorQ1
+        for w in (v + v, v - 1, -v, 2*v, v*2, v/2, v.copy(), v.cross(v),
+                  Vector3D.zero()):
+            self.assertIs(type(w), Vector3D)
+
     def testCrossProduct(self):
         actual = Vector3D(1,0,0).cross(Vector3D(0,1,0))
         expected = Vector3D(0,0,1)
@@ -469,5 +1250,602 @@ class TestVector3D(unittest.TestCase):
         self.assertTrue(self.vectorQ4 == [-4, 6, -8])
 
 
+class TestVector2DArray(unittest.TestCase):
+
+    def setUp(self):
+        self.vectors = [Vector2D(x, y) for x in (-2, -1, 0, 1, 3)
+                        for y in (-1.5, 0, 1, 4)]
+        self.array = Vector2DArray(self.vectors)
+
+    def test_init(self):
+        with self.assertRaises(ValueError):
+            Vector2DArray([[1, 2, 3]])
+        with self.assertRaises(ValueError):
+            Vector2DArray([[1, 'a']])
+        with self.assertRaises(TypeError):
+            Vector2DArray(3)
+        self.assertEqual(len(Vector2DArray([])), 0)
+        self.assertEqual(Vector2DArray(np.ones((4, 2))), Vector2DArray.zeros(4) + 1)
+
+    def test_indexing(self):
+        v = self.array[1]
+        self.assertIs(type(v), Vector2D)
+        self.assertEqual(v, self.vectors[1])
+        v.X = 100 # rows are views into the array
+        self.assertEqual(self.array.X[1], 100)
+        self.assertIs(type(self.array[2:4]), Vector2DArray)
+        self.assertEqual(len(self.array[2:4]), 2)
+        self.assertEqual(list(self.array)[3], self.vectors[3])
+
+    def test_arithmetic(self):
+        u = Vector2D(1, -2)
+        for (actual, expected) in [
+                (self.array + self.array, [v + v for v in self.vectors]),
+                (self.array - u, [v - u for v in self.vectors]),
+                (-self.array, [-v for v in self.vectors]),
+                (2 * self.array, [2 * v for v in self.vectors]),
+                (self.array * u, [v * u for v in self.vectors]),
+                (self.array / 4, [v / 4 for v in self.vectors])]:
+            self.assertIs(type(actual), Vector2DArray)
+            self.assertEqual(actual, Vector2DArray(expected))
+
+        scales = np.arange(len(self.array))
+        actual = self.array * scales
+        for (i, v) in enumerate(self.vectors):
+            self.assertEqual(actual[i], v * i)
+
+        actual = self.array.copy()
+        actual += u
+        actual -= 1
+        self.assertEqual(actual, Vector2DArray([v + u - 1 for v in self.vectors]))
+
+    def test_reflected(self):
+        u = Vector2D(1, -2)
+        for (actual, expected) in [
+                (u + self.array, [u + v for v in self.vectors]),
+                (u - self.array, [u - v for v in self.vectors]),
+                (u * self.array, [u * v for v in self.vectors]),
+                (1 + self.array, [v + 1 for v in self.vectors]),
+                (1 - self.array, [-v + 1 for v in self.vectors]),
+                (u.to_backend('python') + self.array,
+                 [u + v for v in self.vectors])]:
+            self.assertIs(type(actual), Vector2DArray)
+            self.assertEqual(actual, Vector2DArray(expected))
+        actual = 1 / (self.array + 10)
+        np.testing.assert_allclose(actual.data, 1 / (self.array.data + 10))
+        with self.assertRaises(ValueError):
+            Vector3D(1, 2, 3) + self.array
+
+    def test_dot_and_length(self):
+        u = Vector2D(1, -2)
+        np.testing.assert_allclose(
+            self.array.dot(self.array), [v.dot(v) for v in self.vectors])
+        np.testing.assert_allclose(
+            self.array.dot(u), [v.dot(u) for v in self.vectors])
+        np.testing.assert_allclose(
+            abs(self.array), [abs(v) for v in self.vectors])
+
+    def test_angle(self):
+        np.testing.assert_allclose(
+            self.array.angle(), [v.angle() for v in self.vectors])
+
+    def test_angle_between(self):
+        for u in self.vectors:
+            np.testing.assert_allclose(
+                Vector2DArray.angle_between(u, self.array),
+                [Vector2D.angle_between(u, v) for v in self.vectors],
+                rtol=1e-15, atol=1e-15)
+            np.testing.assert_allclose(
+                Vector2DArray.angle_between(self.array, u),
+                [Vector2D.angle_between(v, u) for v in self.vectors],
+                rtol=1e-15, atol=1e-15)
+        np.testing.assert_array_equal(
+            Vector2DArray.angle_between(self.array.data, self.array.data[::-1]),
+            Vector2DArray.angle_between(self.array, self.array[::-1]))
+        with self.assertRaises(ValueError):
+            Vector2DArray.angle_between(np.zeros((2, 3)), self.array)
+        actual = Vector2DArray.angle_between(
+            Vector2DArray([[0, 1], [1, 0], [1, -1], [0, 0]]),
+            Vector2DArray([[0, -1], [-1, 0], [-1, 1], [-1, -1]]))
+        np.testing.assert_allclose(actual, [math.pi, math.pi, math.pi, 0])
+
+    def test_create_from_angle(self):
+        angles = np.linspace(-math.pi, math.pi, 9)
+        actual = Vector2DArray.create_from_angle(angles, 2)
+        for (v, angle) in zip(actual, angles):
+            expected = Vector2D.create_from_angle(angle, 2)
+            self.assertAlmostEqual(v.X, expected.X)
+            self.assertAlmostEqual(v.Y, expected.Y)
+        self.assertEqual(len(Vector2DArray.create_from_angle(0, 1)), 1)
+
+
+class TestVector3DArray(unittest.TestCase):
+
+    def setUp(self):
+        self.vectors = [Vector3D(2, 3, 4), Vector3D(2, -3, 4),
+                        Vector3D(-2, -1, -1), Vector3D(-4, 6, -8),
+                        Vector3D(0, 2, 0)]
+        self.array = Vector3DArray(self.vectors)
+
+    def test_indexing(self):
+        v = self.array[-1]
+        self.assertIs(type(v), Vector3D)
+        self.assertEqual(v, self.vectors[-1])
+        self.array.Z = 1
+        self.assertEqual(v.Z, 1)
+
+    def test_cross(self):
+        u = Vector3D(1, 0, 0)
+        actual = self.array.cross(u)
+        self.assertIs(type(actual), Vector3DArray)
+        self.assertEqual(actual, Vector3DArray([v.cross(u) for v in self.vectors]))
+        actual = self.array.cross(self.array[::-1])
+        expected = [v.cross(w) for (v, w) in zip(self.vectors, self.vectors[::-1])]
+        self.assertEqual(actual, Vector3DArray(expected))
+        with self.assertRaises(TypeError):
+            self.array.cross(Vector2D(1, 0))
+
+    def test_spherical(self):
+        r, theta, phi = self.array.getSphericalCoords()
+        for (i, v) in enumerate(self.vectors):
+            np.testing.assert_allclose(
+                (r[i], theta[i], phi[i]), v.getSphericalCoords())
+        actual = Vector3DArray.createSpherical(r, theta, phi)
+        np.testing.assert_allclose(actual.data, self.array.data, atol=1e-12)
+
+    def test_cylindrical(self):
+        s, phi, z = self.array.getCylindricalCoords()
+        for (i, v) in enumerate(self.vectors):
+            np.testing.assert_allclose(
+                (s[i], phi[i], z[i]), v.getCylindricalCoords())
+        actual = Vector3DArray.createCylindrical(s, phi, z)
+        np.testing.assert_allclose(actual.data, self.array.data, atol=1e-12)
+
+
+class TestMatrix(unittest.TestCase):
+
+    def test_init(self):
+        m = Matrix([[1, 2, 3], [4, 5, 6]])
+        self.assertEqual(m.shape, (2, 3))
+        self.assertEqual(Matrix([Vector([1, 2]), (3, 4)]), Matrix(np.array([[1, 2], [3, 4]])))
+        with self.assertRaises(TypeError):
+            Matrix(3)
+        with self.assertRaises(ValueError):
+            Matrix([[1, '2']])
+        with self.assertRaises(ValueError):
+            Matrix([1, 2, 3])
+        with self.assertRaises(ValueError):
+            Matrix3D(np.eye(3))
+
+    def test_products(self):
+        a = Matrix([[1, 2, 3], [4, 5, 6]])
+        b = Matrix([[1, 0], [0, 1], [1, 1]])
+        self.assertEqual(a @ b, Matrix([[4, 5], [10, 11]]))
+        u = a @ Vector3D(1, 0, -1)
+        self.assertIs(type(u), Vector)
+        self.assertEqual(u, [-2, -2])
+        self.assertEqual(Vector([1, 1]) @ a, [5, 7, 9])
+        self.assertIs(type(Matrix(np.eye(3)) @ Vector3D(1, 2, 3)), Vector3D)
+        np.testing.assert_array_equal(a @ np.ones(3), [6, 15])
+        with self.assertRaises(ValueError):
+            a @ Vector([1, 2])
+        with self.assertRaises(TypeError):
+            a @ 'x'
+
+    def test_elementwise(self):
+        a = Matrix([[1, 2], [3, 4]])
+        self.assertEqual(a + a, 2 * a)
+        self.assertEqual(a - 1, Matrix([[0, 1], [2, 3]]))
+        self.assertEqual(-a / 2, a * -0.5)
+        self.assertEqual(a.T, Matrix([[1, 3], [2, 4]]))
+        self.assertEqual(a[0], [1, 2])
+        self.assertEqual(a[1, 0], 3)
+        with self.assertRaises(ValueError):
+            a + Matrix([[1, 2, 3]])
+
+    def test_identity_and_inverse(self):
+        self.assertEqual(Matrix.identity(3), Matrix(np.eye(3)))
+        self.assertIs(type(Matrix3D.identity()), Matrix3D)
+        m = Matrix3D.translation(1, 2, 3) @ Matrix3D.rotation(0.3, (1, 1, 0))
+        np.testing.assert_allclose((m @ m.inverse()).data, np.eye(4), atol=1e-15)
+        with self.assertRaises(TypeError):
+            Matrix.identity()
+
+    def test_transforms_2d(self):
+        r = Matrix2D.rotation(math.pi/2)
+        u = r @ Vector2D(1, 0)
+        self.assertIs(type(u), Vector2D)
+        np.testing.assert_allclose(u.data, [0, 1], atol=1e-15)
+        m = Matrix2D.translation(1, 2) @ Matrix2D.scaling(2, 3)
+        self.assertIs(type(m), Matrix2D)
+        self.assertEqual(m @ Vector2D(1, 1), Vector2D(3, 5))
+        self.assertEqual(Matrix2D.scaling(2) @ Vector2D(1, 1), Vector2D(2, 2))
+
+    def test_transforms_3d(self):
+        r = Matrix3D.rotation(math.pi/2, Vector3D(0, 0, 2))
+        np.testing.assert_allclose((r @ Vector3D(1, 0, 0)).data, [0, 1, 0],
+                                   atol=1e-15)
+        m = Matrix3D.translation(1, 2, 3) @ Matrix3D.scaling(2, 1, 1)
+        self.assertEqual(m @ Vector3D(1, 1, 1), Vector3D(3, 3, 4))
+        # homogeneous 4-vectors use the plain product
+        self.assertEqual(m @ Vector([1, 1, 1, 0]), [2, 1, 1, 0])
+        with self.assertRaises(ValueError):
+            Matrix3D.rotation(1.0, (0, 0, 0))
+
+    def test_perspective(self):
+        p = Matrix3D.perspective(math.pi/2, 2.0, 1.0, 10.0)
+        np.testing.assert_allclose((p @ Vector3D(0, 0, -1)).data, [0, 0, -1])
+        np.testing.assert_allclose((p @ Vector3D(0, 0, -10)).data, [0, 0, 1])
+        np.testing.assert_allclose((p @ Vector3D(2, 1, -1)).data, [1, 1, -1])
+        with self.assertRaises(ValueError):
+            Matrix3D.perspective(1.0, 1.0, 0.0, 10.0)
+
+    def test_batch_transform(self):
+        rng = np.random.default_rng(0)
+        points = Vector3DArray(rng.uniform(-1, 1, (100, 3)))
+        for m in (Matrix3D.rotation(0.7, (1, 2, 3)) @ Matrix3D.translation(1, 0, 0),
+                  Matrix3D.perspective(1.0, 1.5, 0.1, 100.0)
+                  @ Matrix3D.translation(0, 0, -5)):
+            result = m @ points
+            self.assertIs(type(result), Vector3DArray)
+            expected = [(m @ p).data for p in points]
+            np.testing.assert_allclose(result.data, expected, rtol=1e-12)
+            np.testing.assert_allclose(m.transform(points.data), expected,
+                                       rtol=1e-12)
+        flat = Matrix([[1, 0, 0], [0, 1, 0]]) @ points
+        self.assertIsInstance(flat, np.ndarray)
+        np.testing.assert_array_equal(flat, points.data[:, :2])
+        points2 = Vector2DArray([[1, 0], [0, 1]])
+        np.testing.assert_allclose(
+            (Matrix2D.rotation(math.pi) @ points2).data, [[-1, 0], [0, -1]],
+            atol=1e-15)
+        with self.assertRaises(ValueError):
+            Matrix3D.identity().transform(np.ones(3))
+
+
+class TestPairwise(unittest.TestCase):
+
+    def setUp(self):
+        self.tile_size = linalg._TILE_SIZE, linalg._TILE_COLUMNS
+        linalg._TILE_SIZE, linalg._TILE_COLUMNS = 50, 7 # several blocks
+        rng = np.random.default_rng(0)
+        self.x = [Vector(row) for row in rng.normal(size=(30, 5))]
+        self.y = rng.normal(size=(40, 5))
+
+    def tearDown(self):
+        linalg._TILE_SIZE, linalg._TILE_COLUMNS = self.tile_size
+
+    def test_pairwise_distances(self):
+        expected = [[abs(u - Vector(v)) for v in self.y] for u in self.x]
+        np.testing.assert_allclose(linalg.pairwise_distances(self.x, self.y),
+                                   expected, rtol=1e-12)
+        d = linalg.pairwise_distances(self.x)
+        self.assertEqual(d.shape, (30, 30))
+        np.testing.assert_array_equal(np.diag(d), 0)
+        np.testing.assert_allclose(d, d.T, rtol=1e-12)
+        out = np.empty((30, 40))
+        self.assertIs(linalg.pairwise_distances(self.x, self.y, out=out), out)
+        np.testing.assert_allclose(out, expected, rtol=1e-12)
+        with self.assertRaises(ValueError):
+            linalg.pairwise_distances(self.x, self.y, out=np.empty((3, 4)))
+        with self.assertRaises(ValueError):
+            linalg.pairwise_distances(self.x, self.y[:, :3])
+
+    def test_cosine_similarity(self):
+        expected = [[u.dot(Vector(v)) / (abs(u) * abs(Vector(v)))
+                     for v in self.y] for u in self.x]
+        np.testing.assert_allclose(linalg.cosine_similarity(self.x, self.y),
+                                   expected, rtol=1e-12)
+        s = linalg.cosine_similarity(Vector2DArray([[1, 0], [0, 2], [0, 0]]))
+        np.testing.assert_allclose(s, [[1, 0, 0], [0, 1, 0], [0, 0, 0]])
+
+    def test_top_k_nearest(self):
+        for metric in ('euclidean', 'cosine'):
+            if metric == 'euclidean':
+                full = linalg.pairwise_distances(self.y, self.x)
+                order = np.argsort(full, axis=1, kind='stable')
+            else:
+                full = linalg.cosine_similarity(self.y, self.x)
+                order = np.argsort(-full, axis=1, kind='stable')
+            for k in (1, 5, 30):
+                idx, values = linalg.top_k_nearest(self.y, self.x, k, metric)
+                self.assertEqual(idx.shape, (40, k))
+                np.testing.assert_array_equal(idx, order[:, :k])
+                np.testing.assert_allclose(
+                    values, np.take_along_axis(full, order[:, :k], axis=1),
+                    rtol=1e-12, atol=1e-12)
+        idx, values = linalg.top_k_nearest(self.x[3], self.x, 2)
+        self.assertEqual(idx[0], 3)
+        self.assertEqual(values.shape, (2,))
+        with self.assertRaises(ValueError):
+            linalg.top_k_nearest(self.y, self.x, 31)
+        with self.assertRaises(ValueError):
+            linalg.top_k_nearest(self.y, self.x, 3, metric='manhattan')
+
+    def test_top_k_nearest_ties(self):
+        # many points at the same few exact distances from each query
+        rng = np.random.default_rng(1)
+        corpus = rng.integers(-2, 3, size=(200, 2)).astype(float)
+        queries = rng.integers(-2, 3, size=(20, 2)).astype(float)
+        full = linalg.pairwise_distances(queries, corpus)
+        order = np.argsort(full, axis=1, kind='stable')
+        for k in (1, 6, 25, 200):
+            idx, _ = linalg.top_k_nearest(queries, corpus, k)
+            np.testing.assert_array_equal(idx, order[:, :k])
+
+    def test_empty(self):
+        with self.assertRaisesRegex(ValueError, 'at least one vector'):
+            linalg.pairwise_distances([], self.y)
+        with self.assertRaisesRegex(ValueError, 'at least one vector'):
+            linalg.top_k_nearest(self.y[0], [], 1)
+        with self.assertRaisesRegex(ValueError, 'at least one vector'):
+            linalg.KDTree([])
+        # an empty collection of known dimension keeps its shape
+        empty = np.empty((0, self.y.shape[1]))
+        self.assertEqual(linalg.pairwise_distances(empty, self.y).shape,
+                         (0, len(self.y)))
+
+
+class TestKDTree(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.points = rng.uniform(-10, 10, (500, 3))
+        self.queries = rng.uniform(-12, 12, (20, 3))
+
+    def brute_nearest(self, points, ids, q, k):
+        d = np.sqrt(((points - q)**2).sum(axis=1))
+        order = np.lexsort((ids, d))[:k]
+        return ids[order], d[order]
+
+    def assertMatchesBruteForce(self, tree, points, ids):
+        for q in self.queries:
+            for k in (1, 7):
+                (i, d) = tree.nearest(q, k)
+                (ei, ed) = self.brute_nearest(points, ids, q, k)
+                np.testing.assert_array_equal(i, ei)
+                np.testing.assert_allclose(d, ed, rtol=1e-12)
+            d = np.sqrt(((points - q)**2).sum(axis=1))
+            np.testing.assert_array_equal(tree.within_radius(q, 5.0),
+                                          np.sort(ids[d <= 5.0]))
+            lo, hi = q - 3, q + 4
+            inside = np.all((points >= lo) & (points <= hi), axis=1)
+            np.testing.assert_array_equal(tree.within_box(lo, hi),
+                                          np.sort(ids[inside]))
+
+    def test_queries(self):
+        tree = linalg.KDTree(self.points, leaf_size=4)
+        self.assertEqual(len(tree), 500)
+        self.assertMatchesBruteForce(tree, self.points, np.arange(500))
+        # a box containing everything returns whole subtrees
+        np.testing.assert_array_equal(tree.within_box((-10,)*3, (10,)*3),
+                                      np.arange(500))
+
+    def test_vectors_and_batches(self):
+        tree = linalg.KDTree([Vector2D(0, 0), Vector2D(1, 0), Vector2D(0, 3)])
+        self.assertEqual(tree[2], Vector2D(0, 3))
+        self.assertIs(type(tree[2]), Vector2D)
+        (i, d) = tree.nearest(Vector2D(0.9, 0.1), 2)
+        np.testing.assert_array_equal(i, [1, 0])
+        (i, d) = tree.nearest(Vector2DArray([[0, 2], [1, 1]]), 1)
+        self.assertEqual(i.shape, (2, 1))
+        np.testing.assert_array_equal(i[:, 0], [2, 1])
+        found = tree.within_radius([[0, 0], [5, 5]], 1.0)
+        np.testing.assert_array_equal(found[0], [0, 1])
+        self.assertEqual(len(found[1]), 0)
+        with self.assertRaises(ValueError):
+            tree.nearest(Vector2D(0, 0), 4)
+        with self.assertRaises(ValueError):
+            tree.nearest(Vector3D(0, 0, 0))
+
+    def test_insert_remove_update(self):
+        tree = linalg.KDTree(self.points[:300], leaf_size=4)
+        points = self.points.copy()
+        for i in range(300, 500):
+            self.assertEqual(tree.insert(points[i]), i)
+        rng = np.random.default_rng(1)
+        for i in rng.choice(500, 100, replace=False):
+            points[i] = rng.uniform(-10, 10, 3)
+            tree.update(i, points[i])
+        removed = rng.choice(500, 150, replace=False)
+        for i in removed:
+            tree.remove(i)
+        with self.assertRaises(KeyError):
+            tree.remove(removed[0])
+        with self.assertRaises(KeyError):
+            tree[removed[0]]
+        ids = np.setdiff1d(np.arange(500), removed)
+        self.assertEqual(len(tree), 350)
+        self.assertMatchesBruteForce(tree, points[ids], ids)
+        # and without any rebuilds in between
+        tree = linalg.KDTree(self.points[:300], rebuild_fraction=10)
+        for i in range(300, 500):
+            tree.insert(points[i])
+        for i in range(300):
+            if not np.array_equal(points[i], self.points[i]):
+                tree.update(i, points[i])
+        for i in removed:
+            tree.remove(i)
+        self.assertGreater(len(tree._pending), 0)
+        self.assertMatchesBruteForce(tree, points[ids], ids)
+
+
+class TestVectorStats(unittest.TestCase):
+
+    def setUp(self):
+        self.X = np.random.default_rng(0).normal(5, 2, (2000, 3))
+
+    def assertMatches(self, stats, X):
+        norms = np.linalg.norm(X, axis=1)
+        self.assertEqual(stats.count, len(X))
+        np.testing.assert_allclose(stats.mean, X.mean(axis=0))
+        np.testing.assert_allclose(stats.variance(), X.var(axis=0))
+        np.testing.assert_allclose(stats.std(ddof=1), X.std(axis=0, ddof=1))
+        np.testing.assert_allclose(stats.covariance(ddof=1), np.cov(X.T))
+        np.testing.assert_array_equal(stats.bounds[0], X.min(axis=0))
+        np.testing.assert_array_equal(stats.bounds[1], X.max(axis=0))
+        self.assertAlmostEqual(stats.norm_mean, norms.mean())
+        self.assertAlmostEqual(stats.norm_variance(), norms.var())
+        self.assertEqual(stats.norm_range, (norms.min(), norms.max()))
+
+    def test_add(self):
+        stats = linalg.VectorStats(covariance=True)
+        for x in self.X:
+            stats.add(Vector3D(x))
+        self.assertMatches(stats, self.X)
+        self.assertIs(type(stats.mean), Vector3D)
+        self.assertIs(type(stats.bounds[0]), Vector3D)
+        self.assertIsInstance(stats.covariance(), Matrix)
+
+    def test_batches(self):
+        stats = linalg.VectorStats(covariance=True)
+        stats.add_batch(Vector3DArray(self.X[:700]))
+        stats.add_batch(self.X[700:1000])
+        stats.add_batch([Vector3D(x) for x in self.X[1000:1010]])
+        stats.add_batch(np.empty((0, 3)))
+        for x in self.X[1010:]:
+            stats.add(x.tolist())
+        self.assertMatches(stats, self.X)
+
+    def test_merge(self):
+        parts = [linalg.VectorStats(covariance=True) for _ in range(4)]
+        for (stats, part) in zip(parts, np.array_split(self.X, [1, 300, 1500])):
+            stats.add_batch(part[:len(part) // 2])
+            for x in part[len(part) // 2:]:
+                stats.add(Vector3D(x))
+        # e.g. sent back from worker processes
+        parts = [pickle.loads(pickle.dumps(p)) for p in parts]
+        merged = linalg.VectorStats(covariance=True)
+        for p in parts:
+            merged.merge(p)
+        merged.merge(linalg.VectorStats())
+        self.assertMatches(merged, self.X)
+        self.assertIs(type(merged.mean), Vector3D)
+
+    def test_stability(self):
+        # the naive sum of squares loses all digits of this variance
+        X = 1e9 + np.random.default_rng(1).normal(0, 1e-3, (5000, 2))
+        stats = linalg.VectorStats()
+        for x in X:
+            stats.add(x)
+        np.testing.assert_allclose(stats.variance(), X.var(axis=0), rtol=1e-4)
+
+    def test_backends(self):
+        stats = linalg.VectorStats()
+        stats.add(Vector([1, 2], backend='python'))
+        stats.add(Vector([3, 6]))
+        self.assertEqual(stats.mean, [2, 4])
+        self.assertEqual(stats.variance(), [1, 4])
+
+    def test_errors(self):
+        stats = linalg.VectorStats()
+        with self.assertRaises(ValueError):
+            stats.mean
+        stats.add([1, 2, 3])
+        with self.assertRaises(ValueError):
+            stats.variance(ddof=1)
+        with self.assertRaises(ValueError):
+            stats.covariance()
+        with self.assertRaises(ValueError):
+            stats.add([1, 2])
+        with self.assertRaises(ValueError):
+            stats.add_batch(np.ones((2, 2)))
+        with self.assertRaises(ValueError):
+            stats.add(CVector([1, 2, 3]))
+        with self.assertRaises(ValueError):
+            linalg.VectorStats(covariance=True).merge(stats)
+        with self.assertRaises(TypeError):
+            stats.merge([1, 2, 3])
+
+
+class TestFastVector2D(unittest.TestCase):
+
+    def setUp(self):
+        self.pairs = [(FastVector2D(x, y), Vector2D(x, y))
+                      for (x, y) in ((3, 4), (-3, 4), (-1, -1), (6, -8), (0, 2))]
+
+    def test_init(self):
+        with self.assertRaises(TypeError):
+            FastVector2D(1, 2, 3)
+        with self.assertRaises(TypeError):
+            FastVector2D([1, 2, 3])
+        with self.assertRaises(ValueError):
+            FastVector2D(3, 'a')
+        v = FastVector2D(Vector2D(3, 4))
+        self.assertEqual(v, [3, 4])
+        self.assertEqual(v, FastVector2D((3, 4)))
+        self.assertEqual(v.to_vector(), Vector2D(3, 4))
+        self.assertEqual(v, Vector2D(3, 4))
+        self.assertFalse(hasattr(v, '__dict__'))
+
+    def test_arithmetic(self):
+        u, w = self.pairs[0]
+        for (v, vector) in self.pairs:
+            self.assertEqual(v + u, vector + w)
+            self.assertEqual(v - u, vector - w)
+            self.assertEqual(v * u, vector * w)
+            self.assertEqual(v / u, vector / w)
+            self.assertEqual(-v, -vector)
+            self.assertEqual(2 * v, 2 * vector)
+            self.assertEqual(v - 1, vector - 1)
+            self.assertEqual(v.dot(u), vector.dot(w))
+            self.assertAlmostEqual(abs(v), abs(vector))
+            self.assertEqual(v.angle(), vector.angle())
+            self.assertAlmostEqual(FastVector2D.angle_between(u, v),
+                                   Vector2D.angle_between(w, vector))
+
+    def test_inplace(self):
+        v = FastVector2D(3, 4)
+        w = v
+        w += FastVector2D(1, 1)
+        w -= 2
+        w *= 2
+        w /= 4
+        self.assertIs(w, v)
+        self.assertEqual(v, [1, 1.5])
+        self.assertEqual(FastVector2D.zero(), [0, 0])
+        with self.assertRaises(TypeError):
+            v *= FastVector2D(1, 1)
+
+    def test_create_from_angle(self):
+        v = FastVector2D.create_from_angle(math.pi/6, 2)
+        self.assertAlmostEqual(v.X, math.sqrt(3))
+        self.assertAlmostEqual(v.Y, 1)
+
+
+class TestFastVector3D(unittest.TestCase):
+
+    def setUp(self):
+        self.pairs = [(FastVector3D(x, y, z), Vector3D(x, y, z))
+                      for (x, y, z) in ((2, 3, 4), (2, -3, 4), (-2, -1, -1),
+                                        (-4, 6, -8), (0, 2, 0))]
+
+    def test_arithmetic(self):
+        u, w = self.pairs[0]
+        for (v, vector) in self.pairs:
+            self.assertEqual(v + u, vector + w)
+            self.assertEqual(v - u, vector - w)
+            self.assertEqual(v * 2, vector * 2)
+            self.assertEqual(v / 2, vector / 2)
+            self.assertEqual(v.cross(u), vector.cross(w))
+            self.assertEqual(v.dot(u), vector.dot(w))
+            self.assertAlmostEqual(abs(v), abs(vector))
+            self.assertEqual(v.copy(), v)
+        with self.assertRaises(TypeError):
+            u.cross(w)
+
+    def test_coordinates(self):
+        for (v, vector) in self.pairs:
+            np.testing.assert_allclose(v.getSphericalCoords(),
+                                       vector.getSphericalCoords())
+            np.testing.assert_allclose(v.getCylindricalCoords(),
+                                       vector.getCylindricalCoords())
+        v = FastVector3D.createSpherical(2, math.pi/2, math.pi/2)
+        np.testing.assert_allclose(list(v), [0, 2, 0], atol=1e-15)
+        v = FastVector3D.createCylindrical(2, math.pi/2, 1)
+        np.testing.assert_allclose(list(v), [0, 2, 1], atol=1e-15)
+        self.assertEqual(FastVector3D(1, 2, 3).to_vector(), Vector3D(1, 2, 3))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,297 @@
+from rpn import execOp, evaluate, tokenize, isOp
+import rpn
+import unittest
+import io
+import os
+import random
+import subprocess
+import sys
+import numpy as np
+from linalg import Vector, Vector3D
+
+class TestEvaluate(unittest.TestCase):
+
+    def test_operators(self):
+        self.assertEqual(evaluate('1 2 +'.split()), 3)
+        self.assertEqual(evaluate('5 2 -'.split()), 3)
+        self.assertEqual(evaluate('3 4 x'.split()), 12)
+        self.assertEqual(evaluate('3 4 /'.split()), 0.75)
+        self.assertEqual(evaluate('7 2 //'.split()), 3)
+
+    def test_operator_applies_to_whole_stack(self):
+        self.assertEqual(evaluate('1 2 3 +'.split()), 6)
+        self.assertEqual(evaluate('10 2 3 -'.split()), 5)
+        self.assertEqual(evaluate('1 2 + 4 x'.split()), 12)
+        self.assertEqual(evaluate('1 2 + 3 4 x'.split()), 36)
+        self.assertEqual(evaluate('1.5 -2.5 +'.split()), -1)
+
+    def test_single_value(self):
+        self.assertEqual(evaluate(['5']), 5)
+
+    def test_errors(self):
+        with self.assertRaises(TypeError):
+            evaluate('1 2 ^'.split())
+        with self.assertRaises(TypeError):
+            evaluate('1 +'.split())
+        with self.assertRaises(ValueError):
+            evaluate('1 2 + 3'.split())
+        with self.assertRaises(ValueError):
+            evaluate([])
+        with self.assertRaises(ZeroDivisionError):
+            evaluate('1 0 /'.split())
+
+    def test_stream(self):
+        stream = io.StringIO('1 2\n+ 3\n\nx\n')
+        self.assertEqual(evaluate(tokenize(stream)), 9)
+
+        def tokens(n):
+            yield '0'
+            for i in range(n):
+                yield '1'
+                yield '+'
+        self.assertEqual(evaluate(tokens(100000)), 100000)
+
+    def test_matches_execOp(self):
+        for op in ('+', '-', 'x', '/', '//'):
+            self.assertEqual(evaluate(['7', '2', '3', op]), execOp(op, 7.0, 2.0, 3.0))
+
+    def test_fused_chains(self):
+        self.assertEqual(evaluate('1 2 + 3 + 4 +'.split()), 10)
+        self.assertEqual(evaluate('1 2 + 3 4 + 5 x 2 x'.split()), 100)
+        self.assertEqual(evaluate('100 2 / 5 / 3 //'.split()), 3)
+        self.assertEqual(evaluate('10 2 - 3 -'.split()), 5)
+        self.assertEqual(evaluate(['1'] + ['1', '+'] * 1000), 1001)
+        with self.assertRaises(TypeError):
+            evaluate('1 2 + +'.split())
+        with self.assertRaises(ZeroDivisionError):
+            evaluate('1 0 / 2 / 3'.split())
+        with self.assertRaisesRegex(ValueError, '2 values'):
+            evaluate('1 2 + 3 + 4'.split())
+
+    def test_fused_is_exact(self):
+        def stepwise(tokens):
+            stack = []
+            for token in tokens:
+                if isOp(token):
+                    stack = [execOp(token, *stack)]
+                else:
+                    stack.append(float(token))
+            return stack[0]
+
+        rng = random.Random(0)
+        for _ in range(200):
+            tokens = [repr(rng.uniform(-10, 10)) for _ in range(rng.randint(2, 3))]
+            op = rng.choice(['+', '-', 'x', '/', '//'])
+            for _ in range(rng.randint(1, 300)):
+                tokens.append(op)
+                op = rng.choice([op] * 5 + ['+', '-', 'x', '/', '//'])
+                tokens += [repr(rng.uniform(0.5, 2)) for _ in range(rng.randint(1, 2))]
+            tokens.append(op)
+            self.assertEqual(repr(evaluate(tokens)), repr(stepwise(tokens)))
+            self.assertEqual(repr(rpn.compile(' '.join(tokens))()),
+                             repr(stepwise(tokens)))
+
+
+class TestCompile(unittest.TestCase):
+
+    def test_variables(self):
+        program = rpn.compile('a b + c x')
+        self.assertEqual(program.variables, ['a', 'b', 'c'])
+        self.assertEqual(program(a=1, b=2, c=3), 9)
+        self.assertEqual(program(a=-1, b=0.5, c=4), -2)
+        self.assertEqual(rpn.compile('a a x 2 /')(a=3), 4.5)
+        self.assertEqual(rpn.compile('4')(), 4)
+        self.assertEqual(rpn.compile('inf a +').variables, ['a'])
+
+    def test_matches_evaluate(self):
+        for expr in ('1 2 3 +', '10 2 3 -', '1 2 + 3 4 x', '7 2 3 /',
+                     '17 2 3 //', '-0.0 0.0 -', '1.5 -2.5 + 4 //'):
+            self.assertEqual(rpn.compile(expr)(), evaluate(expr.split()))
+
+    def test_matches_evaluate_random(self):
+        rng = random.Random(0)
+        for _ in range(500):
+            values = {v: rng.uniform(-1e3, 1e3) for v in 'abcd'}
+            tokens = []
+            for step in range(rng.randint(1, 5)):
+                tokens += [rng.choice(['a', 'b', 'c', 'd', '0.1', '-2.7'])
+                           for _ in range(rng.randint(1 if tokens else 2, 6))]
+                tokens.append(rng.choice(['+', '-', 'x', '/']))
+            # variables as literals that parse back to the same floats
+            expected = repr(evaluate([repr(values[t]) if t in values else t
+                                      for t in tokens]))
+            for optimize in (False, True):
+                program = rpn.Program(' '.join(tokens), optimize)
+                inputs = {k: values[k] for k in program.variables}
+                self.assertEqual(repr(program(**inputs)), expected,
+                                 ' '.join(tokens))
+
+    def test_long_expression(self):
+        expr = ' '.join(['0'] + ['a +'] * 10000)
+        self.assertEqual(rpn.compile(expr)(a=1), 10000)
+
+    def test_cache(self):
+        self.assertIs(rpn.compile('a 1 +'), rpn.compile('a 1 +'))
+        self.assertIsNot(rpn.compile('a 1 +'), rpn.compile('a 1 +', False))
+
+    def test_folding(self):
+        program = rpn.compile('2 3 x 4 + a + 1 2 3 -')
+        steps = [(op, [program._constants.get(a, a) for a in args])
+                 for (op, args) in program._steps]
+        self.assertEqual(steps, [('+', [10, 'a']), ('-', ['_t0', 6])])
+        self.assertEqual(sorted(program._constants.values()), [6, 10])
+        self.assertEqual(program.stats, {
+            'literals': 6, 'constants': 2, 'steps': 4, 'operations': 6,
+            'fusedSteps': 1, 'foldedSteps': 1, 'foldedOperations': 4})
+        self.assertEqual(program(a=1), 5)
+        self.assertEqual(rpn.compile('2 3 + 4 x')(), 20)
+        self.assertEqual(rpn.compile('2 2 2 a x').stats['constants'], 1)
+        # not folded: the error is raised when called, as without folding
+        program = rpn.compile('1 0 / a +')
+        self.assertEqual(program.stats['foldedOperations'], 0)
+        with self.assertRaises(ZeroDivisionError):
+            program(a=1)
+
+    def test_folding_is_exact(self):
+        rng = random.Random(0)
+        literals = ['0.1', '-0.0', '0.0', '3', '-7.5', '1e308', 'inf', '1e-300']
+        for _ in range(500):
+            tokens = []
+            for step in range(rng.randint(1, 6)):
+                tokens += [rng.choice(literals + ['a', 'b'])
+                           for _ in range(rng.randint(1 if tokens else 2, 4))]
+                tokens.append(rng.choice(['+', '-', 'x', '/', '//']))
+            values = {'a': rng.uniform(-5, 5), 'b': rng.choice([-0.0, 2.5])}
+            expected = []
+            for optimize in (False, True):
+                program = rpn.Program(' '.join(tokens), optimize)
+                inputs = {k: values[k] for k in program.variables}
+                try:
+                    expected.append(repr(program(**inputs)))
+                except (ZeroDivisionError, TypeError) as e:
+                    expected.append(type(e))
+            self.assertEqual(expected[0], expected[1], ' '.join(tokens))
+
+    def test_folding_float_sums(self):
+        self.assertEqual(repr(rpn.Program('0.1 0.2 0.3 + a x')(a=1.0)),
+                         repr(rpn.Program('0.1 0.2 0.3 + a x', False)(a=1.0)))
+        rng = random.Random(1)
+        for _ in range(300):
+            literals = [repr(rng.uniform(-1, 1) * 10 ** rng.randint(-3, 3))
+                        for _ in range(rng.randint(2, 8))]
+            for op in ('+', '-'):
+                expr = ' '.join(['a'] * (op == '-') + literals + ['b', op])
+                results = []
+                for optimize in (False, True):
+                    program = rpn.Program(expr, optimize)
+                    inputs = {k: {'a': 0.7, 'b': 0.3}[k]
+                              for k in program.variables}
+                    results.append(repr(program(**inputs)))
+                self.assertEqual(results[0], results[1], expr)
+
+    def test_errors(self):
+        with self.assertRaises(TypeError):
+            rpn.compile('a 2 ^')
+        with self.assertRaises(TypeError):
+            rpn.compile('a +')
+        with self.assertRaises(TypeError):
+            rpn.compile('_t0 1 +')
+        with self.assertRaises(TypeError):
+            rpn.compile('a import +')
+        with self.assertRaises(ValueError):
+            rpn.compile('a b + c')
+        with self.assertRaises(TypeError):
+            rpn.compile('a b +')(a=1)
+        with self.assertRaises(ZeroDivisionError):
+            rpn.compile('a 0 /')(a=1)
+
+
+class TestCompileArrays(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.a = rng.uniform(-10, 10, 1000)
+        self.b = rng.uniform(1, 10, 1000)
+        self.c = rng.uniform(-10, -1, 1000)
+
+    def assertMatchesScalar(self, expr, **arrays):
+        program = rpn.compile(expr)
+        arrays = {k: arrays[k] for k in program.variables}
+        inputs = {k: v.copy() for (k, v) in arrays.items()}
+        actual = program(**arrays)
+        expected = [program(**{k: float(v[i]) for (k, v) in arrays.items()})
+                    for i in range(1000)]
+        np.testing.assert_array_equal(actual, expected)
+        for (k, v) in arrays.items(): # inputs are never overwritten
+            np.testing.assert_array_equal(v, inputs[k])
+
+    def test_matches_scalar(self):
+        for expr in ('a b +', 'a b c +', 'a b c -', 'a b -', 'a b c x',
+                     'a b /', 'a b c /', 'a b //', 'a b + c x 2 /',
+                     'a 2 + b - c 3 //', 'a b + c - 2 a b -',
+                     '2 3 x a + 1 2 b -', '4 2 / 3 a x'):
+            self.assertMatchesScalar(expr, a=self.a, b=self.b, c=self.c)
+
+    def test_broadcast(self):
+        program = rpn.compile('a b + c x')
+        np.testing.assert_array_equal(program(a=self.a, b=2.0, c=3),
+                                      (self.a + 2.0) * 3)
+        self.assertEqual(program(a=np.arange(6).reshape(2, 3), b=1, c=2).shape,
+                         (2, 3))
+        # steps on constants only give scalars
+        np.testing.assert_array_equal(
+            rpn.Program('2 3 + 4 x a +', False)(a=self.a), 20 + self.a)
+        # integer arrays are promoted when needed
+        np.testing.assert_array_equal(
+            rpn.compile('a 2 /')(a=np.arange(4)), [0, 0.5, 1, 1.5])
+
+    def test_vectors(self):
+        program = rpn.compile('a b + 2 x')
+        actual = program(a=Vector3D(1, 2, 3), b=np.ones(3))
+        self.assertIs(type(actual), Vector3D)
+        self.assertEqual(actual, Vector3D(4, 6, 8))
+        actual = program(a=Vector(range(4)), b=1.0)
+        self.assertEqual(actual, [2, 4, 6, 8])
+
+    def test_errors(self):
+        with self.assertRaises(TypeError):
+            rpn.compile('a b +')(a=self.a)
+        with self.assertRaises(TypeError):
+            rpn.compile('a b +')(a=self.a, b=1, c=2)
+
+
+class TestBatch(unittest.TestCase):
+
+    lines = ['1 2 +', '', '1 0 /', '3 x', '10 2 3 -', '2 ^', '1 2']
+    expected = ['3.0', '', 'error: float division by zero',
+                'error: x operation needs at least 2 arguments! 1 given.',
+                '5.0', 'error: Invalid operator: ^',
+                'error: Incomplete expression: 2 values left without an operator']
+
+    def test_evaluateLines(self):
+        for (workers, chunkSize) in ((0, 1000), (0, 2), (2, 3)):
+            out = io.StringIO()
+            counts = rpn.evaluateLines(iter(self.lines * 5), out, workers,
+                                       chunkSize)
+            self.assertEqual(out.getvalue().splitlines(), self.expected * 5)
+            self.assertEqual(counts, (35, 20))
+
+    def test_cli(self):
+        python = os.path.dirname(os.path.abspath(rpn.__file__))
+        text = '\n'.join(self.lines) + '\n'
+        for args in (['--batch'], ['--file', '-', '--workers', '2',
+                                   '--chunk-size', '2']):
+            result = subprocess.run([sys.executable, 'rpn.py'] + args,
+                                    input=text, capture_output=True,
+                                    text=True, cwd=python, check=True)
+            self.assertEqual(result.stdout.splitlines(), self.expected)
+            self.assertIn('7 lines, 4 errors', result.stderr)
+        # without options piped input is still one expression
+        result = subprocess.run([sys.executable, 'rpn.py'], input='1 2\n+\n',
+                                capture_output=True, text=True, cwd=python,
+                                check=True)
+        self.assertEqual(result.stdout, '3.0\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
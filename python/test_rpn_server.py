@@ -0,0 +1,105 @@
+from rpn_server import Server, load, randomExpressions
+import rpn
+import unittest
+import asyncio
+import json
+import os
+import socket
+import tempfile
+
+class TestServer(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.server = Server(batchSize=64)
+        (self.host, self.port) = await self.server.start()
+
+    async def asyncTearDown(self):
+        await self.server.close()
+
+    async def request(self, lines):
+        (reader, writer) = await asyncio.open_connection(self.host, self.port)
+        # pipelined: everything is sent before reading any response
+        writer.write(''.join(line + '\n' for line in lines).encode())
+        await writer.drain()
+        responses = [(await reader.readline()).decode().rstrip('\n')
+                     for _ in lines]
+        writer.close()
+        await writer.wait_closed()
+        return responses
+
+    async def test_pipelined(self):
+        lines = ['1 2 +', '1 0 /', '10  2 3 -', '1 2 ^', '', '1 2 + 4 x'] * 50
+        responses = await self.request(lines)
+        self.assertEqual(responses, [rpn.evaluateLine(l) for l in lines])
+        self.assertEqual(responses[:5], ['3.0', 'error: float division by zero',
+                                         '5.0', 'error: Invalid operator: ^',
+                                         ''])
+
+    async def test_batching_and_cache(self):
+        lines = randomExpressions(2000, 100)
+        (responses, latencies) = await load(lines, self.host, self.port,
+                                            connections=4, pipeline=32)
+        self.assertEqual(responses, [rpn.evaluateLine(l) for l in lines])
+        self.assertTrue(all(t >= 0 for t in latencies))
+        stats = self.server.stats()
+        self.assertEqual(stats['requests'], 2000)
+        self.assertEqual(stats['connections'], 4)
+        self.assertLessEqual(stats['evaluated'], 100)
+        self.assertEqual(stats['evaluated'] + stats['cacheHits'], 2000)
+        self.assertGreater(stats['meanBatch'], 1)
+        self.assertGreater(stats['throughput'], 0)
+
+    async def test_cache_size(self):
+        self.server.cacheSize = 10
+        lines = [f'{i} 1 +' for i in range(100)]
+        await self.request(lines + lines[-5:])
+        self.assertEqual(len(self.server._cache), 10)
+        self.assertEqual(self.server.stats()['cacheHits'], 5)
+
+    async def test_stats(self):
+        await self.request(['1 2 +', '1 2 +'])
+        (response,) = await self.request(['STATS'])
+        stats = json.loads(response)
+        self.assertEqual(stats['requests'], 2)
+        self.assertEqual(stats['cacheHits'], 1)
+        self.assertIsNotNone(stats['latencyP99'])
+
+    async def test_line_too_long(self):
+        (reader, writer) = await asyncio.open_connection(self.host, self.port)
+        writer.write(b'1 2 +\n' + b'1 ' * 40000 + b'+\n3 4 +\n')
+        await writer.drain()
+        self.assertEqual(await reader.readline(), b'3.0\n')
+        self.assertEqual(await reader.readline(), b'error: line too long\n')
+        # the connection is closed, without answering what follows
+        self.assertEqual(await reader.read(), b'')
+        writer.close()
+        await writer.wait_closed()
+        self.assertEqual(await self.request(['3 4 +']), ['7.0'])
+
+    async def test_close_with_open_connections(self):
+        (reader, writer) = await asyncio.open_connection(self.host, self.port)
+        writer.write(b'1 2 +\n')
+        self.assertEqual(await reader.readline(), b'3.0\n')
+        # the client stays connected
+        await asyncio.wait_for(self.server.close(), 5)
+        self.assertEqual(await reader.read(), b'')
+        writer.close()
+        self.server = Server()
+        await self.server.start()
+
+    @unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'needs Unix sockets')
+    async def test_unix_socket(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'rpn.sock')
+            server = Server()
+            await server.start(path=path)
+            try:
+                (responses, _) = await load(['1 2 +', '3 4 x'], path=path,
+                                            connections=2)
+            finally:
+                await server.close()
+        self.assertEqual(responses, ['3.0', '12.0'])
+
+
+if __name__ == '__main__':
+    unittest.main()